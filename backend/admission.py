@@ -0,0 +1,220 @@
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass
+from collections import defaultdict
+from fastapi import HTTPException, Request
+import math
+import os
+import time
+
+from serialization import FastJSONResponse
+
+# Admission control for the expensive AI endpoints:
+#   1. token bucket per user (X-User-Id header) and per client IP
+#   2. global in-flight cap per endpoint
+# Anything over a limit is rejected immediately with 429 + Retry-After rather
+# than queued. A request only spends tokens when every check passes, so shed
+# requests cost nothing. Buckets are in-process unless RATE_LIMIT_REDIS_URL is set.
+# AdmissionMiddleware runs this before the (multipart) body is read.
+
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "")
+TRUST_PROXY = os.getenv("ADMISSION_TRUST_PROXY", "") == "1"
+USER_HEADER = "x-user-id"
+
+
+@dataclass(frozen=True)
+class EndpointPolicy:
+    user_rate: float      # tokens/second per user
+    user_burst: int
+    ip_rate: float        # tokens/second per IP (classrooms share one NAT, so looser)
+    ip_burst: int
+    max_concurrency: int  # in-flight requests across all clients
+
+
+def _policy(name: str, default: EndpointPolicy) -> EndpointPolicy:
+    """Allow ADMISSION_<NAME>_<FIELD> env overrides, e.g. ADMISSION_COMBAT_VOICE_MAX_CONCURRENCY=64"""
+    prefix = "ADMISSION_" + name.upper().replace("-", "_") + "_"
+    overrides = {}
+    for field, current in default.__dict__.items():
+        raw = os.getenv(prefix + field.upper())
+        if raw:
+            overrides[field] = type(current)(raw)
+    return EndpointPolicy(**{**default.__dict__, **overrides})
+
+
+POLICIES: Dict[str, EndpointPolicy] = {
+    "analyze-speech": _policy("analyze-speech", EndpointPolicy(user_rate=1 / 10, user_burst=3, ip_rate=1.0, ip_burst=30, max_concurrency=16)),
+    "combat-voice": _policy("combat-voice", EndpointPolicy(user_rate=1.0, user_burst=5, ip_rate=10.0, ip_burst=60, max_concurrency=64)),
+    "refine-content": _policy("refine-content", EndpointPolicy(user_rate=1 / 60, user_burst=2, ip_rate=1 / 6, ip_burst=10, max_concurrency=4)),
+}
+
+
+class MemoryBucketStore:
+    """Token buckets held in this process: key -> (tokens, last_refill)"""
+
+    # Sweep idle buckets once the table grows past this many keys
+    SWEEP_THRESHOLD = 50_000
+
+    def __init__(self):
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+
+    async def take_all(self, requests: List[Tuple[str, float, int]]) -> Tuple[int, float]:
+        """
+        Consume one token from each (key, rate, burst) bucket, or from none.
+        Returns (-1, 0) when admitted, else (index of the first empty bucket, seconds until it refills).
+        """
+        now = time.monotonic()
+        refilled = []
+        for i, (key, rate, burst) in enumerate(requests):
+            tokens, last = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens < 1:
+                return i, (1 - tokens) / rate
+            refilled.append(tokens)
+        for (key, _, _), tokens in zip(requests, refilled):
+            self.buckets[key] = (tokens - 1, now)
+        if len(self.buckets) > self.SWEEP_THRESHOLD:
+            self._sweep(now)
+        return -1, 0.0
+
+    def _sweep(self, now: float):
+        # A bucket that has been idle long enough to refill completely carries no state
+        idle = max(max(p.user_burst / p.user_rate, p.ip_burst / p.ip_rate) for p in POLICIES.values())
+        self.buckets = {k: v for k, v in self.buckets.items() if now - v[1] < idle}
+
+
+class RedisBucketStore:
+    """Shared buckets for multi-worker deployments (needs the optional `redis` package)"""
+
+    # All-or-nothing across KEYS; ARGV = now, then (rate, burst) per key. Returns "index:wait".
+    _SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local refilled = {}
+    for i, key in ipairs(KEYS) do
+        local rate = tonumber(ARGV[2 * i])
+        local burst = tonumber(ARGV[2 * i + 1])
+        local tokens = tonumber(redis.call('HGET', key, 't') or burst)
+        local last = tonumber(redis.call('HGET', key, 'ts') or now)
+        tokens = math.min(burst, tokens + math.max(0, now - last) * rate)
+        if tokens < 1 then return tostring(i - 1) .. ':' .. tostring((1 - tokens) / rate) end
+        refilled[i] = tokens
+    end
+    for i, key in ipairs(KEYS) do
+        local rate = tonumber(ARGV[2 * i])
+        local burst = tonumber(ARGV[2 * i + 1])
+        redis.call('HSET', key, 't', refilled[i] - 1, 'ts', now)
+        redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+    end
+    return '-1:0'
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+        self.script = self.client.register_script(self._SCRIPT)
+
+    async def take_all(self, requests: List[Tuple[str, float, int]]) -> Tuple[int, float]:
+        args = [time.time()]
+        for _, rate, burst in requests:
+            args += [rate, burst]
+        result = await self.script(keys=[f"synapse:rl:{key}" for key, _, _ in requests], args=args)
+        index, wait = (result.decode() if isinstance(result, bytes) else result).split(":")
+        return int(index), float(wait)
+
+
+class AdmissionController:
+    def __init__(self, store=None):
+        self.store = store or MemoryBucketStore()
+        self.in_flight: Dict[str, int] = defaultdict(int)
+        # (endpoint, outcome) -> count; outcome is admitted | user_rate | ip_rate | concurrency
+        self.counters: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    def _reject(self, endpoint: str, reason: str, retry_after: float):
+        self.counters[(endpoint, reason)] += 1
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many requests ({reason}). Try again shortly.",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    async def acquire(self, endpoint: str, user_id: Optional[str], ip: Optional[str]):
+        policy = POLICIES[endpoint]
+        if self.in_flight[endpoint] >= policy.max_concurrency:
+            self._reject(endpoint, "concurrency", 1)
+        # Hold the slot while the buckets are consulted; give it back if they refuse
+        self.in_flight[endpoint] += 1
+        buckets, reasons = [], []
+        if user_id:
+            buckets.append((f"{endpoint}:u:{user_id}", policy.user_rate, policy.user_burst))
+            reasons.append("user_rate")
+        if ip:
+            buckets.append((f"{endpoint}:ip:{ip}", policy.ip_rate, policy.ip_burst))
+            reasons.append("ip_rate")
+        try:
+            failed, wait = await self.store.take_all(buckets) if buckets else (-1, 0.0)
+        except BaseException:
+            self.in_flight[endpoint] -= 1
+            raise
+        if failed >= 0:
+            self.in_flight[endpoint] -= 1
+            self._reject(endpoint, reasons[failed], wait)
+        self.counters[(endpoint, "admitted")] += 1
+
+    def release(self, endpoint: str):
+        self.in_flight[endpoint] -= 1
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        out: Dict[str, Dict[str, int]] = {}
+        for endpoint in POLICIES:
+            row = {outcome: count for (ep, outcome), count in self.counters.items() if ep == endpoint}
+            row["in_flight"] = self.in_flight[endpoint]
+            out[endpoint] = row
+        return out
+
+
+admission = AdmissionController(RedisBucketStore(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL else None)
+
+
+# Request path -> admission endpoint (the multipart AI routes)
+ADMISSION_ROUTES: Dict[str, str] = {
+    "/api/analyze-speech": "analyze-speech",
+    "/api/combat-voice": "combat-voice",
+    "/api/refine-content": "refine-content",
+}
+
+
+def client_ip(request: Request) -> Optional[str]:
+    if TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware: admits ADMISSION_ROUTES requests before their body is
+    read, so shed uploads are rejected without parsing them. Holds one
+    concurrency slot until the response is sent.
+    """
+
+    def __init__(self, app, routes: Optional[Dict[str, str]] = None):
+        self.app = app
+        self.routes = ADMISSION_ROUTES if routes is None else routes
+
+    async def __call__(self, scope, receive, send):
+        endpoint = self.routes.get(scope.get("path")) if scope["type"] == "http" else None
+        if endpoint is None or scope.get("method") == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        try:
+            await admission.acquire(endpoint, request.headers.get(USER_HEADER), client_ip(request))
+        except HTTPException as e:
+            response = FastJSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.release(endpoint)
+
@@ -0,0 +1,529 @@
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+import asyncio
+import os
+import time
+import numpy as np
+
+from enemy_registry import ENEMIES, classify_error_type
+from logging_setup import get_logger
+
+log = get_logger("synapse.analysis_store")
+
+# Persisted analysis results for cohort analytics.
+#   - On disk: append-only file of fixed-width records (RECORD_DTYPE, 24 bytes
+#     with the five launch archetypes), plus a "<path>.regions" sidecar mapping
+#     region codes to names and a "<path>.archetypes" sidecar naming the error
+#     columns the records were written with. When the enemy roster gains an
+#     archetype, the file is rewritten one column wider at load.
+#   - In memory: one contiguous NumPy array per field (columnar), grown by doubling.
+#   - Cohort stats come from value histograms (np.bincount), so percentiles and
+#     means are exact and rollups are additive: a cached cohort only folds in
+#     the rows appended since it was last read.
+#   - Per-user history: a (user, time) index (row positions sorted by user id, in
+#     append order within a user). New rows sit in an unsorted tail that is
+#     scanned directly and merged into the index once it grows past INDEX_TAIL_MAX.
+#   - Appends are queued and written by a worker thread (one at a time, regions
+#     before the records that use them), so request handlers never block on disk.
+
+ANALYSIS_STORE_PATH = os.getenv("ANALYSIS_STORE_PATH", "./analyses.bin")
+ROLLUP_CACHE_SIZE = int(os.getenv("ANALYTICS_ROLLUP_CACHE_SIZE", "256"))
+INDEX_TAIL_MAX = int(os.getenv("ANALYTICS_INDEX_TAIL_MAX", "4096"))
+
+# Both are part of the on-disk format: only ever append (to the roster in data/enemies.json for archetypes)
+GAP_AXES = ("vocabulary", "syntax", "phonetics", "coherence")
+ERROR_ARCHETYPES = tuple(ENEMIES)
+# Columns of files written before the archetypes sidecar existed
+LEGACY_ERROR_ARCHETYPES = ("Tense", "Article", "Subject-Verb", "Vocabulary", "Pronunciation")
+
+PERCENTILES = (10, 25, 50, 75, 90)
+GAP_LEVELS = 101  # gap scores are stored as whole points 0..100
+BAND_LEVELS = 91  # bandEstimate is stored in tenths 0.0..9.0
+NO_ID = -1
+NO_REGION = 0xFFFF
+
+
+def record_dtype(archetypes: int) -> np.dtype:
+    return np.dtype([
+        ("ts", "<u4"),        # unix seconds
+        ("user_id", "<i4"),   # NO_ID for anonymous requests
+        ("clan_id", "<i4"),   # NO_ID when the user has no clan
+        ("region", "<u2"),    # index into the regions sidecar
+        ("band", "u1"),       # bandEstimate * 10
+        ("gap", "u1", (len(GAP_AXES),)),
+        ("errors", "u1", (archetypes,)),  # error count per archetype
+    ])
+
+
+RECORD_DTYPE = record_dtype(len(ERROR_ARCHETYPES))
+
+_ERROR_INDEX = {key: i for i, key in enumerate(ERROR_ARCHETYPES)}
+_SCALAR_FIELDS = ("ts", "user_id", "clan_id", "region", "band")
+
+
+def encode_analysis(band: float, gap_graph: Dict[str, float], errors: List[Dict]) -> Tuple[int, List[int], List[int]]:
+    """Quantize one AnalysisResult into (band tenths, gap points, error counts)"""
+    band_code = int(round(min(max(float(band or 0), 0.0), 9.0) * 10))
+    gap = [int(round(min(max(float((gap_graph or {}).get(axis, 0) or 0), 0.0), 100.0))) for axis in GAP_AXES]
+    counts = [0] * len(ERROR_ARCHETYPES)
+    for error in errors or []:
+        idx = _ERROR_INDEX.get(classify_error_type((error or {}).get("type", "") or ""))
+        if idx is not None and counts[idx] < 255:
+            counts[idx] += 1
+    return band_code, gap, counts
+
+
+class Cohort:
+    """Filter over stored analyses; None means 'any'. Hashable so it can key the rollup cache."""
+    __slots__ = ("region", "clan_id", "since", "until")
+
+    def __init__(self, region: Optional[str] = None, clan_id: Optional[int] = None,
+                 since: Optional[int] = None, until: Optional[int] = None):
+        self.region = region
+        self.clan_id = clan_id
+        self.since = since
+        self.until = until
+
+    def key(self) -> tuple:
+        return (self.region, self.clan_id, self.since, self.until)
+
+    def describe(self) -> Dict:
+        return {"region": self.region, "clan_id": self.clan_id, "since": self.since, "until": self.until}
+
+
+class Rollup:
+    """Additive cohort summary: value histograms over every row folded in so far"""
+    __slots__ = ("rows", "band", "gap", "errors", "with_errors")
+
+    def __init__(self):
+        self.rows = 0  # store rows [0, rows) have been folded
+        self.band = np.zeros(BAND_LEVELS, dtype=np.int64)
+        self.gap = np.zeros((len(GAP_AXES), GAP_LEVELS), dtype=np.int64)
+        self.errors = np.zeros(len(ERROR_ARCHETYPES), dtype=np.int64)
+        self.with_errors = np.zeros(len(ERROR_ARCHETYPES), dtype=np.int64)  # analyses showing each archetype
+
+    @property
+    def count(self) -> int:
+        return int(self.band.sum())
+
+
+def _percentiles(counts: np.ndarray, scale: float = 1.0) -> Dict[str, Optional[float]]:
+    """Nearest-rank percentiles straight from a value histogram"""
+    n = int(counts.sum())
+    if n == 0:
+        return {f"p{q}": None for q in PERCENTILES}
+    cumulative = np.cumsum(counts)
+    ranks = np.maximum(np.ceil(np.array(PERCENTILES) / 100.0 * n), 1)
+    values = np.searchsorted(cumulative, ranks) * scale
+    return {f"p{q}": round(float(v), 2) for q, v in zip(PERCENTILES, values)}
+
+
+def _mean(counts: np.ndarray, scale: float = 1.0) -> Optional[float]:
+    n = counts.sum()
+    if n == 0:
+        return None
+    return round(float(np.dot(np.arange(counts.size), counts) / n * scale), 2)
+
+
+class AnalysisStore:
+    def __init__(self, path: Optional[str] = ANALYSIS_STORE_PATH, cache_size: int = ROLLUP_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self.size = 0
+        self._columns: Dict[str, np.ndarray] = {}
+        self._allocate(1024)
+        self.regions: List[str] = []
+        self._region_codes: Dict[str, int] = {}
+        self._rollups: "OrderedDict[tuple, Rollup]" = OrderedDict()
+        self._pending_regions: List[str] = []
+        self._pending_rows: List[bytes] = []
+        self._write_task: Optional[asyncio.Task] = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # (user, time) index over rows [0, _indexed)
+        self._indexed = 0
+        self._index_rows = np.zeros(0, dtype=np.int64)
+        self._index_users = np.zeros(0, dtype=np.int32)
+        if path and (os.path.exists(path) or os.path.exists(self._backup_path)):
+            self._load()
+        elif path:
+            self._write_archetypes()
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def capacity(self) -> int:
+        return self._columns["ts"].shape[0]
+
+    def _allocate(self, capacity: int):
+        old, n = self._columns, self.size
+        columns = {field: np.zeros(capacity, dtype=RECORD_DTYPE[field].base) for field in _SCALAR_FIELDS}
+        # Axis-major so each gap axis / error archetype is one contiguous column
+        columns["gap"] = np.zeros((len(GAP_AXES), capacity), dtype=np.uint8)
+        columns["errors"] = np.zeros((len(ERROR_ARCHETYPES), capacity), dtype=np.uint8)
+        for field, column in old.items():
+            columns[field][..., :n] = column[..., :n]
+        self._columns = columns
+
+    def column(self, field: str) -> np.ndarray:
+        """Read-only view of the stored values of one field"""
+        view = self._columns[field][..., :self.size]
+        view.flags.writeable = False
+        return view
+
+    # --- Persistence ---
+
+    @property
+    def _regions_path(self) -> str:
+        return self.path + ".regions"
+
+    @property
+    def _archetypes_path(self) -> str:
+        return self.path + ".archetypes"
+
+    @property
+    def _backup_path(self) -> str:
+        return self.path + ".bak"
+
+    def _stored_archetypes(self) -> Tuple[str, ...]:
+        if not os.path.exists(self._archetypes_path):
+            return LEGACY_ERROR_ARCHETYPES
+        with open(self._archetypes_path, "r", encoding="utf-8") as f:
+            return tuple(line.rstrip("\n") for line in f)
+
+    def _write_archetypes(self):
+        tmp = self._archetypes_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(key + "\n" for key in ERROR_ARCHETYPES)
+        os.replace(tmp, self._archetypes_path)
+
+    def _load(self):
+        if os.path.exists(self._regions_path):
+            with open(self._regions_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._remember_region(line.rstrip("\n"))
+
+        if os.path.exists(self._backup_path):
+            # Crash while widening: the sidecar is written last, so it tells which file is current
+            if self._stored_archetypes() == ERROR_ARCHETYPES:
+                os.remove(self._backup_path)
+            else:
+                os.replace(self._backup_path, self.path)
+        stored = self._stored_archetypes()
+        if ERROR_ARCHETYPES[:len(stored)] != stored:
+            raise ValueError(f"{self.path} was written with archetypes {list(stored)}; "
+                             f"the enemy roster may only append to them, got {list(ERROR_ARCHETYPES)}")
+        dtype = record_dtype(len(stored))
+
+        n_bytes = os.path.getsize(self.path)
+        n = n_bytes // dtype.itemsize
+        if n * dtype.itemsize != n_bytes:
+            # Torn final write (crash mid-append): drop it so later appends stay aligned
+            log.warning("partial_record_truncated", path=self.path, bytes=n_bytes - n * dtype.itemsize)
+            os.truncate(self.path, n * dtype.itemsize)
+        records = np.fromfile(self.path, dtype=dtype, count=n)
+        self._allocate(max(1024, 1 << int(n).bit_length()))
+        for field in _SCALAR_FIELDS:
+            self._columns[field][:n] = records[field]
+        self._columns["gap"][:, :n] = records["gap"].T
+        self._columns["errors"][:len(stored), :n] = records["errors"].T
+        self.size = n
+        if len(stored) < len(ERROR_ARCHETYPES):
+            self._widen(stored)
+        log.info("analysis_store_loaded", path=self.path, analyses=n, regions=len(self.regions))
+
+    def _widen(self, stored: Tuple[str, ...]):
+        """Rewrite the file with a column per current archetype (new ones read as zero)"""
+        rows = np.zeros(self.size, dtype=RECORD_DTYPE)
+        for field in _SCALAR_FIELDS:
+            rows[field] = self._columns[field][:self.size]
+        rows["gap"] = self._columns["gap"][:, :self.size].T
+        rows["errors"] = self._columns["errors"][:, :self.size].T
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(rows.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path, self._backup_path)
+        os.replace(tmp, self.path)
+        self._write_archetypes()
+        os.remove(self._backup_path)
+        log.info("analysis_store_widened", path=self.path, analyses=self.size,
+                 added=list(ERROR_ARCHETYPES[len(stored):]))
+
+    def _remember_region(self, name: str) -> int:
+        code = len(self.regions)
+        self.regions.append(name)
+        self._region_codes[name] = code
+        return code
+
+    def _region_code(self, region: Optional[str]) -> int:
+        if not region:
+            return NO_REGION
+        code = self._region_codes.get(region)
+        if code is None:
+            if len(self.regions) >= NO_REGION:
+                return NO_REGION
+            code = self._remember_region(region)
+            if self.path:
+                self._pending_regions.append(region + "\n")
+        return code
+
+    def _persist(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._append(*self._drain())  # scripts / startup: no loop to hand off to
+            return
+        if self._write_task is None or self._write_task.done():
+            self._write_task = loop.create_task(self._write_pending())
+
+    def _drain(self) -> Tuple[List[str], List[bytes]]:
+        regions, rows = self._pending_regions, self._pending_rows
+        self._pending_regions, self._pending_rows = [], []
+        return regions, rows
+
+    def _append(self, regions: List[str], rows: List[bytes]):
+        if regions:
+            with open(self._regions_path, "a", encoding="utf-8") as f:
+                f.writelines(regions)
+        if rows:
+            with open(self.path, "ab") as f:
+                f.writelines(rows)
+
+    async def _write_pending(self):
+        while self._pending_regions or self._pending_rows:
+            regions, rows = self._drain()
+            try:
+                await asyncio.to_thread(self._append, regions, rows)
+            except OSError as e:
+                log.warning("analysis_store_write_failed", path=self.path, analyses=len(rows), error=str(e))
+
+    async def close(self):
+        """Wait for queued appends (shutdown)"""
+        if self._write_task is not None:
+            await self._write_task
+
+    # --- Writes ---
+
+    def record(self, band: float, gap_graph: Dict[str, float], errors: List[Dict],
+               user_id: Optional[int] = None, clan_id: Optional[int] = None,
+               region: Optional[str] = None, ts: Optional[int] = None):
+        """Append one analysis (and persist it)"""
+        band_code, gap, counts = encode_analysis(band, gap_graph, errors)
+        row = np.zeros(1, dtype=RECORD_DTYPE)
+        row["ts"] = int(ts if ts is not None else time.time())
+        row["user_id"] = NO_ID if user_id is None else user_id
+        row["clan_id"] = NO_ID if clan_id is None else clan_id
+        row["region"] = self._region_code(region)
+        row["band"] = band_code
+        row["gap"] = gap
+        row["errors"] = counts
+        self.extend(row)
+
+    def extend(self, rows: np.ndarray, persist: bool = True):
+        """Append structured RECORD_DTYPE rows (bulk imports, benchmarks)"""
+        k = rows.shape[0]
+        if self.size + k > self.capacity:
+            self._allocate(1 << int(self.size + k).bit_length())
+        lo, hi = self.size, self.size + k
+        for field in _SCALAR_FIELDS:
+            self._columns[field][lo:hi] = rows[field]
+        self._columns["gap"][:, lo:hi] = rows["gap"].T
+        self._columns["errors"][:, lo:hi] = rows["errors"].T
+        self.size = hi
+        if persist and self.path:
+            self._pending_rows.append(rows.astype(RECORD_DTYPE, copy=False).tobytes())
+            self._persist()
+
+    # --- Cohort analytics ---
+
+    def _mask(self, cohort: Cohort, lo: int, hi: int) -> Optional[np.ndarray]:
+        """Boolean mask over rows [lo, hi); None means every row matches"""
+        mask = None
+
+        def both(m):
+            return m if mask is None else mask & m
+
+        if cohort.region is not None:
+            code = self._region_codes.get(cohort.region)
+            if code is None:
+                return np.zeros(hi - lo, dtype=bool)
+            mask = both(self._columns["region"][lo:hi] == code)
+        if cohort.clan_id is not None:
+            mask = both(self._columns["clan_id"][lo:hi] == cohort.clan_id)
+        if cohort.since is not None:
+            mask = both(self._columns["ts"][lo:hi] >= cohort.since)
+        if cohort.until is not None:
+            mask = both(self._columns["ts"][lo:hi] < cohort.until)
+        return mask
+
+    def _fold(self, rollup: Rollup, cohort: Cohort):
+        lo, hi = rollup.rows, self.size
+        if hi <= lo:
+            return
+        mask = self._mask(cohort, lo, hi)
+
+        def pick(column):
+            return column[..., lo:hi] if mask is None else column[..., lo:hi][..., mask]
+
+        band = pick(self._columns["band"])
+        if band.size:
+            rollup.band += np.bincount(band, minlength=BAND_LEVELS)[:BAND_LEVELS]
+            gap = pick(self._columns["gap"])
+            for axis in range(len(GAP_AXES)):
+                rollup.gap[axis] += np.bincount(gap[axis], minlength=GAP_LEVELS)[:GAP_LEVELS]
+            errors = pick(self._columns["errors"])
+            rollup.errors += errors.sum(axis=1, dtype=np.int64)
+            rollup.with_errors += np.count_nonzero(errors, axis=1)
+        rollup.rows = hi
+
+    def rollup(self, cohort: Cohort) -> Rollup:
+        """Cached, incrementally refreshed summary for a cohort"""
+        key = cohort.key()
+        rollup = self._rollups.get(key)
+        if rollup is None:
+            self.cache_misses += 1
+            rollup = Rollup()
+            self._rollups[key] = rollup
+            if len(self._rollups) > self.cache_size:
+                self._rollups.popitem(last=False)
+        else:
+            self.cache_hits += 1
+            self._rollups.move_to_end(key)
+        self._fold(rollup, cohort)
+        return rollup
+
+    def cohort_stats(self, cohort: Cohort) -> Dict:
+        rollup = self.rollup(cohort)
+        n = rollup.count
+
+        gap_graph = {}
+        for axis, counts in zip(GAP_AXES, rollup.gap):
+            # Ten 10-point buckets; 100 is folded into the top one
+            buckets = counts[:100].reshape(10, 10).sum(axis=1)
+            buckets[-1] += counts[100]
+            gap_graph[axis] = {"mean": _mean(counts), **_percentiles(counts), "histogram": buckets.tolist()}
+
+        # Half-band buckets keyed by their lower edge ("6.5" covers 6.5-6.9)
+        half_bands = np.add.reduceat(rollup.band, np.arange(0, BAND_LEVELS, 5))
+        band_histogram = {f"{i * 0.5:.1f}": int(c) for i, c in enumerate(half_bands) if c}
+
+        total_errors = int(rollup.errors.sum())
+        error_distribution = {
+            key: {
+                "count": int(count),
+                "share": round(int(count) / total_errors, 4) if total_errors else 0.0,
+                "analysesAffected": round(int(affected) / n, 4) if n else 0.0,
+            }
+            for key, count, affected in zip(ERROR_ARCHETYPES, rollup.errors, rollup.with_errors)
+        }
+
+        return {
+            "cohort": cohort.describe(),
+            "analyses": n,
+            "bandEstimate": {"mean": _mean(rollup.band, 0.1), **_percentiles(rollup.band, 0.1), "histogram": band_histogram},
+            "gapGraph": gap_graph,
+            "errorDistribution": error_distribution,
+        }
+
+    # --- Per-user history ---
+
+    def _refresh_user_index(self):
+        tail = self.size - self._indexed
+        if tail <= max(INDEX_TAIL_MAX, self._indexed // 8):
+            return
+        rows = np.concatenate([self._index_rows, np.arange(self._indexed, self.size, dtype=np.int64)])
+        users = self._columns["user_id"][rows]
+        # Stable sort keeps append (= time) order within a user; the indexed prefix is
+        # already one sorted run, so timsort mostly merges
+        order = np.argsort(users, kind="stable")
+        self._index_rows = rows[order]
+        self._index_users = users[order]
+        self._indexed = self.size
+
+    def user_rows(self, user_id: int, since: Optional[int] = None) -> np.ndarray:
+        """Row positions of one user's analyses, oldest first"""
+        self._refresh_user_index()
+        key = np.int32(user_id)  # a Python int would make searchsorted upcast the whole array
+        lo = np.searchsorted(self._index_users, key, side="left")
+        hi = np.searchsorted(self._index_users, key, side="right")
+        tail = np.flatnonzero(self._columns["user_id"][self._indexed:self.size] == user_id) + self._indexed
+        rows = np.concatenate([self._index_rows[lo:hi], tail])
+        if since is not None:
+            rows = rows[self._columns["ts"][rows] >= since]
+        return rows
+
+    def _decode(self, row: int) -> Dict:
+        errors = self._columns["errors"][:, row]
+        return {
+            "ts": int(self._columns["ts"][row]),
+            "bandEstimate": int(self._columns["band"][row]) / 10,
+            "gapGraph": {axis: float(v) for axis, v in zip(GAP_AXES, self._columns["gap"][:, row])},
+            "errors": {key: int(c) for key, c in zip(ERROR_ARCHETYPES, errors) if c},
+        }
+
+    def user_history(self, user_id: int, limit: int = 50) -> List[Dict]:
+        """Most recent analyses first"""
+        rows = self.user_rows(user_id)
+        return [self._decode(int(row)) for row in rows[::-1][:limit]]
+
+    def user_trend(self, user_id: int, points: int = 60, since: Optional[int] = None) -> Dict:
+        """
+        Chart series for one user, downsampled to at most `points` equal-width
+        time buckets (bucket means for scores, sums for error counts).
+        """
+        rows = self.user_rows(user_id, since)
+        n = int(rows.size)
+        series: Dict = {"t": [], "analyses": [], "bandEstimate": [],
+                        "gapGraph": {axis: [] for axis in GAP_AXES},
+                        "errors": {key: [] for key in ERROR_ARCHETYPES}}
+        if n == 0:
+            return {"analyses": 0, "bucketSeconds": 0, "series": series}
+
+        ts = self._columns["ts"][rows].astype(np.int64)
+        start, end = int(ts.min()), int(ts.max()) + 1
+        if n <= points:
+            bucket = np.arange(n)  # Already small enough: one point per analysis
+            width = 0
+            points = n
+        else:
+            width = -(-(end - start) // points)  # ceil
+            bucket = (ts - start) // width
+
+        counts = np.bincount(bucket, minlength=points)
+        used = np.flatnonzero(counts)
+        per_bucket = counts[used]
+
+        def mean(values: np.ndarray, scale: float = 1.0) -> List[float]:
+            sums = np.bincount(bucket, weights=values, minlength=points)[used]
+            return np.round(sums / per_bucket * scale, 2).tolist()
+
+        def total(values: np.ndarray) -> List[int]:
+            return np.bincount(bucket, weights=values, minlength=points)[used].astype(np.int64).tolist()
+
+        series["t"] = (ts if width == 0 else start + used * width).tolist()
+        series["analyses"] = per_bucket.tolist()
+        series["bandEstimate"] = mean(self._columns["band"][rows], 0.1)
+        gap = self._columns["gap"][:, rows]
+        for i, axis in enumerate(GAP_AXES):
+            series["gapGraph"][axis] = mean(gap[i])
+        errors = self._columns["errors"][:, rows]
+        for i, key in enumerate(ERROR_ARCHETYPES):
+            series["errors"][key] = total(errors[i])
+        return {"analyses": n, "bucketSeconds": width, "series": series}
+
+    def stats(self) -> Dict:
+        return {
+            "analyses": self.size,
+            "bytes_per_analysis": RECORD_DTYPE.itemsize,
+            "regions": len(self.regions),
+            "cached_rollups": len(self._rollups),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "unindexed_rows": self.size - self._indexed,
+        }
+
+
+analysis_store = AnalysisStore()
@@ -0,0 +1,217 @@
+from dataclasses import dataclass
+from typing import Dict
+import io
+import os
+import time
+import wave
+import numpy as np
+
+from instrumentation import observe
+from logging_setup import get_logger
+
+log = get_logger("synapse.audio")
+
+# Pre-transcription stage for PCM WAV uploads:
+#   decode -> downmix to mono -> energy VAD over 20 ms frames -> trim leading and
+#   trailing silence (keeping AUDIO_VAD_PAD_MS) -> low-pass + resample to 16 kHz
+#   -> re-encode as 16-bit mono WAV.
+# No speech at all means the caller can answer "[Silence]" without calling Whisper.
+# Anything that is not PCM WAV (webm/ogg from browsers, float WAV) passes through.
+
+AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "1") != "0"
+TARGET_RATE = int(os.getenv("AUDIO_TARGET_RATE", "16000"))  # Whisper resamples to 16 kHz anyway
+FRAME_MS = 20
+VAD_FLOOR_DB = float(os.getenv("AUDIO_VAD_FLOOR_DB", "-50"))  # never speech below this (dBFS)
+VAD_MARGIN_DB = float(os.getenv("AUDIO_VAD_MARGIN_DB", "12"))  # above the clip's noise floor
+VAD_FLAT_SPEECH_DB = float(os.getenv("AUDIO_VAD_FLAT_SPEECH_DB", "-35"))  # level for clips with no dynamics
+VAD_PAD_MS = float(os.getenv("AUDIO_VAD_PAD_MS", "200"))
+MIN_SPEECH_MS = float(os.getenv("AUDIO_MIN_SPEECH_MS", "100"))
+
+# Latency model for the "saved" estimate: upload time plus Whisper time per audio second
+UPLINK_BYTES_PER_S = float(os.getenv("AUDIO_UPLINK_BYTES_PER_S", str(10e6 / 8)))
+WHISPER_BASE_S = float(os.getenv("AUDIO_WHISPER_BASE_S", "0.4"))
+WHISPER_S_PER_AUDIO_S = float(os.getenv("AUDIO_WHISPER_S_PER_AUDIO_S", "0.05"))
+
+FIR_TAPS = 63
+
+
+@dataclass
+class PreparedAudio:
+    audio: bytes
+    filename: str
+    silent: bool = False
+    processed: bool = False
+    duration_s: float = 0.0
+    speech_s: float = 0.0
+    bytes_in: int = 0
+    preprocess_s: float = 0.0
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_in - len(self.audio)
+
+    @property
+    def est_latency_saved_s(self) -> float:
+        """Modelled upstream time avoided, minus what preprocessing itself cost"""
+        if not self.processed:
+            return 0.0
+        if self.silent:
+            saved = self.bytes_in / UPLINK_BYTES_PER_S + WHISPER_BASE_S + self.duration_s * WHISPER_S_PER_AUDIO_S
+        else:
+            saved = self.bytes_saved / UPLINK_BYTES_PER_S + (self.duration_s - self.speech_s) * WHISPER_S_PER_AUDIO_S
+        return saved - self.preprocess_s
+
+
+def _decode_wav(data: bytes):
+    """(float32 samples shaped (frames, channels) in [-1, 1], sample rate) or None"""
+    if len(data) < 44 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+            raw = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None  # e.g. IEEE float or compressed WAV
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = (b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)) << 8 >> 8  # sign-extend 24-bit
+        samples = ints.astype(np.float32) / 8388608.0
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        return None
+    frames = samples.size // channels
+    return samples[:frames * channels].reshape(frames, channels), rate
+
+
+def _encode_wav(samples: np.ndarray, rate: int) -> bytes:
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2")
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return out.getvalue()
+
+
+def frame_energy_db(mono: np.ndarray, frame_len: int) -> np.ndarray:
+    """RMS level per non-overlapping frame in dBFS"""
+    n_frames = mono.size // frame_len
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = mono[:n_frames * frame_len].reshape(n_frames, frame_len)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1))
+    return 20.0 * np.log10(np.maximum(rms, 1e-9))
+
+
+def detect_speech(mono: np.ndarray, rate: int):
+    """(first, last) sample of detected speech, or None if the clip is silent"""
+    frame_len = max(1, rate * FRAME_MS // 1000)
+    energy = frame_energy_db(mono, frame_len)
+    if energy.size == 0:
+        return None
+    noise_floor = float(np.percentile(energy, 10))
+    peak = float(energy.max())
+    if peak - noise_floor < VAD_MARGIN_DB:
+        # No quiet stretch to calibrate against (steady hum, or wall-to-wall speech):
+        # judge the whole clip by its absolute level
+        threshold = VAD_FLOOR_DB if peak >= VAD_FLAT_SPEECH_DB else float("inf")
+    else:
+        threshold = max(VAD_FLOOR_DB, noise_floor + VAD_MARGIN_DB)
+    voiced = np.flatnonzero(energy > threshold)
+    if voiced.size * FRAME_MS < MIN_SPEECH_MS:
+        return None
+    pad = int(VAD_PAD_MS * rate / 1000)
+    first = max(0, int(voiced[0]) * frame_len - pad)
+    last = min(mono.size, (int(voiced[-1]) + 1) * frame_len + pad)
+    return first, last
+
+
+def resample(mono: np.ndarray, rate: int, target: int) -> np.ndarray:
+    """Windowed-sinc low-pass at the target Nyquist, then decimate (integer ratio) or interpolate"""
+    if rate <= target or mono.size == 0:
+        return mono
+    cutoff = 0.5 * target / rate  # cycles per input sample
+    n = np.arange(FIR_TAPS) - (FIR_TAPS - 1) / 2
+    taps = (2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(FIR_TAPS)).astype(np.float32)
+    filtered = np.convolve(mono, taps / taps.sum(), mode="same")
+    if rate % target == 0:
+        return filtered[::rate // target]
+    n_out = int(mono.size * target / rate)
+    return np.interp(np.arange(n_out) * (rate / target), np.arange(mono.size), filtered).astype(np.float32)
+
+
+def prepare_audio(data: bytes, filename: str = "audio_upload.webm") -> PreparedAudio:
+    """Trim/downsample PCM WAV uploads; everything else is returned untouched"""
+    start = time.perf_counter()
+    result = PreparedAudio(audio=data, filename=filename, bytes_in=len(data))
+    decoded = _decode_wav(data) if AUDIO_PREPROCESS else None
+    if decoded is None:
+        return result
+    samples, rate = decoded
+    mono = samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+    result.processed = True
+    result.duration_s = mono.size / rate if rate else 0.0
+
+    speech = detect_speech(mono, rate)
+    if speech is None:
+        result.silent = True
+        result.audio = b""
+    else:
+        first, last = speech
+        result.speech_s = (last - first) / rate
+        out_rate = min(rate, TARGET_RATE)
+        encoded = _encode_wav(resample(mono[first:last], rate, out_rate), out_rate)
+        if len(encoded) < len(data):
+            result.audio = encoded
+            result.filename = "audio_upload.wav"
+    result.preprocess_s = time.perf_counter() - start
+    return result
+
+
+class AudioStats:
+    """Running totals for /api/audio/stats and /metrics"""
+
+    def __init__(self):
+        self.requests = 0
+        self.processed = 0
+        self.silent = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.est_latency_saved_s = 0.0
+
+    def record(self, prepared: PreparedAudio):
+        self.requests += 1
+        self.bytes_in += prepared.bytes_in
+        self.bytes_out += len(prepared.audio)
+        if prepared.processed:
+            self.processed += 1
+            self.silent += prepared.silent
+            self.est_latency_saved_s += prepared.est_latency_saved_s
+            observe("synapse_audio_bytes_saved_ratio", prepared.bytes_saved / max(prepared.bytes_in, 1), (),
+                    (0.1, 0.25, 0.5, 0.75, 0.9, 1.0))
+            observe("synapse_audio_latency_saved_seconds", max(prepared.est_latency_saved_s, 0.0))
+        log.debug("audio_prepared", processed=prepared.processed, silent=prepared.silent,
+                  bytes_in=prepared.bytes_in, bytes_out=len(prepared.audio),
+                  duration_s=round(prepared.duration_s, 3), speech_s=round(prepared.speech_s, 3),
+                  preprocess_ms=round(prepared.preprocess_s * 1000, 2),
+                  est_latency_saved_ms=round(prepared.est_latency_saved_s * 1000, 1))
+
+    def snapshot(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "processed": self.processed,
+            "silent_short_circuits": self.silent,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "est_latency_saved_s": round(self.est_latency_saved_s, 3),
+        }
+
+
+audio_stats = AudioStats()
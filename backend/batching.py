@@ -0,0 +1,137 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+import asyncio
+import time
+
+from instrumentation import observe, SIZE_BUCKETS
+from logging_setup import get_logger
+
+log = get_logger("synapse.batching")
+
+# Micro-batching: an item whose key has no call in flight is dispatched at
+# once, so a lone request never waits for the window. Items arriving while a
+# call for their key is running queue up. They go out together when that call
+# finishes, `window_s` after the first of them, or once `max_items` are
+# queued, whichever comes first. Items the batch
+# could not answer (bad JSON, missing ids, upstream error) are retried one by
+# one through single_fn, so callers always get an answer or a real exception.
+# With a key_fn, only items with the same key share a batch, and items keyed
+# None are never batched (e.g. untrusted input from different users must not
+# share one prompt).
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        name: str,
+        batch_fn: Callable[[List[Any]], Awaitable[List[Optional[Any]]]],
+        single_fn: Callable[[Any], Awaitable[Any]],
+        window_s: float,
+        max_items: int,
+        key_fn: Optional[Callable[[Any], Optional[Hashable]]] = None,
+    ):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.single_fn = single_fn
+        self.window_s = window_s
+        self.max_items = max_items
+        self.key_fn = key_fn
+        # batch key -> queued (item, future, enqueued_at)
+        self.pending: Dict[Hashable, List[Tuple[Any, asyncio.Future, float]]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._inflight: Dict[Hashable, int] = {}  # key -> calls running
+        self._running: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+        self.fallbacks = 0  # items re-graded individually
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_s > 0 and self.max_items > 1
+
+    async def submit(self, item: Any) -> Any:
+        key = self.key_fn(item) if self.key_fn else ()
+        if not self.enabled or key is None:
+            return await self.single_fn(item)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queue = self.pending.setdefault(key, [])
+        queue.append((item, future, time.perf_counter()))
+        if len(queue) >= self.max_items or not self._inflight.get(key):
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.window_s, self._flush, key)
+        return await future
+
+    def _flush(self, key: Hashable):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(key, [])
+        if batch:
+            self._inflight[key] = self._inflight.get(key, 0) + 1
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(lambda done: self._finished(key, done))
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        self._running.discard(task)
+        remaining = self._inflight.get(key, 0) - 1
+        if remaining > 0:
+            self._inflight[key] = remaining
+        else:
+            self._inflight.pop(key, None)
+        if key in self.pending:
+            self._flush(key)  # what queued up behind this call goes now
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future, float]]):
+        now = time.perf_counter()
+        labels = (("batcher", self.name),)
+        observe("synapse_batch_size", len(batch), labels, SIZE_BUCKETS)
+        for _, _, enqueued in batch:
+            observe("synapse_batch_added_wait_seconds", now - enqueued, labels)
+        self.batches += 1
+        self.items += len(batch)
+
+        if len(batch) == 1:  # Nothing to amortize
+            item, future, _ = batch[0]
+            await self._run_single(item, future)
+            return
+
+        items = [item for item, _, _ in batch]
+        try:
+            results: List[Optional[Any]] = list(await self.batch_fn(items))
+            results += [None] * (len(items) - len(results))
+        except Exception as e:
+            log.warning("batch_failed_falling_back", batcher=self.name, items=len(items), error=str(e))
+            results = [None] * len(items)
+
+        retries = []
+        for (item, future, _), result in zip(batch, results):
+            if future.done():  # Caller gave up
+                continue
+            if result is None:
+                retries.append(self._run_single(item, future))
+            else:
+                future.set_result(result)
+        if retries:
+            self.fallbacks += len(retries)
+            await asyncio.gather(*retries)
+
+    async def _run_single(self, item: Any, future: asyncio.Future):
+        """Run one item through single_fn and resolve its future"""
+        try:
+            result = await self.single_fn(item)
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "fallbacks": self.fallbacks,
+            "pending": sum(len(queue) for queue in self.pending.values()),
+        }
@@ -0,0 +1,66 @@
+import io
+import os
+import statistics
+import time
+import wave
+import numpy as np
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from audio_preprocess import prepare_audio
+
+# Synthetic recordings through the preprocessing stage: size before/after,
+# preprocessing cost, and the modelled upload + Whisper time saved.
+
+
+def speech_like(seconds: float, rate: int, rng) -> np.ndarray:
+    """Voiced harmonics with ~4 Hz syllable envelope, around -20 dBFS"""
+    t = np.arange(int(seconds * rate)) / rate
+    pitch = 140 + 25 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 0.5
+    return 0.15 * voice * envelope + rng.normal(0, 0.003, t.size)
+
+
+def room_tone(seconds: float, rate: int, rng) -> np.ndarray:
+    return rng.normal(0, 0.001, int(seconds * rate))  # ~ -60 dBFS
+
+
+def encode(mono: np.ndarray, rate: int, channels: int = 1) -> bytes:
+    pcm = (np.clip(mono, -1, 1) * 32767).astype("<i2")
+    if channels > 1:
+        pcm = np.repeat(pcm[:, None], channels, axis=1)
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return out.getvalue()
+
+
+def clips():
+    rng = np.random.default_rng(0)
+    yield "48k stereo, 1.5s+3s+2s", encode(np.concatenate([
+        room_tone(1.5, 48000, rng), speech_like(3, 48000, rng), room_tone(2, 48000, rng)]), 48000, 2)
+    yield "44.1k mono, 1s+4s+1s", encode(np.concatenate([
+        room_tone(1, 44100, rng), speech_like(4, 44100, rng), room_tone(1, 44100, rng)]), 44100)
+    yield "16k mono, speech only 5s", encode(speech_like(5, 16000, rng), 16000)
+    yield "48k stereo, silent 4s", encode(room_tone(4, 48000, rng), 48000, 2)
+    yield "webm (passthrough)", b"\x1aE\xdf\xa3" + bytes(64_000)
+
+
+if __name__ == "__main__":
+    print("⏱️ Audio preprocessing (VAD trim + 16 kHz mono)")
+    print(f"{'clip':<28}{'in':>10}{'out':>10}{'saved':>8}{'speech':>10}{'prep':>9}{'est. saved':>12}")
+    for label, data in clips():
+        samples = []
+        for _ in range(10):
+            start = time.perf_counter()
+            prepared = prepare_audio(data)
+            samples.append(time.perf_counter() - start)
+        verdict = "[Silence]" if prepared.silent else f"{prepared.speech_s:.2f}s"
+        print(f"{label:<28}{prepared.bytes_in / 1024:>8.0f}KB{len(prepared.audio) / 1024:>8.0f}KB"
+              f"{prepared.bytes_saved / max(prepared.bytes_in, 1):>8.0%}{verdict:>10}"
+              f"{statistics.median(samples) * 1000:>7.1f}ms{prepared.est_latency_saved_s * 1000:>10.0f}ms")
@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import numpy as np
+
+# Throwaway database; must be set before database.py is imported (via clan_sync)
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='synapse-sync-')}/sync.db")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from clan_sync import compute_sync_levels, member_stats_changed
+
+# Clan Sync Level benchmark:
+#   - bulk NumPy recomputation vs a per-member Python loop, over N clans
+#   - optional (--db) end-to-end recompute_all_clans against a seeded SQLite file,
+#     and the O(1) incremental UPDATE when one member's stats change
+
+
+def python_baseline(member_clan, member_stats, n_clans):
+    sums = [[0.0, 0.0, 0.0] for _ in range(n_clans)]
+    counts = [0] * n_clans
+    for clan, stats in zip(member_clan.tolist(), member_stats.tolist()):
+        row = sums[clan]
+        row[0] += stats[0]; row[1] += stats[1]; row[2] += stats[2]
+        counts[clan] += 1
+    return [[s / c if c else 0.0 for s in row] for row, c in zip(sums, counts)]
+
+
+async def bench_db(n_clans: int, members: np.ndarray, stats: np.ndarray):
+    from database import engine, Base, AsyncSessionLocal
+    from models import Clan, User
+    from clan_sync import recompute_all_clans
+    from sqlalchemy import insert
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(Clan), [{"id": i + 1, "name": f"Clan {i}"} for i in range(n_clans)])
+        await db.execute(insert(User), [
+            {"username": f"u{i}", "clan_id": int(c) + 1, "vocabulary": float(s[0]), "syntax": float(s[1]), "fluency": float(s[2])}
+            for i, (c, s) in enumerate(zip(members, stats))
+        ])
+        await db.commit()
+        start = time.perf_counter()
+        updated = await recompute_all_clans(db)
+        print(f"recompute_all_clans (SQLite, end-to-end): {time.perf_counter() - start:8.3f} s for {updated:,} clans")
+
+        old, new = {"vocabulary": 60, "syntax": 55, "fluency": 50}, {"vocabulary": 65, "syntax": 55, "fluency": 52}
+        n = 2_000
+        start = time.perf_counter()
+        for i in range(n):
+            await member_stats_changed(db, i % n_clans + 1, old, new)
+        await db.commit()
+        print(f"incremental UPDATE (SQLite):   {(time.perf_counter() - start) / n * 1e6:8.1f} µs/member change")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clans", type=int, default=100_000)
+    parser.add_argument("--members-per-clan", type=int, default=3)
+    parser.add_argument("--db", action="store_true", help="also run the SQLite end-to-end recompute")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    n_members = args.clans * args.members_per_clan
+    member_clan = rng.integers(0, args.clans, n_members)
+    member_stats = rng.uniform(0, 100, (n_members, 3))
+
+    print(f"⏱️ Clan sync: {args.clans:,} clans, {n_members:,} members")
+    start = time.perf_counter()
+    python_baseline(member_clan, member_stats, args.clans)
+    py_s = time.perf_counter() - start
+    print(f"python loop:           {py_s * 1000:8.1f} ms")
+
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        means, counts = compute_sync_levels(member_clan, member_stats, args.clans)
+        best = min(best, time.perf_counter() - start)
+    print(f"numpy bincount:        {best * 1000:8.1f} ms  ({py_s / best:.0f}x)")
+
+    if args.db:
+        asyncio.run(bench_db(args.clans, member_clan, member_stats))
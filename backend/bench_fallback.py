@@ -0,0 +1,48 @@
+import timeit
+from main import (
+    AnalysisResult, CustomEnemy, MOCK_ANALYSIS,
+    generate_enemy, get_mock_analysis,
+)
+from enemy_registry import ENEMIES
+
+# Baseline: what the fallback path used to do on every call
+# (rebuild the enemy dict, substring-scan, validate fresh Pydantic models)
+_MOCK_PAYLOAD = MOCK_ANALYSIS.model_dump()
+_ENEMY_PAYLOADS = {key: enemy.model_dump() for key, enemy in ENEMIES.items()}
+
+
+def legacy_generate_enemy(error):
+    enemies = {key: dict(payload) for key, payload in _ENEMY_PAYLOADS.items()}
+    enemy_data = enemies["Tense"]
+    if error:
+        err_type = error.get("type", "")
+        if "Tense" in err_type: enemy_data = enemies["Tense"]
+        elif "Article" in err_type: enemy_data = enemies["Article"]
+        elif "Subject" in err_type or "Agreement" in err_type: enemy_data = enemies["Subject-Verb"]
+        elif "Vocabulary" in err_type: enemy_data = enemies["Vocabulary"]
+        elif "Pronunciation" in err_type: enemy_data = enemies["Pronunciation"]
+    return CustomEnemy(**enemy_data)
+
+
+def legacy_mock_analysis():
+    payload = dict(_MOCK_PAYLOAD)
+    payload["enemy"] = legacy_generate_enemy({"type": "Tense"})
+    return AnalysisResult(**payload)
+
+
+def bench(label, fn, number=20000):
+    seconds = min(timeit.repeat(fn, number=number, repeat=5))
+    per_call_us = seconds / number * 1e6
+    print(f"{label:<40} {per_call_us:8.2f} µs/call")
+    return per_call_us
+
+
+if __name__ == "__main__":
+    error = {"type": "Subject-Verb Agreement"}
+    print("⏱️ Fallback path micro-benchmark")
+    old_enemy = bench("generate_enemy (legacy)", lambda: legacy_generate_enemy(error))
+    new_enemy = bench("generate_enemy (registry)", lambda: generate_enemy(error))
+    old_mock = bench("get_mock_analysis (legacy)", legacy_mock_analysis)
+    new_mock = bench("get_mock_analysis (precompiled)", get_mock_analysis)
+    print(f"📉 generate_enemy speedup: {old_enemy / new_enemy:.1f}x")
+    print(f"📉 get_mock_analysis speedup: {old_mock / new_mock:.1f}x")
@@ -0,0 +1,66 @@
+import json
+import os
+import statistics
+import sys
+import time
+import numpy as np
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from analysis_store import AnalysisStore, RECORD_DTYPE
+from bench_analytics import synthetic_rows, DAY
+
+# Usage: python bench_history.py [background analyses]   (default 2,000,000)
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+USER = 777_777
+USER_ENTRIES = 10_000
+
+
+def p50_us(fn, repeat: int = 200) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1e6
+
+
+if __name__ == "__main__":
+    now = int(time.time())
+    rows = synthetic_rows(N, now)
+    # One heavy user whose 10k analyses are spread through everyone else's
+    heavy = np.sort(np.random.default_rng(3).choice(N, USER_ENTRIES, replace=False))
+    rows["user_id"][heavy] = USER
+
+    store = AnalysisStore(path=None)
+    store.extend(rows, persist=False)
+
+    entry = store.user_history(USER, 1)[0]
+    json_bytes = len(json.dumps({**entry, "errors": [{"type": k, "count": c} for k, c in entry["errors"].items()]}))
+    print(f"⏱️ Per-user history: {USER_ENTRIES:,} analyses for one user among {N:,}")
+    print(f"storage: {RECORD_DTYPE.itemsize} B/analysis fixed-width vs ~{json_bytes} B as JSON "
+          f"({json_bytes / RECORD_DTYPE.itemsize:.0f}x); 10k entries = {USER_ENTRIES * RECORD_DTYPE.itemsize / 1024:.0f} KiB")
+
+    store._indexed = 0
+    store._index_rows = store._index_rows[:0]
+    store._index_users = store._index_users[:0]
+    start = time.perf_counter()
+    store._refresh_user_index()
+    print(f"index build (cold, {N:,} rows): {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    full_scan = p50_us(lambda: np.flatnonzero(store.column("user_id") == USER), repeat=20)
+    print(f"full-scan lookup (no index):      {full_scan:8.0f} µs")
+    print(f"indexed user_rows():              {p50_us(lambda: store.user_rows(USER)):8.0f} µs")
+    print(f"history (latest 50):              {p50_us(lambda: store.user_history(USER, 50)):8.0f} µs")
+    print(f"trend (60 points, all time):      {p50_us(lambda: store.user_trend(USER, 60)):8.0f} µs")
+    print(f"trend (60 points, last 30 days):  {p50_us(lambda: store.user_trend(USER, 60, now - 30 * DAY)):8.0f} µs")
+
+    # Fresh appends stay in the scanned tail until the next merge
+    tail = synthetic_rows(4_000, now, seed=5)
+    tail["user_id"][::10] = USER
+    store.extend(tail, persist=False)
+    print(f"trend with 4k-row unindexed tail: {p50_us(lambda: store.user_trend(USER, 60)):8.0f} µs")
+    store.extend(synthetic_rows(N // 8, now, seed=6), persist=False)
+    start = time.perf_counter()
+    store._refresh_user_index()
+    print(f"index merge (+{N // 8:,} rows):     {(time.perf_counter() - start) * 1000:8.1f} ms")
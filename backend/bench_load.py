@@ -0,0 +1,304 @@
+"""
+Reproducible load test for the Synapse backend.
+
+Boots the API in-process (uvicorn on a free port) against a stub OpenAI server,
+seeds a throwaway database and drives scripted scenarios:
+
+    raids        concurrent 3-member raids over WebSockets (start -> 3 parts -> grading)
+    summon       summon storm on /api/clan/summon
+    leaderboard  national/regional leaderboard polling
+    combat       voice-combat bursts on /api/combat-voice
+
+Prints one JSON document (throughput, p50/p95/p99 latency, errors, peak RSS per
+scenario) so runs can be diffed between commits:
+
+    python bench_load.py --users 5000 --clans 1000 --scenarios raids,combat --out run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import socket
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--clans", type=int, default=500)
+    parser.add_argument("--regions", type=int, default=12)
+    parser.add_argument("--scenarios", default="raids,summon,leaderboard,combat")
+    parser.add_argument("--requests", type=int, default=500, help="requests per HTTP scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--raids", type=int, default=50, help="concurrent raids")
+    parser.add_argument("--stub-latency-ms", type=float, default=40.0, help="simulated OpenAI latency")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write the JSON report here as well as stdout")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(name: str, latencies: List[float], wall: float, errors: int) -> Dict:
+    latencies = sorted(latencies)
+
+    def pct(p):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 2)
+
+    return {
+        "scenario": name,
+        "completed": len(latencies),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_per_s": round(len(latencies) / wall, 1) if wall else None,
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def build_stub_openai(latency_s: float):
+    """Minimal OpenAI look-alike: chat completions + Whisper transcriptions"""
+    from fastapi import FastAPI, Request
+
+    stub = FastAPI()
+    rng = random.Random(0)
+
+    def completion(content: Dict) -> Dict:
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-4o-mini",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": json.dumps(content)}}],
+            "usage": {"prompt_tokens": 300, "completion_tokens": 80, "total_tokens": 380},
+        }
+
+    @stub.post("/v1/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        await asyncio.sleep(latency_s)
+        system, user = body["messages"][0]["content"], body["messages"][1]["content"]
+        if "Combat" in system and '"results"' in user:
+            ids = [int(i) for i in re.findall(r'"id": (\d+)', user)]
+            return completion({"results": [{"id": i, "damage": rng.randint(20, 100), "isCritical": False,
+                                            "feedback": "Stub volley.", "recoilType": "hit"} for i in ids]})
+        if "Combat" in system:
+            return completion({"damage": rng.randint(20, 100), "isCritical": rng.random() < 0.2,
+                               "feedback": "Stub strike.", "recoilType": "hit"})
+        if "IELTS expert" in system:
+            return completion({
+                "bandEstimate": 6.5,
+                "errors": [{"type": "Article Missing", "category": "Grammar", "example": "go to park",
+                            "correction": "go to the park", "severity": "medium"}],
+                "gapGraph": {"vocabulary": 60, "syntax": 55, "phonetics": 70, "coherence": 65},
+                "questions": [{"id": i, "prompt": f"Stub article drill {rng.random()}", "options": ["a", "an", "the", "-"],
+                               "correctAnswer": "the", "complexity": 6.0, "explanation": "Stub."} for i in range(1, 4)],
+            })
+        return completion({"quests": []})
+
+    @stub.post("/v1/audio/transcriptions")
+    async def transcriptions():
+        await asyncio.sleep(latency_s)
+        # Distinct per attempt, like real students, so gradings batch rather than coalesce
+        return {"text": f"I went to Charvak last summer and it was incredibly serene ({rng.randrange(1 << 30)})."}
+
+    return stub
+
+
+async def start_server(app, port: int):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def seed(args, rng: random.Random):
+    from database import engine, Base, AsyncSessionLocal
+    from models import User, Clan
+    from sqlalchemy import insert
+
+    regions = [f"Region-{i}" for i in range(args.regions)]
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(Clan), [
+            {"name": f"Clan {i}", "region": rng.choice(regions)} for i in range(args.clans)
+        ])
+        await db.execute(insert(User), [
+            {"username": f"user{i}", "xp": rng.randint(0, 5000), "region": rng.choice(regions),
+             "clan_id": rng.randint(1, args.clans) if args.clans else None,
+             "vocabulary": rng.randint(0, 100), "syntax": rng.randint(0, 100), "fluency": rng.randint(0, 100)}
+            for i in range(args.users)
+        ])
+        await db.commit()
+
+
+async def run_http(name: str, args, make_request) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    queue = iter(range(args.requests))
+
+    async def worker():
+        nonlocal errors
+        for i in queue:
+            start = time.perf_counter()
+            try:
+                response = await make_request(i)
+                if response.status_code >= 400:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    return summarize(name, latencies, time.perf_counter() - start, errors)
+
+
+async def run_raids(base_ws: str, args) -> Dict:
+    import websockets
+
+    async def member(clan_id: int, username: str, joined: asyncio.Event, go: asyncio.Event, done: asyncio.Event):
+        async with websockets.connect(f"{base_ws}/ws/raid/{clan_id}/{username}") as ws:
+            joined.set()
+            submitted = False
+            if go is not None:  # Raid leader starts once the whole triad is in the lobby
+                await go.wait()
+                await ws.send(json.dumps({"type": "start_raid"}))
+            while not done.is_set():
+                try:
+                    message = json.loads(await asyncio.wait_for(ws.recv(), timeout=0.5))
+                except asyncio.TimeoutError:
+                    continue
+                if message["type"] == "notification" and "Damage Dealt" in message["message"]:
+                    done.set()
+                elif message["type"] == "state_update":
+                    state = message["data"]
+                    if state["status"] == "active" and state["active_player"] == username and not submitted:
+                        submitted = True
+                        await ws.send(json.dumps({"type": "submit_part", "content": f"{username} speaks at length."}))
+
+    async def raid(i: int) -> float:
+        clan_id = 100_000 + i  # Raid rooms are in-memory; keep clear of seeded clans
+        go, done = asyncio.Event(), asyncio.Event()
+        start = time.perf_counter()
+        tasks = []
+        for n, suffix in enumerate("ABC"):
+            joined = asyncio.Event()
+            # Connect one at a time: turn order is connection order
+            tasks.append(asyncio.create_task(member(clan_id, f"raider{i}_{suffix}", joined, go if n == 0 else None, done)))
+            await joined.wait()
+        go.set()
+        await asyncio.wait_for(asyncio.gather(*tasks), timeout=60)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[raid(i) for i in range(args.raids)], return_exceptions=True)
+    latencies = [r for r in results if isinstance(r, float)]
+    return summarize("raids", latencies, time.perf_counter() - start, len(results) - len(latencies))
+
+
+async def main_async(args, stub_port: int, api_port: int) -> Dict:
+    import httpx
+
+    rng = random.Random(args.seed)
+    stub_server, stub_task = await start_server(build_stub_openai(args.stub_latency_ms / 1000), stub_port)
+
+    import main as api
+    from database import engine
+    engine.sync_engine.echo = False  # SQL echo would dominate the measurement
+
+    await seed(args, rng)
+    api_server, api_task = await start_server(api.app, api_port)
+
+    base = f"http://127.0.0.1:{api_port}"
+    results = []
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base, timeout=60, limits=limits) as client:
+        for scenario in scenarios:
+            if scenario == "raids":
+                results.append(await run_raids(f"ws://127.0.0.1:{api_port}", args))
+            elif scenario == "summon":
+                run_id = rng.randrange(1 << 30)
+                results.append(await run_http("summon", args, lambda i: client.post("/api/clan/summon", json={
+                    "inviter_username": f"user{rng.randrange(max(1, args.users))}",
+                    "invitee_username": f"recruit{run_id}_{i}",
+                })))
+            elif scenario == "leaderboard":
+                results.append(await run_http("leaderboard", args, lambda i: client.get(
+                    "/api/leaderboard", params={"by": "regional" if i % 2 else "national"})))
+            elif scenario == "combat":
+                results.append(await run_http("combat", args, lambda i: client.post(
+                    "/api/combat-voice",
+                    params={"prompt": "Describe a memorable journey."},
+                    files={"audio": ("burst.webm", os.urandom(4096), "audio/webm")},
+                    headers={"X-User-Id": f"user{i}"},
+                )))
+            else:
+                raise SystemExit(f"Unknown scenario: {scenario}")
+
+    api_server.should_exit = True
+    stub_server.should_exit = True
+    await asyncio.gather(api_task, stub_task)
+
+    return {
+        "config": vars(args),
+        "python": sys.version.split()[0],
+        "results": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="synapse-bench-")
+    # Everything below must be in place before main.py / database.py are imported
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{workdir}/bench.db"
+    os.environ["QUESTION_BANK_PATH"] = f"{workdir}/question_bank.jsonl"
+    os.environ["ANALYSIS_STORE_PATH"] = f"{workdir}/analyses.bin"
+    # Paired with bench.db: awards must never replay into another database
+    os.environ["XP_JOURNAL_DIR"] = f"{workdir}/xp_journal"
+    os.environ["OPENAI_API_KEY"] = "stub"  # Never send a real key to the stub
+    # Usage records land in bench.db; a budget from the caller's env must not turn load into 429s
+    os.environ["USAGE_DAILY_TOKEN_BUDGET"] = "0"
+    # Load generation comes from one IP with few users; lift admission limits
+    for endpoint in ("ANALYZE_SPEECH", "COMBAT_VOICE", "REFINE_CONTENT"):
+        for field, value in (("USER_RATE", "1e9"), ("USER_BURST", "1000000000"), ("IP_RATE", "1e9"),
+                             ("IP_BURST", "1000000000"), ("MAX_CONCURRENCY", "100000")):
+            os.environ.setdefault(f"ADMISSION_{endpoint}_{field}", value)
+
+    # Point the OpenAI SDK at the stub before it is first used
+    stub_port, api_port = free_port(), free_port()
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{stub_port}/v1"
+
+    report = asyncio.run(main_async(args, stub_port, api_port))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
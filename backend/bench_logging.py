@@ -0,0 +1,49 @@
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Request throughput on the mock /api/analyze-speech path with structured
+# logging off, at INFO (production) and at DEBUG (every per-request event plus
+# library debug output). Logs go to a real file so the writer thread does real I/O.
+from bench_instrumentation import run_load, REQUESTS, ROUNDS
+
+
+def measure(level: str, log_path: str) -> float:
+    env = dict(
+        os.environ,
+        LOG_LEVEL=level,
+        LOG_LEVELS="httpx=WARNING",  # the load generator's own client logs
+        OPENAI_API_KEY="",
+        DATABASE_URL=os.getenv("DATABASE_URL", "sqlite+aiosqlite:////tmp/synapse_bench.db"),
+        ADMISSION_ANALYZE_SPEECH_IP_RATE="1e9",
+        ADMISSION_ANALYZE_SPEECH_IP_BURST="1000000000",
+    )
+    with open(log_path, "w") as log_file:
+        out = subprocess.run([sys.executable, __file__, "--child"], env=env, stdout=subprocess.PIPE,
+                             stderr=log_file, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])["rps"]
+
+
+if __name__ == "__main__":
+    if "--child" in sys.argv:
+        print(json.dumps({"rps": asyncio.run(run_load())}))
+        sys.exit(0)
+
+    print(f"⏱️ Logging overhead on the mock analyze-speech path ({REQUESTS} req x {ROUNDS} rounds)")
+    log_path = os.path.join(tempfile.mkdtemp(prefix="synapse-log-"), "bench.log")
+    runs = {"OFF": [], "INFO": [], "DEBUG": []}
+    lines = {}
+    levels = list(runs)
+    for i in range(3):  # interleave and rotate the order to cancel out machine noise
+        for level in levels[i:] + levels[:i]:
+            runs[level].append(measure(level, log_path))
+            lines[level] = sum(1 for _ in open(log_path))
+    baseline = statistics.median(runs["OFF"])
+    for level, samples in runs.items():
+        rps = statistics.median(samples)
+        print(f"LOG_LEVEL={level:<6} {rps:>8,.0f} req/s  {lines[level]:>7,} lines/run  "
+              f"overhead {(baseline - rps) / baseline:6.2%}")
@@ -0,0 +1,64 @@
+import json
+import random
+import statistics
+import sys
+import time
+from main import MOCK_ANALYSIS
+from question_bank import QuestionBank
+from enemy_registry import ENEMIES
+
+# Decode speed used to translate saved output tokens into latency (gpt-4o-mini ballpark)
+TOKENS_PER_SECOND = float(sys.argv[1]) if len(sys.argv) > 1 else 80.0
+
+ERROR_TYPES = ["Tense Error", "Article Missing", "Subject-Verb Agreement", "Vocabulary", "Pronunciation"]
+CATEGORIES = ["Grammar", "Syntax", "Phonetics", "Coherence"]
+
+
+def estimate_tokens(text: str) -> int:
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding("o200k_base").encode(text))
+    except ImportError:
+        return max(1, len(text) // 4)  # ~4 chars/token for English JSON
+
+
+def build_bank(size: int) -> QuestionBank:
+    bank = QuestionBank(path=None)
+    rng = random.Random(42)
+    for i in range(size):
+        bank.add({
+            "prompt": f"Synthetic drill #{i}: choose the right form.",
+            "options": ["a", "b", "c", "d"],
+            "correctAnswer": "a",
+            "complexity": round(rng.uniform(4.0, 9.0), 1),
+            "explanation": "Synthetic.",
+        }, rng.choice(ERROR_TYPES), rng.choice(CATEGORIES))
+    return bank
+
+
+if __name__ == "__main__":
+    full = MOCK_ANALYSIS.model_dump(exclude={"enemy"})
+    diagnostics_only = {k: v for k, v in full.items() if k != "questions"}
+    full_tokens = estimate_tokens(json.dumps(full, indent=2))
+    diag_tokens = estimate_tokens(json.dumps(diagnostics_only, indent=2))
+    saved = full_tokens - diag_tokens
+
+    print("⏱️ Question bank benchmark")
+    print(f"Output tokens with generated MCQs: {full_tokens}")
+    print(f"Output tokens diagnostics-only:    {diag_tokens}")
+    print(f"📉 Saved per analysis: {saved} tokens ({saved / full_tokens:.0%}), "
+          f"~{saved / TOKENS_PER_SECOND * 1000:.0f} ms of decode at {TOKENS_PER_SECOND:.0f} tok/s")
+
+    errors = MOCK_ANALYSIS.errors
+    for size in (100, 10_000, 100_000):
+        bank = build_bank(size)
+        assert bank.is_warm(), f"bank of {size} should cover all {len(ENEMIES)} archetypes"
+        samples = []
+        for _ in range(2000):
+            start = time.perf_counter()
+            bank.select(errors, 6.5)
+            samples.append(time.perf_counter() - start)
+        samples.sort()
+        p50 = statistics.median(samples) * 1e6
+        p99 = samples[int(len(samples) * 0.99)] * 1e6
+        print(f"select() over {size:>7} questions: p50 {p50:6.1f} µs, p99 {p99:6.1f} µs")
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Scratch database and journal before database.py / xp_ledger.py are imported
+WORKDIR = tempfile.mkdtemp(prefix="synapse-rollups-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{WORKDIR}/rollups.db")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, func, insert, select
+
+from database import AsyncSessionLocal, Base, engine
+from models import RegionXPBucket, User
+from region_rollups import DAY, HOUR, RegionRollups
+from xp_ledger import XPLedger
+
+# A day of turf war: EVENTS XP awards (default 1M) over USERS users in 14 regions,
+# through the ledger with the rollup listener, flushed every FLUSH_EVERY awards.
+# Then:
+#   - windowed standings (hour/day/week) from the buckets
+#   - the same windows computed from a raw events table (ts-indexed scan)
+#   - the existing all-time SUM(xp) GROUP BY region over users
+#   - compaction of 120 days of buckets
+# Usage: python bench_region_rollups.py [events] [users]
+
+EVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+USERS = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+FLUSH_EVERY = 10_000
+QUERY_ROUNDS = 20
+REGIONS = [
+    "Tashkent", "Samarkand", "Bukhara", "Namangan", "Andijan", "Fergana", "Kashkadarya",
+    "Surkhandarya", "Khorezm", "Navoi", "Jizzakh", "Sirdarya", "Karakalpakstan", "Tashkent Region",
+]
+
+raw_events = Table(
+    "bench_xp_events", MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("region", String),
+    Column("ts", Integer, index=True),
+    Column("xp", Integer),
+)
+
+
+def median_ms(samples):
+    return statistics.median(samples) * 1000
+
+
+async def setup():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(raw_events.metadata.create_all)
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), [
+            {"username": f"user{i}", "region": REGIONS[i % len(REGIONS)], "xp": 0} for i in range(USERS)
+        ])
+        await db.commit()
+
+
+def day_of_events(now: float, rng: random.Random):
+    for _ in range(EVENTS):
+        user = rng.randrange(USERS)
+        yield f"user{user}", REGIONS[user % len(REGIONS)], rng.randint(10, 120), int(now - rng.random() * DAY)
+
+
+async def ingest(now: float):
+    ledger = XPLedger(os.path.join(WORKDIR, "xp_journal"))
+    rollups = RegionRollups(ledger)
+    ledger.add_listener(rollups)
+    await ledger.start()
+    raw = []
+    award_s = flush_s = 0.0
+    start = time.perf_counter()
+    for i, (username, region, xp, ts) in enumerate(day_of_events(now, random.Random(1)), 1):
+        ledger.award(username, xp, "bench", ts)
+        raw.append({"region": region, "ts": ts, "xp": xp})
+        if i % FLUSH_EVERY == 0:
+            award_s += time.perf_counter() - start
+            start = time.perf_counter()
+            await ledger.flush()
+            flush_s += time.perf_counter() - start
+            start = time.perf_counter()
+    await ledger.stop()
+    async with AsyncSessionLocal() as db:
+        for i in range(0, len(raw), 100_000):
+            await db.execute(insert(raw_events), raw[i:i + 100_000])
+        await db.commit()
+    return rollups, award_s, flush_s
+
+
+async def time_query(fn):
+    samples, result = [], None
+    for _ in range(QUERY_ROUNDS):
+        async with AsyncSessionLocal() as db:
+            start = time.perf_counter()
+            result = await fn(db)
+            samples.append(time.perf_counter() - start)
+    return median_ms(samples), result
+
+
+async def compaction(rollups: RegionRollups, now: float):
+    """120 older days of hourly + daily buckets per region, then one nightly compaction"""
+    rows = []
+    first_hour = int(now) // HOUR * HOUR - 122 * DAY
+    for region in REGIONS:
+        for hour in range(first_hour, first_hour + 120 * DAY, HOUR):
+            rows.append({"region": region, "granularity": "h", "start": hour, "xp": 500, "events": 10})
+        for day in range(first_hour, first_hour + 120 * DAY, DAY):
+            rows.append({"region": region, "granularity": "d", "start": day, "xp": 12_000, "events": 240})
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(RegionXPBucket), rows)
+        await db.commit()
+        before = (await db.execute(select(func.count()).select_from(RegionXPBucket))).scalar()
+        start = time.perf_counter()
+        summary = await rollups.compact(db, now)
+        elapsed = time.perf_counter() - start
+        after = (await db.execute(select(func.count()).select_from(RegionXPBucket))).scalar()
+    return before, after, elapsed, summary
+
+
+async def main():
+    await setup()
+    now = time.time()
+    rollups, award_s, flush_s = await ingest(now)
+    async with AsyncSessionLocal() as db:
+        buckets = (await db.execute(select(func.count()).select_from(RegionXPBucket))).scalar()
+
+    print(f"⏱️ {EVENTS:,} XP events over 24 h, {USERS:,} users, {len(REGIONS)} regions")
+    print(f"ingest: {award_s / EVENTS * 1e6:.2f} µs/award (journal + ledger + rollup), "
+          f"{flush_s / (EVENTS // FLUSH_EVERY) * 1000:.1f} ms/flush of {FLUSH_EVERY:,} awards, {buckets:,} bucket rows")
+
+    print(f"{'query':<34}{'median':>10}{'rows read':>12}")
+    for window in ("hour", "day", "week"):
+        ms, result = await time_query(lambda db, w=window: rollups.standings(db, w, now))
+        print(f"{'rollup window=' + window:<34}{ms:>8.2f}ms{result['buckets_read']:>12,}")
+        since = result["since"]
+        raw_stmt = (select(raw_events.c.region, func.sum(raw_events.c.xp), func.count())
+                    .where(raw_events.c.ts >= since).group_by(raw_events.c.region))
+        ms, rows = await time_query(lambda db: db.execute(raw_stmt))
+        scanned = sum(count for _, _, count in rows.all())
+        print(f"{'raw events since ' + window + ' start':<34}{ms:>8.2f}ms{scanned:>12,}")
+    all_time = select(User.region, func.sum(User.xp), func.count(User.id)).group_by(User.region)
+    ms, _ = await time_query(lambda db: db.execute(all_time))
+    print(f"{'all-time SUM(xp) over users':<34}{ms:>8.2f}ms{USERS:>12,}")
+
+    before, after, elapsed, summary = await compaction(rollups, now)
+    print(f"compaction: {before:,} -> {after:,} bucket rows in {elapsed * 1000:.0f} ms {summary}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+import json
+import timeit
+from main import MOCK_ANALYSIS, MOCK_ANALYSIS_JSON
+from raid_engine import RaidState, parse_action
+import serialization
+
+
+def bench(label, fn, number=20000):
+    seconds = min(timeit.repeat(fn, number=number, repeat=5))
+    ops = number / seconds
+    print(f"{label:<46} {ops:>12,.0f} ops/s")
+    return ops
+
+
+def raid_state() -> RaidState:
+    state = RaidState(clan_id=1)
+    for name in ("MemberA", "MemberB", "MemberC"):
+        state.add_member(name)
+    state.status = "active"
+    state.responses = ["I went to Charvak...", "...which was incredibly **serene**...", ""]
+    return state
+
+
+if __name__ == "__main__":
+    print(f"⏱️ Serialization benchmark (backend: {serialization.JSON_BACKEND})")
+
+    print("AnalysisResult")
+    data = MOCK_ANALYSIS.model_dump(mode="json")
+    bench("  json.dumps(model_dump())", lambda: json.dumps(MOCK_ANALYSIS.model_dump(mode="json")))
+    bench("  model_dump_json()", MOCK_ANALYSIS.model_dump_json)
+    bench("  serialization.dumps_bytes(dict)", lambda: serialization.dumps_bytes(data))
+    bench("  pre-encoded static_json()", lambda: serialization.static_json(MOCK_ANALYSIS_JSON))
+
+    print("Raid state_update frame")
+    state = raid_state()
+    bench("  json.dumps(to_json())", lambda: json.dumps({"type": "state_update", "data": state.to_json()}))
+    bench("  serialization.dumps(to_json())", lambda: serialization.dumps({"type": "state_update", "data": state.to_json()}))
+
+    print("Incoming raid frame")
+    frame = json.dumps({"type": "submit_part", "content": "...despite the scorching heat."})
+    bench("  json.loads (unvalidated)", lambda: json.loads(frame))
+    bench("  parse_action (decode + validate)", lambda: parse_action(frame))
@@ -0,0 +1,102 @@
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+# Cold-start benchmark. Each configuration runs in fresh processes:
+#   - import time of `main` (measured inside the child)
+#   - time from spawning uvicorn to the first 200 on GET /, and to GET /ready == 200
+# Usage: python bench_startup.py [rounds]   (default 5)
+
+ROUNDS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CONFIGS = {
+    "eager imports + eager startup": {"LAZY_IMPORTS": "0", "STARTUP_MODE": "eager"},
+    "lazy imports + eager startup": {"LAZY_IMPORTS": "1", "STARTUP_MODE": "eager"},
+    "lazy imports + deferred startup": {"LAZY_IMPORTS": "1", "STARTUP_MODE": "deferred"},
+}
+
+IMPORT_PROBE = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def child_env(config: dict, workdir: str) -> dict:
+    env = dict(os.environ, **config)
+    env.update({
+        "DATABASE_URL": f"sqlite+aiosqlite:///{workdir}/startup.db",
+        "QUESTION_BANK_PATH": f"{workdir}/question_bank.jsonl",
+        "ANALYSIS_STORE_PATH": f"{workdir}/analyses.bin",
+        "XP_JOURNAL_DIR": f"{workdir}/xp_journal",
+        "LOG_LEVEL": "WARNING",
+        "PYTHONDONTWRITEBYTECODE": "0",
+    })
+    return env
+
+
+def status(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+def serve_timings(env: dict):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    first_request = ready = None
+    try:
+        deadline = start + 60
+        while time.perf_counter() < deadline and ready is None:
+            if first_request is None and status(base + "/") == 200:
+                first_request = time.perf_counter() - start
+            if first_request is not None and status(base + "/ready") == 200:
+                ready = time.perf_counter() - start
+            time.sleep(0.005)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return first_request, ready
+
+
+if __name__ == "__main__":
+    results = {}
+    print(f"⏱️ Cold start, median of {ROUNDS} fresh processes")
+    for label, config in CONFIGS.items():
+        imports, firsts, readies = [], [], []
+        for _ in range(ROUNDS):
+            workdir = tempfile.mkdtemp(prefix="synapse-startup-")
+            env = child_env(config, workdir)
+            out = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=HERE, env=env,
+                                 capture_output=True, text=True, check=True)
+            imports.append(float(out.stdout.strip().splitlines()[-1]))
+            first, ready = serve_timings(env)
+            firsts.append(first)
+            readies.append(ready)
+        row = {
+            "import_s": round(statistics.median(imports), 3),
+            "first_request_s": round(statistics.median(firsts), 3),
+            "ready_s": round(statistics.median(readies), 3),
+        }
+        results[label] = row
+        print(f"{label:<34} import {row['import_s']:6.3f} s   first request {row['first_request_s']:6.3f} s   "
+              f"/ready {row['ready_s']:6.3f} s")
+    print(json.dumps(results))
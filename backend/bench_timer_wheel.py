@@ -0,0 +1,135 @@
+import asyncio
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from raid_engine import TimerWheel
+
+# 50k pending timers (turn deadlines + heartbeats for ~10k raids):
+# timer wheel vs one asyncio.sleep task per timer vs loop.call_later.
+# Usage: python bench_timer_wheel.py [timers]
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+TICK_S = 0.1
+
+
+def delays(n: int, seed: int = 1):
+    rng = random.Random(seed)
+    # Mostly 15 s heartbeats and 60 s turn deadlines, plus a long tail
+    return [rng.choice((15.0, 60.0, rng.uniform(0.1, 3600.0))) for _ in range(n)]
+
+
+def check_exact_firing():
+    """Every timer fires on exactly its deadline tick, including ones cascaded from upper wheels"""
+    wheel = TimerWheel(tick_s=TICK_S)
+    fired = {}
+    rng = random.Random(3)
+    timers = {}
+    for i in range(20_000):
+        delay = rng.uniform(0.05, 600.0)
+        timers[i] = wheel.call_later(delay, lambda i=i: fired.__setitem__(i, wheel.tick))
+    for i in rng.sample(range(20_000), 2_000):
+        wheel.cancel(timers.pop(i))
+    expected = {i: timer.expires for i, timer in timers.items()}
+    while wheel.pending:
+        wheel.advance()
+    assert fired == expected, "timers fired on the wrong tick"
+
+
+def traced_bytes(build) -> int:
+    """Memory retained by build()'s result (separate pass so timings run untraced)"""
+    tracemalloc.start()
+    kept = build()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return memory
+
+
+def bench_wheel(ds):
+    memory = traced_bytes(lambda: (lambda w: (w, [w.call_later(d, int) for d in ds]))(TimerWheel(tick_s=TICK_S)))
+    wheel = TimerWheel(tick_s=TICK_S)
+    start = time.perf_counter()
+    timers = [wheel.call_later(d, int) for d in ds]
+    insert = time.perf_counter() - start
+
+    # Steady state: one tick with 50k pending (mostly nothing due)
+    start = time.perf_counter()
+    ticks = 600  # one simulated minute
+    for _ in range(ticks):
+        wheel.advance()
+    per_tick = (time.perf_counter() - start) / ticks
+
+    start = time.perf_counter()
+    for timer in timers:
+        wheel.cancel(timer)
+    cancel = time.perf_counter() - start
+    return insert, cancel, per_tick, memory, wheel.fired
+
+
+async def bench_sleep_tasks(ds):
+    async def sleeper(d):
+        await asyncio.sleep(d)
+
+    tracemalloc.start()
+    probe = [asyncio.ensure_future(sleeper(d)) for d in ds]
+    await asyncio.sleep(0)  # let every task reach its sleep
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    for task in probe:
+        task.cancel()
+    await asyncio.gather(*probe, return_exceptions=True)
+    del probe
+
+    start = time.perf_counter()
+    tasks = [asyncio.ensure_future(sleeper(d)) for d in ds]
+    await asyncio.sleep(0)
+    insert = time.perf_counter() - start
+    start = time.perf_counter()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    cancel = time.perf_counter() - start
+    return insert, cancel, memory
+
+
+async def bench_call_later(ds):
+    loop = asyncio.get_running_loop()
+    tracemalloc.start()
+    probe = [loop.call_later(d, int) for d in ds]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    for handle in probe:
+        handle.cancel()
+    del probe
+    start = time.perf_counter()
+    handles = [loop.call_later(d, int) for d in ds]
+    insert = time.perf_counter() - start
+    start = time.perf_counter()
+    for handle in handles:
+        handle.cancel()
+    cancel = time.perf_counter() - start
+    return insert, cancel, memory
+
+
+def per_op_us(seconds: float) -> float:
+    return seconds / N * 1e6
+
+
+if __name__ == "__main__":
+    check_exact_firing()
+    ds = delays(N)
+    insert, cancel, per_tick, memory, fired = bench_wheel(ds)
+    s_insert, s_cancel, s_memory = asyncio.run(bench_sleep_tasks(ds))
+    c_insert, c_cancel, c_memory = asyncio.run(bench_call_later(ds))
+
+    print(f"⏱️ {N:,} pending timers (exact-firing check passed)")
+    print(f"{'':<24}{'insert':>12}{'cancel':>12}{'memory':>12}")
+    print(f"{'timer wheel':<24}{per_op_us(insert):>9.2f} µs{per_op_us(cancel):>9.2f} µs{memory / 1e6:>9.1f} MB")
+    print(f"{'asyncio.sleep tasks':<24}{per_op_us(s_insert):>9.2f} µs{per_op_us(s_cancel):>9.2f} µs{s_memory / 1e6:>9.1f} MB")
+    print(f"{'loop.call_later':<24}{per_op_us(c_insert):>9.2f} µs{per_op_us(c_cancel):>9.2f} µs{c_memory / 1e6:>9.1f} MB")
+    print(f"wheel tick with {N:,} pending: {per_tick * 1e6:.1f} µs avg over 600 ticks ({fired:,} fired)")
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import httpx
+from pypdf import PdfWriter
+
+# Peak server RSS while CONCURRENT clients upload SIZE_MB (decimal MB) textbook PDFs to
+# /api/refine-content. Each configuration runs in a fresh uvicorn process;
+# the peak (VmHWM) is read before and after the uploads.
+# Usage: python bench_uploads.py [concurrent] [size_mb]
+
+CONCURRENT = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+SIZE_MB = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+HERE = os.path.dirname(os.path.abspath(__file__))
+MiB = 1024 * 1024
+
+CONFIGS = {
+    "whole upload in memory": {"UPLOAD_SPOOL_MAX_BYTES": str(4096 * MiB)},
+    "1 MiB spool + mmap (default)": {},
+    f"limit {SIZE_MB // 2} MB (413)": {"UPLOAD_MAX_PDF_BYTES": str(SIZE_MB // 2 * 1_000_000)},
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def textbook_pdf(path: str, size_mb: int):
+    """A one-page PDF carrying size_mb of incompressible embedded data (scanned-textbook sized)"""
+    writer = PdfWriter()
+    writer.add_blank_page(595, 842)
+    writer.add_attachment("scans.bin", os.urandom(size_mb * 1_000_000))
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def peak_rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def wait_ready(base: str, timeout_s: float = 60):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(base + "/ready", timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError("server did not become ready")
+
+
+async def upload_all(base: str, path: str):
+    async with httpx.AsyncClient(base_url=base, timeout=300) as client:
+        async def one(i: int):
+            with open(path, "rb") as f:
+                response = await client.post("/api/refine-content", files={"file": (f"book{i}.pdf", f, "application/pdf")})
+            return response.status_code
+
+        start = time.perf_counter()
+        statuses = await asyncio.gather(*(one(i) for i in range(CONCURRENT)))
+        return statuses, time.perf_counter() - start
+
+
+def run(config: dict, workdir: str, path: str):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, **config)
+    env.update({
+        "DATABASE_URL": f"sqlite+aiosqlite:///{workdir}/uploads.db",
+        "QUESTION_BANK_PATH": f"{workdir}/question_bank.jsonl",
+        "ANALYSIS_STORE_PATH": f"{workdir}/analyses.bin",
+        "XP_JOURNAL_DIR": f"{workdir}/xp_journal",
+        "OPENAI_API_KEY": "",  # text extraction only; quests fall back to the canned set
+        "LOG_LEVEL": "WARNING",
+        "TMPDIR": workdir,
+    })
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_ready(base)
+        idle = peak_rss_mb(proc.pid)
+        statuses, elapsed = asyncio.run(upload_all(base, path))
+        peak = peak_rss_mb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return idle, peak, statuses, elapsed
+
+
+if __name__ == "__main__":
+    workdir = tempfile.mkdtemp(prefix="synapse-uploads-")
+    path = os.path.join(workdir, "textbook.pdf")
+    textbook_pdf(path, SIZE_MB)
+    size = os.path.getsize(path) / 1e6
+    print(f"⏱️ {CONCURRENT} concurrent uploads of a {size:.0f} MB PDF, peak server RSS")
+    print(f"{'config':<32}{'idle':>10}{'peak':>10}{'growth':>10}{'wall':>9}  statuses")
+    for label, config in CONFIGS.items():
+        idle, peak, statuses, elapsed = run(config, workdir, path)
+        print(f"{label:<32}{idle:>7.0f} MB{peak:>7.0f} MB{peak - idle:>7.0f} MB{elapsed:>8.2f}s  {sorted(set(statuses))}")
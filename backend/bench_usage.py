@@ -0,0 +1,75 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+# Point the database at a scratch file before database.py is imported
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='synapse-usage-')}/usage.db")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from sqlalchemy import insert
+
+from database import AsyncSessionLocal, Base, engine
+from models import UsageRecord, User
+from usage_accounting import UsageAccountant, UsageContext
+
+# Usage accounting costs on the request path and the write path:
+#   - budget check per request (dict lookup) with 100k users tracked
+#   - N usage records written one commit each vs buffered and flushed in one insert
+# Usage: python bench_usage.py [records]
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+USERS = 100_000
+
+
+async def seed_users(count: int):
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), [{"username": f"user{i}", "clan_id": i % 50 or None} for i in range(count)])
+        await db.commit()
+
+
+async def per_row_writes(n: int) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        async with AsyncSessionLocal() as db:
+            db.add(UsageRecord(endpoint="combat-voice", model="gpt-4o-mini", username=f"user{i % 1000}",
+                               prompt_tokens=300, completion_tokens=80, latency_ms=40.0))
+            await db.commit()
+    return time.perf_counter() - start
+
+
+async def batched_writes(n: int) -> float:
+    accountant = UsageAccountant()
+    for i in range(n):
+        accountant.record("gpt-4o-mini", 300, 80, 0.04, contexts=[UsageContext("combat-voice", f"user{i % 1000}", f"user{i % 1000}")])
+    start = time.perf_counter()
+    await accountant.flush()
+    return time.perf_counter() - start
+
+
+async def main():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await seed_users(1000)
+
+    accountant = UsageAccountant(daily_token_budget=50_000)
+    for i in range(USERS):
+        accountant.record("gpt-4o-mini", 300, 80, 0.04, contexts=[UsageContext("combat-voice", f"user{i}", f"user{i}")])
+    accountant.pending.clear()
+    loops = 200_000
+    check_s = timeit.timeit(lambda: accountant.check_budget("user4242"), number=loops) / loops
+
+    row_s = await per_row_writes(N)
+    batch_s = await batched_writes(N)
+
+    print(f"⏱️ Usage accounting ({USERS:,} users with spend today, {N:,} records)")
+    print(f"budget check per request: {check_s * 1e9:.0f} ns")
+    print(f"per-row commits:  {row_s * 1000:8.1f} ms  ({row_s / N * 1e6:7.1f} µs/record)")
+    print(f"batched flush:    {batch_s * 1000:8.1f} ms  ({batch_s / N * 1e6:7.1f} µs/record)  "
+          f"{row_s / max(batch_s, 1e-9):.0f}x fewer seconds")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
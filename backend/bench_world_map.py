@@ -0,0 +1,149 @@
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Scratch database before database.py is imported
+WORKDIR = tempfile.mkdtemp(prefix="synapse-worldmap-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{WORKDIR}/worldmap.db")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from database import AsyncSessionLocal, Base, engine
+from serialization import dumps_bytes
+from world_map import HEX_DIRECTIONS, UNLOCKED, WorldMap, WorldMaps, layout
+
+# A NODES-quest map (default 10k), played to the end in unlock order:
+#   - layout build (spiral + coordinate index + neighbour lists) and map build
+#   - coordinate -> node lookup: index vs scanning the node list (what the client does today)
+#   - completing a node: neighbour lists vs scanning every node for adjacent locked ones
+#   - stored size and a persisted completion / cold load through SQLite
+# Usage: python bench_world_map.py [nodes]
+
+NODES = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+SCAN_SAMPLES = 300
+DB_COMPLETIONS = 300
+TYPES = ("vocabulary", "grammar", "phonetics", "coherence")
+
+
+def quests(count: int, rng: random.Random):
+    return [{
+        "id": f"q_{i}",
+        "type": TYPES[i % len(TYPES)],
+        "title": f"Quest {i}",
+        "description": "Master complex academic words in context.",
+        "difficulty": round(rng.uniform(5.0, 8.5), 1),
+        "rewards": {"xp": rng.randint(100, 200), "sanity": 10},
+    } for i in range(count)]
+
+
+def per_op_us(elapsed: float, ops: int) -> float:
+    return elapsed / ops * 1e6
+
+
+def scan_complete(nodes, i):
+    """Unlocking without an index: every node is checked for adjacency to node i"""
+    q, r = nodes[i]["coordinates"]["q"], nodes[i]["coordinates"]["r"]
+    nodes[i]["status"] = "completed"
+    unlocked = []
+    for node in nodes:
+        dq, dr = node["coordinates"]["q"] - q, node["coordinates"]["r"] - r
+        if (dq, dr) in HEX_DIRECTIONS and node["status"] == "locked":
+            node["status"] = "unlocked"
+            unlocked.append(node["id"])
+    return unlocked
+
+
+def play_order(world: WorldMap, rng: random.Random):
+    """Complete a random unlocked node until none is left; returns the ids in order"""
+    frontier = [world.nodes[i]["id"] for i in range(len(world.nodes)) if world.status[i] == UNLOCKED]
+    order = []
+    while frontier:
+        node_id = frontier.pop(rng.randrange(len(frontier)))
+        order.append(node_id)
+        frontier.extend(world.nodes[j]["id"] for j in world.complete(node_id))
+    return order
+
+
+async def persisted(defs, order):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    maps = WorldMaps()
+    async with AsyncSessionLocal() as db:
+        start = time.perf_counter()
+        world = await maps.replace(db, "bench", defs)
+        build_s = time.perf_counter() - start
+        samples = []
+        for node_id in order[:DB_COMPLETIONS]:
+            start = time.perf_counter()
+            await maps.complete(db, world, "bench", node_id)
+            samples.append(time.perf_counter() - start)
+    maps.maps.clear()
+    async with AsyncSessionLocal() as db:
+        start = time.perf_counter()
+        await maps.get(db, "bench")
+        load_s = time.perf_counter() - start
+    return build_s, statistics.median(samples), load_s
+
+
+def main():
+    rng = random.Random(7)
+    defs = quests(NODES, rng)
+    print(f"⏱️ world map with {NODES:,} quest nodes")
+
+    start = time.perf_counter()
+    hexes = layout(NODES)  # cold: built once per size
+    layout_s = time.perf_counter() - start
+    start = time.perf_counter()
+    world = WorldMap.build(defs)
+    build_s = time.perf_counter() - start
+    rings = max(max(abs(q), abs(r), abs(q + r)) for q, r in hexes.coords)
+    print(f"layout: {layout_s * 1000:.1f} ms ({rings} rings, cached per size); "
+          f"map build on the cached layout: {build_s * 1000:.1f} ms")
+
+    start = time.perf_counter()
+    nodes = world.to_list()
+    print(f"to_list (GET /api/world-map body): {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    probes = [hexes.coords[rng.randrange(NODES)] for _ in range(SCAN_SAMPLES)]
+    start = time.perf_counter()
+    for q, r in probes:
+        next(n for n in nodes if n["coordinates"]["q"] == q and n["coordinates"]["r"] == r)
+    scan_us = per_op_us(time.perf_counter() - start, len(probes))
+    start = time.perf_counter()
+    for _ in range(100):
+        for q, r in probes:
+            hexes.at(q, r)
+    index_us = per_op_us(time.perf_counter() - start, 100 * len(probes))
+    print(f"{'coord lookup':<26}{'scan':>12}{scan_us:>10.1f} µs   index{index_us:>8.3f} µs")
+
+    playthrough = WorldMap.build(defs)
+    start = time.perf_counter()
+    order = play_order(playthrough, rng)
+    play_s = time.perf_counter() - start
+    assert len(order) == NODES, "every node must become reachable"
+
+    scan_nodes = world.to_list()
+    index_of = {node["id"]: i for i, node in enumerate(scan_nodes)}
+    start = time.perf_counter()
+    for node_id in order[:SCAN_SAMPLES]:
+        scan_complete(scan_nodes, index_of[node_id])
+    naive_us = per_op_us(time.perf_counter() - start, SCAN_SAMPLES)
+    indexed_us = per_op_us(play_s, NODES)
+    print(f"{'complete + unlock':<26}{'scan':>12}{naive_us:>10.1f} µs   index{indexed_us:>8.3f} µs"
+          f"  (full playthrough {play_s * 1000:.0f} ms vs ~{naive_us * NODES / 1e6:.1f} s)")
+
+    nodes_blob, status_blob = playthrough.encode()
+    full = dumps_bytes(playthrough.to_list())
+    print(f"stored: {len(nodes_blob) / 1024:.0f} KiB quests + {len(status_blob) / 1024:.1f} KiB status "
+          f"(full node JSON {len(full) / 1024:.0f} KiB); a completion rewrites {len(status_blob) / 1024:.1f} KiB")
+
+    build_db_s, complete_db_s, load_s = asyncio.run(persisted(defs, order))
+    print(f"sqlite: replace {build_db_s * 1000:.1f} ms, persisted completion {complete_db_s * 1000:.2f} ms (median), "
+          f"cold load {load_s * 1000:.1f} ms; layouts cached: {layout.cache_info().currsize}")
+
+
+if __name__ == "__main__":
+    main()
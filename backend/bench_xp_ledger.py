@@ -0,0 +1,123 @@
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Scratch database and journal before database.py / xp_ledger.py are imported
+WORKDIR = tempfile.mkdtemp(prefix="synapse-xp-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{WORKDIR}/xp.db")
+os.environ.setdefault("XP_JOURNAL_DIR", f"{WORKDIR}/xp_journal")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import OperationalError
+
+from database import AsyncSessionLocal, Base, engine
+from models import User
+from xp_ledger import XPLedger, XP_FLUSH_INTERVAL_S
+
+# Sustained XP award throughput on raid night over USERS users, issued by
+# CONCURRENCY concurrent writers.
+#   - direct: each award is its own read-modify-write transaction on users.xp
+#     (AWARDS awards; concurrent read-modify-writes also lose updates)
+#   - ledger: journal append + in-memory sum, flushed every XP_FLUSH_INTERVAL_S
+#     (LEDGER_FACTOR x AWARDS awards, so the run spans several flushes)
+# Usage: python bench_xp_ledger.py [awards] [users]
+
+AWARDS = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+USERS = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000
+CONCURRENCY = 32
+LEDGER_FACTOR = 50
+
+
+def workload(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    # Raid squads hit the same few hundred users repeatedly
+    hot = max(1, USERS // 10)
+    return [(f"user{rng.randrange(hot) if rng.random() < 0.8 else rng.randrange(USERS)}", rng.randint(10, 120))
+            for _ in range(count)]
+
+
+async def reset_users():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), [{"username": f"user{i}", "xp": 0} for i in range(USERS)])
+        await db.commit()
+
+
+async def total_xp() -> int:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(func.sum(User.xp)))).scalar() or 0
+
+
+async def run_concurrently(awards, award_fn):
+    queue = list(reversed(awards))
+
+    async def worker():
+        while queue:
+            username, delta = queue.pop()
+            await award_fn(username, delta)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return time.perf_counter() - start
+
+
+async def bench_direct(awards):
+    await reset_users()
+
+    failed = 0
+
+    async def award(username, delta):
+        nonlocal failed
+        try:
+            async with AsyncSessionLocal() as db:
+                user = (await db.execute(select(User).where(User.username == username))).scalars().first()
+                user.xp = (user.xp or 0) + delta
+                await db.commit()
+        except OperationalError:  # "database is locked": SQLite's single writer timed out
+            failed += 1
+
+    elapsed = await run_concurrently(awards, award)
+    return elapsed, await total_xp(), failed
+
+
+async def bench_ledger(awards):
+    await reset_users()
+    ledger = XPLedger(os.environ["XP_JOURNAL_DIR"])
+    await ledger.start()
+
+    async def award(username, delta):
+        ledger.award(username, delta, "bench")
+        await asyncio.sleep(0)  # yield like a request handler would
+
+    elapsed = await run_concurrently(awards, award)
+    start = time.perf_counter()
+    await ledger.stop()
+    drain = time.perf_counter() - start
+    return elapsed, drain, await total_xp(), ledger.stats()
+
+
+async def main():
+    awards = workload(AWARDS)
+    expected = sum(delta for _, delta in awards)
+    direct_s, direct_total, direct_failed = await bench_direct(awards)
+
+    ledger_awards = workload(AWARDS * LEDGER_FACTOR, seed=2)
+    ledger_expected = sum(delta for _, delta in ledger_awards)
+    ledger_s, drain_s, ledger_total, stats = await bench_ledger(ledger_awards)
+    assert ledger_total == ledger_expected, "ledger lost awards"
+
+    print(f"⏱️ XP awards over {USERS:,} users, {CONCURRENCY} concurrent writers")
+    print(f"direct read-modify-write: {AWARDS / direct_s:>10,.0f} awards/s  ({AWARDS:,} awards in {direct_s:.2f} s, "
+          f"{direct_failed:,} failed with 'database is locked', {1 - direct_total / expected:.1%} of XP lost)")
+    print(f"write-behind ledger:      {len(ledger_awards) / ledger_s:>10,.0f} awards/s  ({len(ledger_awards):,} awards in "
+          f"{ledger_s:.2f} s, {stats['flushes']} flushes, final flush {drain_s * 1000:.0f} ms, no XP lost)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
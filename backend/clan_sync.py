@@ -0,0 +1,128 @@
+from typing import Dict, Optional, Tuple
+import numpy as np
+from sqlalchemy import Float, bindparam, case, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Clan, User, STAT_FIELDS
+from logging_setup import get_logger
+
+log = get_logger("synapse.clan_sync")
+
+# Clan Sync Level = per-axis mean of member stats.
+#   - Incremental: member_joined / member_left / member_stats_changed run one
+#     UPDATE that adjusts the stored means in O(1) using Clan.member_count (no
+#     member scan). The arithmetic runs in SQL on the row's current values, so
+#     concurrent joins can't lose each other's update.
+#   - Bulk: recompute_all_clans rebuilds every clan from users with NumPy
+#     (nightly job; also corrects any drift in the incremental path).
+
+
+def _stat(stats: Optional[Dict], field: str) -> float:
+    return float((stats or {}).get(field, 0) or 0)
+
+
+# Compiled once; per-call values are bound parameters (b_id, b_<field>, b_old_<field>)
+_clans = Clan.__table__
+_count = func.coalesce(_clans.c.member_count, 0)
+
+
+def _mean(field: str):
+    return func.coalesce(_clans.c[f"sync_{field}"], 0.0)
+
+
+def _stat_param(prefix: str, field: str):
+    return bindparam(f"{prefix}{field}", type_=Float)
+
+
+_by_id = update(_clans).where(_clans.c.id == bindparam("b_id"))
+
+_join = _by_id.values(
+    member_count=_count + 1,
+    **{f"sync_{f}": (_mean(f) * _count + _stat_param("b_", f)) / (_count + 1) for f in STAT_FIELDS},
+)
+_leave = _by_id.values(
+    member_count=case((_count <= 1, 0), else_=_count - 1),
+    **{f"sync_{f}": case((_count <= 1, 0.0), else_=(_mean(f) * _count - _stat_param("b_", f)) / (_count - 1))
+       for f in STAT_FIELDS},
+)
+_change = _by_id.values(
+    member_count=case((_count == 0, 1), else_=_count),
+    **{f"sync_{f}": case((_count == 0, _stat_param("b_", f)),
+                         else_=_mean(f) + (_stat_param("b_", f) - _stat_param("b_old_", f)) / _count)
+       for f in STAT_FIELDS},
+)
+
+
+def _params(clan_id: int, stats: Optional[Dict], old_stats: Optional[Dict] = None) -> Dict:
+    params = {"b_id": clan_id, **{f"b_{f}": _stat(stats, f) for f in STAT_FIELDS}}
+    if old_stats is not None:
+        params.update({f"b_old_{f}": _stat(old_stats, f) for f in STAT_FIELDS})
+    return params
+
+
+async def member_joined(db: AsyncSession, clan_id: int, stats: Optional[Dict]):
+    """Fold a new member into the clan's means"""
+    await db.execute(_join, _params(clan_id, stats))
+
+
+async def member_left(db: AsyncSession, clan_id: int, stats: Optional[Dict]):
+    """Remove a member from the clan's means (the last one resets them to 0)"""
+    await db.execute(_leave, _params(clan_id, stats))
+
+
+async def member_stats_changed(db: AsyncSession, clan_id: int, old_stats: Optional[Dict], new_stats: Optional[Dict]):
+    """Shift the clan's means by one member's stat change"""
+    await db.execute(_change, _params(clan_id, new_stats, old_stats or {}))
+
+
+async def set_user_stats(db: AsyncSession, user: User, new_stats: Dict):
+    """Update a user's stats and fold the delta into their clan, in the caller's transaction"""
+    old_stats = user.stats
+    user.stats = new_stats
+    if user.clan_id is not None:
+        await member_stats_changed(db, user.clan_id, old_stats, user.stats)
+
+
+def compute_sync_levels(member_clan: np.ndarray, member_stats: np.ndarray, n_clans: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    member_clan: (m,) dense clan index per member, in [0, n_clans)
+    member_stats: (m, len(STAT_FIELDS)) float stats per member
+    Returns (means (n_clans, k), counts (n_clans,)); clans without members get 0.
+    """
+    counts = np.bincount(member_clan, minlength=n_clans)
+    sums = np.empty((n_clans, member_stats.shape[1]), dtype=np.float64)
+    for axis in range(member_stats.shape[1]):
+        sums[:, axis] = np.bincount(member_clan, weights=member_stats[:, axis], minlength=n_clans)
+    means = np.divide(sums, counts[:, None], out=np.zeros_like(sums), where=counts[:, None] > 0)
+    return means, counts
+
+
+async def recompute_all_clans(db: AsyncSession) -> int:
+    """Rebuild every clan's sync level from its members. Returns clans updated."""
+    clan_ids = np.fromiter((await db.execute(select(Clan.id).order_by(Clan.id))).scalars(), dtype=np.int64)
+    if clan_ids.size == 0:
+        return 0
+
+    rows = (await db.execute(
+        select(User.clan_id, *(getattr(User, field) for field in STAT_FIELDS)).where(User.clan_id.is_not(None))
+    )).all()
+    if rows:
+        raw = np.array(rows, dtype=np.float64)
+        raw = np.nan_to_num(raw)  # NULL stats count as 0
+        member_clan = np.searchsorted(clan_ids, raw[:, 0].astype(np.int64))
+        # Members pointing at a deleted clan are ignored
+        valid = (member_clan < clan_ids.size) & (clan_ids[np.minimum(member_clan, clan_ids.size - 1)] == raw[:, 0])
+        means, counts = compute_sync_levels(member_clan[valid], raw[valid, 1:], clan_ids.size)
+    else:
+        means = np.zeros((clan_ids.size, len(STAT_FIELDS)))
+        counts = np.zeros(clan_ids.size, dtype=np.int64)
+
+    params = [
+        {"id": int(cid), "member_count": int(count),
+         **{f"sync_{field}": float(value) for field, value in zip(STAT_FIELDS, mean)}}
+        for cid, mean, count in zip(clan_ids.tolist(), means, counts.tolist())
+    ]
+    await db.execute(update(Clan), params)  # ORM bulk UPDATE by primary key
+    await db.commit()
+    log.info("clan_sync_recomputed", clans=len(params), members=len(rows))
+    return len(params)
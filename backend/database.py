@@ -1,10 +1,16 @@
+from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 import os
+from instrumentation import instrument_engine
+from startup import readiness
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Statement logging is off on the hot path; enable it through the logging queue
+# with LOG_LEVELS=sqlalchemy.engine=INFO (or SQL_ECHO=1 for synchronous echo while debugging)
+engine = create_async_engine(DATABASE_URL, echo=os.getenv("SQL_ECHO", "") == "1")
+instrument_engine(engine)
 
 AsyncSessionLocal = async_sessionmaker(
     bind=engine,
@@ -15,5 +21,9 @@ AsyncSessionLocal = async_sessionmaker(
 Base = declarative_base()
 
 async def get_db():
+    # With STARTUP_MODE=deferred the first requests can arrive before the schema check
+    await readiness.wait("schema")
+    if readiness.failed("schema"):
+        raise HTTPException(status_code=503, detail="Database unavailable: schema setup failed")
     async with AsyncSessionLocal() as session:
         yield session
@@ -0,0 +1,74 @@
+from pydantic import BaseModel, ConfigDict
+from typing import Dict, List, Optional, Tuple
+from types import MappingProxyType
+from functools import lru_cache
+import json
+import os
+
+# Enemy archetypes live in a data file so new demons can ship without code changes.
+# Override the location with SYNAPSE_ENEMIES_PATH to load a custom roster.
+ENEMIES_PATH = os.getenv(
+    "SYNAPSE_ENEMIES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "enemies.json"),
+)
+
+
+class CustomEnemy(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    name: str
+    type: str
+    description: str
+    weakness: str
+    hp: int
+    image: str
+    color: str
+
+
+def load_registry(path: str = ENEMIES_PATH) -> Tuple[MappingProxyType, Tuple[Tuple[str, str], ...], str]:
+    """
+    Load and validate the enemy roster.
+    Returns (key -> CustomEnemy, ordered (keyword, key) rules, default key).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+
+    enemies: Dict[str, CustomEnemy] = {}
+    rules: List[Tuple[str, str]] = []
+    for archetype in raw["archetypes"]:
+        key = archetype["key"]
+        if key in enemies:
+            raise ValueError(f"Duplicate enemy archetype: {key}")
+        enemies[key] = CustomEnemy(**archetype["enemy"])
+        # Keyword order in the file is match priority (first hit wins)
+        for keyword in archetype.get("keywords", [key]):
+            rules.append((keyword, key))
+
+    default_key = raw.get("default") or raw["archetypes"][0]["key"]
+    if default_key not in enemies:
+        raise ValueError(f"Default enemy '{default_key}' is not in the roster")
+
+    return MappingProxyType(enemies), tuple(rules), default_key
+
+
+# Built once at import; a broken data file fails fast on startup instead of mid-request
+ENEMIES, _RULES, DEFAULT_ENEMY_KEY = load_registry()
+
+
+@lru_cache(maxsize=1024)
+def classify_error_type(err_type: str) -> str:
+    """
+    Map a GPT error type (e.g. "Subject-Verb Agreement") to an archetype key.
+    The keyword scan runs once per distinct string; repeats are a cache hit.
+    """
+    for keyword, key in _RULES:
+        if keyword in err_type:
+            return key
+    return DEFAULT_ENEMY_KEY
+
+
+def enemy_for_error(error: Optional[Dict]) -> CustomEnemy:
+    """Return the shared (immutable) enemy for an error dict"""
+    if not error:
+        return ENEMIES[DEFAULT_ENEMY_KEY]
+    return ENEMIES[classify_error_type(error.get("type", "") or "")]
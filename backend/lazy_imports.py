@@ -0,0 +1,79 @@
+from types import ModuleType
+from typing import Any, Dict, Optional
+import importlib
+import os
+import sys
+import threading
+
+# Heavy, rarely-first-needed dependencies (openai ~0.4 s, pypdf) are imported on
+# first attribute access instead of at module load, so workers start serving sooner.
+#   openai = lazy_import("openai")
+#   openai.api_key = KEY                  # remembered and applied once loaded
+#   openai.chat.completions.create(...)   # first use imports the real module
+# LAZY_IMPORTS=0 imports everything eagerly (import errors surface at boot).
+
+LAZY_IMPORTS = os.getenv("LAZY_IMPORTS", "1") != "0"
+
+
+class LazyModule:
+    """
+    Module proxy that imports on first use. Unlike importlib.util.LazyLoader it
+    is safe to trigger from several threads at once (asyncio.to_thread callers).
+    """
+
+    def __init__(self, name: str):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+        object.__setattr__(self, "_pending", {})
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _load(self) -> ModuleType:
+        with self._lock:
+            if self._module is None:
+                module = importlib.import_module(self._name)
+                for attr, value in self._pending.items():
+                    setattr(module, attr, value)
+                self._pending.clear()
+                object.__setattr__(self, "_module", module)
+        return self._module
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._module or self._load(), attr)
+
+    def __setattr__(self, attr: str, value: Any):
+        with self._lock:
+            if self._module is None:
+                self._pending[attr] = value
+                return
+        setattr(self._module, attr, value)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+_proxies: Dict[str, LazyModule] = {}
+
+
+def lazy_import(name: str):
+    """Return the module if already imported, else a shared LazyModule proxy"""
+    module: Optional[ModuleType] = sys.modules.get(name)
+    if module is not None:
+        return module
+    if not LAZY_IMPORTS:
+        return importlib.import_module(name)
+    return _proxies.setdefault(name, LazyModule(name))
+
+
+def ensure_loaded(module) -> ModuleType:
+    """Force the import now (used to warm dependencies after startup)"""
+    if isinstance(module, LazyModule):
+        return module._load()
+    return module
+
+
+def is_loaded(name: str) -> bool:
+    proxy = _proxies.get(name)
+    if proxy is not None:
+        return proxy._module is not None
+    return name in sys.modules
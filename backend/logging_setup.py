@@ -0,0 +1,170 @@
+from typing import Any, Dict
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import sys
+
+# Structured, non-blocking logging.
+#   - Request code only enqueues records; a background thread formats and writes them.
+#   - LOG_LEVEL sets the root level; LOG_LEVELS="raid_engine=DEBUG,sqlalchemy.engine=INFO"
+#     sets per-module levels. LOG_LEVEL=OFF silences everything.
+#   - High-frequency events pass `sample=0.01`; LOG_SAMPLING="state_update=0.1" overrides per event.
+#   - Transcripts and other learner content are redacted unless LOG_REDACT=0.
+#   - LOG_FORMAT=json (default) or text.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+LOG_REDACT = os.getenv("LOG_REDACT", "1") != "0"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+REDACTED_FIELDS = frozenset({"transcript", "content", "responses", "update", "text", "prompt"})
+
+_RESERVED = frozenset(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+
+def _parse_pairs(raw: str) -> Dict[str, str]:
+    pairs = {}
+    for item in raw.split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+_SAMPLE_OVERRIDES = {event: float(rate) for event, rate in _parse_pairs(LOG_SAMPLING).items()}
+
+
+def redact(value: Any) -> str:
+    size = len(value) if hasattr(value, "__len__") else 0
+    return f"<redacted len={size}>"
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """
+    log.info("transcript_received", transcript=text, chars=len(text))
+    The message is an event name; keyword arguments become structured fields.
+    """
+
+    def __init__(self, logger: logging.Logger):
+        super().__init__(logger, {})
+
+    def log(self, level, event, *args, sample: float = 1.0, exc_info=None, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        rate = _SAMPLE_OVERRIDES.get(event, sample)
+        if rate < 1.0 and random.random() >= rate:
+            return
+        if rate < 1.0:
+            fields["sample_rate"] = rate
+        self.logger.log(level, event, *args, exc_info=exc_info, extra={"fields": fields}, stacklevel=3)
+
+    def debug(self, event, *args, **kwargs):
+        self.log(logging.DEBUG, event, *args, **kwargs)
+
+    def info(self, event, *args, **kwargs):
+        self.log(logging.INFO, event, *args, **kwargs)
+
+    def warning(self, event, *args, **kwargs):
+        self.log(logging.WARNING, event, *args, **kwargs)
+
+    def error(self, event, *args, **kwargs):
+        self.log(logging.ERROR, event, *args, **kwargs)
+
+    def exception(self, event, *args, **kwargs):
+        self.log(logging.ERROR, event, *args, exc_info=True, **kwargs)
+
+
+def _fields(record: logging.LogRecord) -> Dict[str, Any]:
+    fields = dict(getattr(record, "fields", None) or {})
+    # Records from third-party loggers carry their extras as plain attributes
+    for key, value in record.__dict__.items():
+        if key not in _RESERVED and key != "fields":
+            fields[key] = value
+    if LOG_REDACT:
+        for key in REDACTED_FIELDS.intersection(fields):
+            fields[key] = redact(fields[key])
+    return fields
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        payload.update(_fields(record))
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{k}={v}" for k, v in _fields(record).items())
+        line = f"{self.formatTime(record)} {record.levelname:<7} {record.name}: {record.getMessage()} {fields}".rstrip()
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Drops (and counts) records when the writer falls behind instead of stalling requests"""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens on the writer thread; only resolve %-args here
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _NonBlockingQueueHandler.dropped += 1
+
+
+_listener: QueueListener = None
+
+
+def configure_logging():
+    """Install the queue-based root handler once (safe to call repeatedly)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _listener = QueueListener(log_queue, stream, respect_handler_level=False)
+
+    root = logging.getLogger()
+    root.handlers[:] = [_NonBlockingQueueHandler(log_queue)]
+    root.setLevel(logging.CRITICAL + 1 if LOG_LEVEL == "OFF" else LOG_LEVEL)
+    for name, level in _parse_pairs(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> StructuredLogger:
+    return StructuredLogger(logging.getLogger(name))
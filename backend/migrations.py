@@ -0,0 +1,57 @@
+from sqlalchemy import inspect, text
+import json
+
+from database import Base
+from models import STAT_FIELDS
+from logging_setup import get_logger
+
+log = get_logger("synapse.migrations")
+
+# create_all() only creates missing tables. This adds columns/indexes that newer
+# models introduced to tables that already exist (e.g. an old test.db), and moves
+# legacy JSON data into them. Runs inside engine.begin() via conn.run_sync().
+
+
+def upgrade_schema(conn) -> bool:
+    """Returns True if anything was added (callers may then rebuild derived data)"""
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    changed = False
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        added = set()
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            col_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+            log.info("column_added", table=table.name, column=column.name)
+            added.add(column.name)
+            changed = True
+        existing_indexes = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(conn)
+                log.info("index_added", table=table.name, index=index.name)
+                changed = True
+
+        if table.name == "users" and "stats" in existing and added.intersection(STAT_FIELDS):
+            _backfill_user_stats(conn)
+
+    return changed
+
+
+def _backfill_user_stats(conn):
+    """Copy the legacy users.stats JSON blob into the typed stat columns"""
+    rows = conn.execute(text("SELECT id, stats FROM users WHERE stats IS NOT NULL")).all()
+    params = []
+    for user_id, raw in rows:
+        stats = json.loads(raw) if isinstance(raw, str) else (raw or {})
+        params.append({"id": user_id, **{field: float(stats.get(field, 0) or 0) for field in STAT_FIELDS}})
+    if params:
+        assignments = ", ".join(f"{field} = :{field}" for field in STAT_FIELDS)
+        conn.execute(text(f"UPDATE users SET {assignments} WHERE id = :id"), params)
+    log.info("legacy_stats_backfilled", users=len(params))
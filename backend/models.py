@@ -1,8 +1,11 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, JSON, DateTime
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
 
+# The three Sync axes, stored as typed columns so they can be aggregated/indexed in SQL
+STAT_FIELDS = ("vocabulary", "syntax", "fluency")
+
 class Clan(Base):
     __tablename__ = "clans"
 
@@ -11,13 +14,25 @@ class Clan(Base):
     sanity_meter = Column(Float, default=100.0)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     
-    # "Sync Level" stored as JSON: {"vocabulary": 50, "syntax": 50, "fluency": 50}
-    sync_level = Column(JSON, default={"vocabulary": 0, "syntax": 0, "fluency": 0})
+    # "Sync Level" = mean of member stats, maintained by clan_sync
+    sync_vocabulary = Column(Float, default=0.0)
+    sync_syntax = Column(Float, default=0.0)
+    sync_fluency = Column(Float, default=0.0)
+    member_count = Column(Integer, default=0) # members folded into the sync means
     
     region = Column(String, default="Tashkent") # e.g., Tashkent, Samarkand, Namangan
     
     members = relationship("User", back_populates="clan")
 
+    @property
+    def sync_level(self):
+        return {field: getattr(self, f"sync_{field}") or 0.0 for field in STAT_FIELDS}
+
+    @sync_level.setter
+    def sync_level(self, values):
+        for field in STAT_FIELDS:
+            setattr(self, f"sync_{field}", float((values or {}).get(field, 0)))
+
 class User(Base):
     __tablename__ = "users"
 
@@ -25,7 +40,7 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     telegram_id = Column(String, unique=True, nullable=True)
     
-    clan_id = Column(Integer, ForeignKey("clans.id"), nullable=True)
+    clan_id = Column(Integer, ForeignKey("clans.id"), nullable=True, index=True)
     clan = relationship("Clan", back_populates="members")
     
     xp = Column(Integer, default=0)
@@ -34,8 +49,74 @@ class User(Base):
     
     region = Column(String, default="Tashkent")
     
-    # Store individual user stats to aggregate for Clan Sync
-    stats = Column(JSON, default={"vocabulary": 0, "syntax": 0, "fluency": 0})
+    # Individual user stats, aggregated into Clan Sync
+    vocabulary = Column(Float, default=0.0)
+    syntax = Column(Float, default=0.0)
+    fluency = Column(Float, default=0.0)
+
+    @property
+    def stats(self):
+        return {field: getattr(self, field) or 0.0 for field in STAT_FIELDS}
+
+    @stats.setter
+    def stats(self, values):
+        for field in STAT_FIELDS:
+            setattr(self, field, float((values or {}).get(field, 0)))
     
     def __repr__(self):
         return f"<User {self.username}>"
+
+class UsageRecord(Base):
+    """One upstream AI call (or a share of a batched one), written by usage_accounting"""
+    __tablename__ = "usage_records"
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    endpoint = Column(String)
+    model = Column(String)
+    username = Column(String, nullable=True, index=True) # X-User-Id of the caller
+    budget_key = Column(String, nullable=True, index=True) # daily budget charged: username or ip:<address>
+    user_id = Column(Integer, nullable=True)
+    clan_id = Column(Integer, nullable=True, index=True)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    audio_seconds = Column(Float, default=0.0)
+    latency_ms = Column(Float, default=0.0)
+    cost_usd = Column(Float, default=0.0)
+
+class XPLedgerCheckpoint(Base):
+    """Highest XP journal sequence number applied to users.xp (single row, id=1)"""
+    __tablename__ = "xp_ledger_checkpoint"
+
+    id = Column(Integer, primary_key=True)
+    applied_seq = Column(Integer, default=0)
+
+class RegionXPBucket(Base):
+    """Pre-aggregated XP per region and time bucket, maintained by region_rollups"""
+    __tablename__ = "region_xp_buckets"
+
+    region = Column(String, primary_key=True)
+    granularity = Column(String(1), primary_key=True) # "h"ourly, "d"aily, "w"eekly
+    start = Column(Integer, primary_key=True) # bucket start, epoch seconds
+    xp = Column(Integer, default=0)
+    events = Column(Integer, default=0)
+
+    __table_args__ = (Index("ix_region_xp_buckets_window", "granularity", "start"),)
+
+class UserWorldMap(Base):
+    """A user's quest map (see world_map.py); coordinates are implied by node order"""
+    __tablename__ = "world_maps"
+
+    username = Column(String, primary_key=True) # X-User-Id of the owner
+    nodes = Column(LargeBinary) # JSON list of quest definitions, in spiral order
+    status = Column(LargeBinary) # one status byte per node
+    source = Column(String) # content key of the upload the map was built from
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class QuestReward(Base):
+    """Quest XP paid out: once per user, uploaded content and map slot (see world_map.py)"""
+    __tablename__ = "quest_rewards"
+
+    username = Column(String, primary_key=True)
+    source = Column(String, primary_key=True) # UserWorldMap.source of the map it was earned on
+    slot = Column(Integer, primary_key=True) # node position on that map
@@ -0,0 +1,257 @@
+from typing import List, Dict, Optional, Set, Tuple
+from bisect import bisect_left, insort
+import asyncio
+import json
+import os
+import random
+import re
+
+from enemy_registry import ENEMIES, DEFAULT_ENEMY_KEY, classify_error_type
+from logging_setup import get_logger
+
+log = get_logger("synapse.question_bank")
+
+# Append-only JSONL store; the in-memory index is rebuilt from it on startup.
+# Appends are queued and written off the event loop.
+# The bank is shared by every user. Callers validate generated questions first and
+# keep out any that quote the transcript they were generated from
+# (quotes_transcript). Malformed entries are refused here too, also when loading.
+QUESTION_BANK_PATH = os.getenv("QUESTION_BANK_PATH", "./question_bank.jsonl")
+# Share of analyses that still ask the model for fresh MCQs once the bank is warm
+QUESTION_BANK_REFRESH_RATE = float(os.getenv("QUESTION_BANK_REFRESH_RATE", "0.1"))
+
+# Questions served per analysis (matches the "exactly 3 items" prompt contract)
+QUESTIONS_PER_ANALYSIS = 3
+OPTIONS_PER_QUESTION = 4
+# A question repeating this many consecutive transcript words quotes the speaker
+QUOTE_WORDS = 4
+
+_QUESTION_FIELDS = ("prompt", "options", "correctAnswer", "complexity", "explanation")
+_NON_WORD = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Case, punctuation and whitespace-insensitive key used for deduplication"""
+    return _SPACES.sub(" ", _NON_WORD.sub("", prompt.lower())).strip()
+
+
+def well_formed(question: Dict) -> bool:
+    """The shape every served question needs: 4 string options, the answer among them"""
+    options = question.get("options")
+    complexity = question.get("complexity")
+    return (
+        isinstance(question.get("prompt"), str)
+        and isinstance(question.get("explanation"), str)
+        and isinstance(options, list)
+        and len(options) == OPTIONS_PER_QUESTION
+        and all(isinstance(option, str) for option in options)
+        and question.get("correctAnswer") in options
+        and isinstance(complexity, (int, float))
+        and not isinstance(complexity, bool)
+    )
+
+
+def quotes_transcript(question: Dict, transcript: str, words: int = QUOTE_WORDS) -> bool:
+    """Whether the question repeats `words` consecutive words of the transcript (or all of a shorter one)"""
+    spoken = normalize_prompt(transcript or "").split()
+    if not spoken:
+        return False
+    text = " ".join([question.get("prompt", ""), *question.get("options", []), question.get("explanation", "")])
+    text = f" {normalize_prompt(text)} "
+    size = min(words, len(spoken))
+    return any(f" {' '.join(spoken[i:i + size])} " in text for i in range(len(spoken) - size + 1))
+
+
+class QuestionBank:
+    """
+    MCQ bank indexed by (error archetype, category) and sorted by complexity.
+    Error types are folded onto enemy archetypes, so "Tense Error" and
+    "Wrong Tense" share one bucket. A question is indexed under every error
+    of the analysis it was generated for.
+    """
+
+    def __init__(self, path: Optional[str] = QUESTION_BANK_PATH):
+        self.path = path
+        self.entries: List[Dict] = []
+        # normalized prompt -> entry index; entry index -> (archetype, category) keys it is filed under
+        self._ids: Dict[str, int] = {}
+        self._covers: List[Set[Tuple[str, str]]] = []
+        self._pending: List[str] = []
+        self._write_task: Optional[asyncio.Task] = None
+        # (archetype, category) -> [(complexity, entry_index)] kept sorted
+        self._by_key: Dict[Tuple[str, str], List[Tuple[float, int]]] = {}
+        # archetype -> [(complexity, entry_index)] for category-agnostic fallback
+        self._by_type: Dict[str, List[Tuple[float, int]]] = {}
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                    if "errors" in record:
+                        covers = [(error["type"], error["category"]) for error in record["errors"]]
+                    else:  # records written before multi-error indexing
+                        covers = [(record["error_type"], record["category"])]
+                    self._index(record["question"], covers)
+                except (ValueError, KeyError, TypeError) as e:
+                    log.warning("corrupt_record_skipped", path=self.path, error=str(e))
+
+    def _index(self, question: Dict, covers: List[Tuple[str, str]]) -> bool:
+        """File a question under each (error type, category); False if that added nothing"""
+        if not well_formed(question):
+            raise ValueError("malformed question")
+        key = normalize_prompt(question["prompt"])
+        if not key:
+            return False
+
+        idx = self._ids.get(key)
+        created = idx is None
+        if created:
+            entry = {field: question[field] for field in _QUESTION_FIELDS}
+            entry["complexity"] = float(entry["complexity"])
+            idx = len(self.entries)
+            self.entries.append(entry)
+            self._ids[key] = idx
+            self._covers.append(set())
+        complexity = self.entries[idx]["complexity"]
+        filed = self._covers[idx]
+
+        extended = False
+        for error_type, category in covers or [("", "")]:
+            archetype = classify_error_type(error_type or "")
+            pair = (archetype, category or "")
+            if pair in filed:
+                continue
+            if all(archetype != known for known, _ in filed):
+                insort(self._by_type.setdefault(archetype, []), (complexity, idx))
+            insort(self._by_key.setdefault(pair, []), (complexity, idx))
+            filed.add(pair)
+            extended = True
+        return created or extended
+
+    def add(self, question: Dict, error_type: str, category: str) -> bool:
+        """Index and persist a question. Returns False for duplicates."""
+        return self._add(question, [(error_type, category)])
+
+    def _add(self, question: Dict, covers: List[Tuple[str, str]]) -> bool:
+        if not self._index(question, covers):
+            return False
+        if self.path:
+            entry = self.entries[self._ids[normalize_prompt(question["prompt"])]]
+            record = {"errors": [{"type": t, "category": c} for t, c in covers], "question": entry}
+            self._persist(json.dumps(record, ensure_ascii=False) + "\n")
+        return True
+
+    def _persist(self, line: str):
+        self._pending.append(line)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._append(self._drain())  # scripts / startup: no loop to hand off to
+            return
+        if self._write_task is None or self._write_task.done():
+            self._write_task = loop.create_task(self._write_pending())
+
+    def _drain(self) -> List[str]:
+        lines, self._pending = self._pending, []
+        return lines
+
+    def _append(self, lines: List[str]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    async def _write_pending(self):
+        while self._pending:
+            lines = self._drain()
+            try:
+                await asyncio.to_thread(self._append, lines)
+            except OSError as e:
+                log.warning("question_bank_write_failed", path=self.path, records=len(lines), error=str(e))
+
+    async def close(self):
+        """Wait for queued appends (shutdown)"""
+        if self._write_task is not None:
+            await self._write_task
+
+    def seed(self, questions: List[Dict], error: Dict):
+        """Index built-in questions without persisting them"""
+        for question in questions:
+            self._index(question, [(error.get("type", ""), error.get("category", ""))])
+
+    def is_warm(self, limit: int = QUESTIONS_PER_ANALYSIS) -> bool:
+        """True once every enemy archetype can be served from the bank alone"""
+        return all(len(self._by_type.get(key, ())) >= limit for key in ENEMIES)
+
+    def should_generate(self, rate: float = QUESTION_BANK_REFRESH_RATE) -> bool:
+        """Ask the model for MCQs: always while cold, then for a `rate` sample so the bank keeps growing"""
+        return not self.is_warm() or random.random() < rate
+
+    def add_many(self, questions: List[Dict], errors: Optional[List[Dict]]) -> int:
+        """Ingest a batch of generated questions under every error of the analysis"""
+        covers = [
+            (error.get("type", "") or "", error.get("category", "") or "")
+            for error in errors or [] if isinstance(error, dict)
+        ]
+        added = 0
+        for question in questions:
+            try:
+                if self._add(question, covers):
+                    added += 1
+            except (KeyError, TypeError, ValueError) as e:
+                log.warning("malformed_question_rejected", error=str(e))
+        return added
+
+    @staticmethod
+    def _nearest(bucket: List[Tuple[float, int]], complexity: float, limit: int) -> List[int]:
+        """Walk outwards from the target complexity, closest first"""
+        picked = []
+        hi = bisect_left(bucket, (complexity, -1))
+        lo = hi - 1
+        while len(picked) < limit and (lo >= 0 or hi < len(bucket)):
+            if hi >= len(bucket) or (lo >= 0 and complexity - bucket[lo][0] <= bucket[hi][0] - complexity):
+                picked.append(bucket[lo][1])
+                lo -= 1
+            else:
+                picked.append(bucket[hi][1])
+                hi += 1
+        return picked
+
+    def select(self, errors: List[Dict], complexity: float, limit: int = QUESTIONS_PER_ANALYSIS) -> Optional[List[Dict]]:
+        """
+        Pick `limit` questions for the diagnosed errors near the target complexity.
+        Returns None when the bank cannot fill the set (caller should generate).
+        """
+        chosen: List[int] = []
+        buckets = []
+        for error in errors or []:
+            archetype = classify_error_type(error.get("type", "") or "")
+            buckets.append(self._by_key.get((archetype, error.get("category", "") or "")))
+            buckets.append(self._by_type.get(archetype))
+        buckets.append(self._by_type.get(DEFAULT_ENEMY_KEY))
+
+        for bucket in buckets:
+            if not bucket:
+                continue
+            for idx in self._nearest(bucket, complexity, limit):
+                if idx not in chosen:
+                    chosen.append(idx)
+                if len(chosen) == limit:
+                    break
+            if len(chosen) == limit:
+                break
+
+        if len(chosen) < limit:
+            return None
+        return [dict(self.entries[idx], id=n) for n, idx in enumerate(chosen, start=1)]
+
+
+question_bank = QuestionBank()
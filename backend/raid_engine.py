@@ -1,7 +1,183 @@
-from typing import List, Dict, Optional
+from typing import Any, Callable, List, Dict, Optional, Set, Tuple
+from pydantic import BaseModel, ValidationError
 import asyncio
-import json
-import openai
+import os
+import time
+from serialization import dumps, loads
+from instrumentation import span
+from xp_ledger import xp_ledger
+from logging_setup import get_logger
+
+log = get_logger("synapse.raid")
+
+# Seconds a member has to submit their part before the turn moves on (0 disables)
+RAID_TURN_TIMEOUT_S = float(os.getenv("RAID_TURN_TIMEOUT_S", "60"))
+# App-level heartbeat: a {"type": "ping"} every RAID_HEARTBEAT_S; a socket that sent
+# nothing (pong or otherwise) for RAID_HEARTBEAT_S + RAID_HEARTBEAT_GRACE_S is closed
+RAID_HEARTBEAT_S = float(os.getenv("RAID_HEARTBEAT_S", "15"))
+RAID_HEARTBEAT_GRACE_S = float(os.getenv("RAID_HEARTBEAT_GRACE_S", "10"))
+RAID_TIMER_TICK_MS = float(os.getenv("RAID_TIMER_TICK_MS", "100"))
+# Per round. A graded round pays its damage as XP to every member still connected;
+# the length-based mock only moves the boss bar
+MAX_RAID_DAMAGE = int(os.getenv("MAX_RAID_DAMAGE", "300"))
+
+PING_FRAME = dumps({"type": "ping"})
+
+
+class StartRaidAction(BaseModel):
+    type: str
+
+
+class SubmitPartAction(BaseModel):
+    type: str
+    content: str
+
+
+class PongAction(BaseModel):
+    type: str
+
+
+# Incoming WebSocket frame schemas, keyed by "type". Each validator is built
+# once here; frames are dispatched to theirs by type without re-resolving.
+# "draft_part" carries the active member's work in progress, auto-submitted if
+# their turn times out.
+RAID_ACTION_SCHEMAS = {
+    "start_raid": StartRaidAction,
+    "submit_part": SubmitPartAction,
+    "draft_part": SubmitPartAction,
+    "pong": PongAction,
+}
+
+
+def parse_action(raw: str) -> Optional[dict]:
+    """Decode and validate a raid frame. Returns None for malformed/unknown frames."""
+    try:
+        data = loads(raw)
+    except ValueError:
+        return None
+    # JSON arrays/scalars, or a "type" that is a list/object (unhashable), are not frames
+    if not isinstance(data, dict) or not isinstance(data.get("type"), str):
+        return None
+    schema = RAID_ACTION_SCHEMAS.get(data["type"])
+    if schema is None:
+        return None
+    try:
+        return schema.model_validate(data).model_dump()
+    except ValidationError:
+        return None
+
+
+class Timer:
+    __slots__ = ("expires", "callback", "args", "slot")
+
+    def __init__(self, expires: int, callback: Callable, args: tuple):
+        self.expires = expires  # absolute tick
+        self.callback = callback
+        self.args = args
+        self.slot: Optional[Set["Timer"]] = None  # bucket currently holding it
+
+    @property
+    def active(self) -> bool:
+        return self.slot is not None
+
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel (Varghese & Lauck) shared by every raid.
+    `levels` wheels of `2**bits` slots; level L slots span 2**(bits*L) ticks, so the
+    default 4 x 64 slots at 100 ms covers ~19 days. Insert and cancel are O(1) set
+    operations; each tick fires one level-0 slot, and a higher-level slot is
+    cascaded down only when the level below wraps. One asyncio task drives it all.
+    Callbacks are plain functions run on the event loop and must not block.
+    """
+
+    def __init__(self, tick_s: float = RAID_TIMER_TICK_MS / 1000, bits: int = 6, levels: int = 4):
+        self.tick_s = tick_s
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.levels = levels
+        self.wheels: List[List[Set[Timer]]] = [[set() for _ in range(1 << bits)] for _ in range(levels)]
+        self.tick = 0
+        self.origin = time.monotonic()
+        self.pending = 0
+        self.fired = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _place(self, timer: Timer):
+        delta = timer.expires - self.tick
+        level = 0
+        while level < self.levels - 1 and delta >= 1 << (self.bits * (level + 1)):
+            level += 1
+        # Due (or overdue) timers go in the slot being processed right now
+        index = (max(timer.expires, self.tick) >> (self.bits * level)) & self.mask
+        slot = self.wheels[level][index]
+        slot.add(timer)
+        timer.slot = slot
+
+    def call_later(self, delay_s: float, callback: Callable, *args: Any) -> Timer:
+        ticks = max(1, -int(-delay_s // self.tick_s))  # ceil, at least one tick out
+        timer = Timer(self.tick + ticks, callback, args)
+        self._place(timer)
+        self.pending += 1
+        return timer
+
+    def cancel(self, timer: Optional[Timer]):
+        if timer is not None and timer.slot is not None:
+            timer.slot.discard(timer)
+            timer.slot = None
+            self.pending -= 1
+
+    def advance(self):
+        """Process one tick: cascade wrapped levels, then fire the due slot"""
+        self.tick += 1
+        tick = self.tick
+        for level in range(1, self.levels):
+            if tick & ((1 << (self.bits * level)) - 1):
+                break
+            index = (tick >> (self.bits * level)) & self.mask
+            bucket = self.wheels[level][index]
+            self.wheels[level][index] = set()
+            for timer in bucket:
+                self._place(timer)
+
+        index = tick & self.mask
+        due = self.wheels[0][index]
+        if not due:
+            return
+        self.wheels[0][index] = set()
+        for timer in due:
+            timer.slot = None
+            self.pending -= 1
+            self.fired += 1
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                log.exception("timer_callback_failed", error=str(e))
+
+    def advance_to_now(self):
+        target = int((time.monotonic() - self.origin) / self.tick_s)
+        while self.tick < target:
+            self.advance()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick_s)
+            self.advance_to_now()
+
+    def start(self):
+        """Start the driver task on the running loop (idempotent)"""
+        if self._task is None or self._task.done():
+            self.origin = time.monotonic() - self.tick * self.tick_s
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "fired": self.fired, "tick": self.tick}
+
 
 class RaidState:
     def __init__(self, clan_id: int):
@@ -12,6 +188,9 @@ class RaidState:
         self.members: List[str] = [] # connected usernames in order
         self.question = "Describe a time you had to overcome a significant challenge."
         self.boss_hp = 1000
+        self.drafts: List[str] = ["", "", ""] # latest draft_part per turn
+        self.turn_timer: Optional[Timer] = None
+        self.turn_deadline: Optional[float] = None # wall clock, for client countdowns
 
     def add_member(self, username: str):
         if username not in self.members:
@@ -36,7 +215,8 @@ class RaidState:
             "responses": self.responses,
             "boss_hp": self.boss_hp,
             "question": self.question,
-            "members": self.members
+            "members": self.members,
+            "turn_deadline": self.turn_deadline
         }
 
 class ConnectionManager:
@@ -44,15 +224,25 @@ class ConnectionManager:
         # clan_id -> {username: websocket}
         self.active_connections: Dict[int, Dict[str, any]] = {} 
         self.raid_states: Dict[int, RaidState] = {}
+        # One wheel drives every turn deadline and heartbeat
+        self.timers = TimerWheel()
+        self.last_seen: Dict[Tuple[int, str], float] = {}
+        self.heartbeats: Dict[Tuple[int, str], Timer] = {}
+        self._tasks: Set[asyncio.Task] = set()
 
     async def connect(self, websocket: any, clan_id: int, username: str):
         await websocket.accept()
+        self.timers.start()
         if clan_id not in self.active_connections:
             self.active_connections[clan_id] = {}
             self.raid_states[clan_id] = RaidState(clan_id)
         
         self.active_connections[clan_id][username] = websocket
         self.raid_states[clan_id].add_member(username)
+        self.touch(clan_id, username)
+        if RAID_HEARTBEAT_S > 0:
+            self.timers.cancel(self.heartbeats.get((clan_id, username)))
+            self.heartbeats[(clan_id, username)] = self.timers.call_later(RAID_HEARTBEAT_S, self._heartbeat, clan_id, username)
         
         await self.broadcast_state(clan_id)
 
@@ -60,59 +250,152 @@ class ConnectionManager:
         if clan_id in self.active_connections and username in self.active_connections[clan_id]:
             del self.active_connections[clan_id][username]
             # Cleanup if empty? For now, keep state active for basic persistence
+        self.timers.cancel(self.heartbeats.pop((clan_id, username), None))
+        self.last_seen.pop((clan_id, username), None)
+
+    def touch(self, clan_id: int, username: str):
+        """Any frame from a member proves the socket is alive"""
+        self.last_seen[(clan_id, username)] = time.monotonic()
+
+    def _spawn(self, coro):
+        # Timer callbacks are synchronous; async follow-ups run as tracked tasks
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _heartbeat(self, clan_id: int, username: str):
+        websocket = self.active_connections.get(clan_id, {}).get(username)
+        if websocket is None:
+            return
+        silent_for = time.monotonic() - self.last_seen.get((clan_id, username), 0)
+        if silent_for > RAID_HEARTBEAT_S + RAID_HEARTBEAT_GRACE_S:
+            log.info("raid_member_timed_out", clan_id=clan_id, username=username, silent_s=round(silent_for, 1))
+            self.disconnect(clan_id, username)
+            self._spawn(self._drop(websocket, clan_id))
+            return
+        self._spawn(self._send(websocket, PING_FRAME))
+        self.heartbeats[(clan_id, username)] = self.timers.call_later(RAID_HEARTBEAT_S, self._heartbeat, clan_id, username)
+
+    async def _send(self, websocket: any, message: str):
+        try:
+            await websocket.send_text(message)
+        except:
+            pass
+
+    async def _drop(self, websocket: any, clan_id: int):
+        try:
+            await websocket.close(code=1001)
+        except:
+            pass
+        await self.broadcast_state(clan_id)
+
+    def _arm_turn(self, state: RaidState):
+        self.timers.cancel(state.turn_timer)
+        state.turn_timer = None
+        state.turn_deadline = None
+        if state.status != "active" or RAID_TURN_TIMEOUT_S <= 0:
+            return
+        state.turn_timer = self.timers.call_later(RAID_TURN_TIMEOUT_S, self._turn_expired, state.clan_id, state.current_turn_index)
+        state.turn_deadline = round(time.time() + RAID_TURN_TIMEOUT_S, 3)
+
+    def _turn_expired(self, clan_id: int, turn_index: int):
+        state = self.raid_states.get(clan_id)
+        if not state or state.status != "active" or state.current_turn_index != turn_index:
+            return # Turn already moved on
+        state.turn_timer = None
+        log.info("raid_turn_timed_out", clan_id=clan_id, turn=turn_index, player=state.get_active_player(),
+                 outcome="auto_submit" if state.drafts[turn_index] else "skip")
+        self._spawn(self._timeout_turn(clan_id, state, turn_index))
+
+    async def _timeout_turn(self, clan_id: int, state: RaidState, turn_index: int):
+        if state.status != "active" or state.current_turn_index != turn_index:
+            return # Submitted between the deadline firing and this task running
+        player = state.get_active_player()
+        draft = state.drafts[turn_index]
+        outcome = "Their draft was submitted." if draft else "Turn skipped."
+        await self.complete_part(clan_id, state, draft)
+        await self.broadcast_message(clan_id, f"{player} ran out of time. {outcome}")
             
     async def broadcast_state(self, clan_id: int):
         if clan_id not in self.active_connections: return
         
-        state = self.raid_states[clan_id].to_json()
-        message = json.dumps({"type": "state_update", "data": state})
-        
-        for connection in self.active_connections[clan_id].values():
-            try:
-                await connection.send_text(message)
-            except:
-                pass # Handle disconnects gracefully in real app
+        with span("broadcast_state"):
+            state = self.raid_states[clan_id].to_json()
+            message = dumps({"type": "state_update", "data": state})
+            
+            for connection in self.active_connections[clan_id].values():
+                try:
+                    await connection.send_text(message)
+                except:
+                    pass # Handle disconnects gracefully in real app
+            # Fires on every turn of every raid; keep a 1% sample at debug level
+            log.debug("state_update", clan_id=clan_id, recipients=len(self.active_connections[clan_id]), sample=0.01)
 
     async def handle_action(self, clan_id: int, username: str, action: dict):
         state = self.raid_states.get(clan_id)
         if not state: return
 
         if action["type"] == "start_raid":
+            if state.status != "active":
+                # New round: the previous one left the turn index past the last part
+                state.current_turn_index = 0
+                state.responses = ["", "", ""]
+                state.drafts = ["", "", ""]
             state.status = "active"
             state.question = "Describe a memorable journey you have taken. (Speak about: Where, When, Who with, Why memorable)"
+            self._arm_turn(state)
             await self.broadcast_state(clan_id)
 
+        elif action["type"] == "draft_part":
+            if state.get_active_player() == username:
+                state.drafts[state.current_turn_index] = action["content"]
+
         elif action["type"] == "submit_part":
             # Verify turn
             if state.get_active_player() != username:
                 return # Not your turn
+            await self.complete_part(clan_id, state, action["content"])
+
+    async def complete_part(self, clan_id: int, state: RaidState, content: str):
+        """Record the active member's part (submitted or timed out) and advance the turn"""
+        part_index = state.current_turn_index
+        state.responses[part_index] = content
+        
+        round_finished = state.next_turn()
+        self._arm_turn(state)
+        
+        if round_finished:
+            await self.broadcast_message(clan_id, "All parts submitted! Assessing damage...")
+            # Grading Logic
+            damage, graded = await self.calculate_damage(" ".join(state.responses))
+            damage = min(max(int(damage), 0), MAX_RAID_DAMAGE)
+            state.boss_hp -= damage
+            if graded:
+                self.award_round(clan_id, state, damage)
+            state.status = "finished" if state.boss_hp <= 0 else "waiting" # Reset to waiting for next round or finish
             
-            part_index = state.current_turn_index
-            state.responses[part_index] = action["content"]
-            
-            round_finished = state.next_turn()
-            
-            if round_finished:
-                await self.broadcast_message(clan_id, "All parts submitted! Assessing damage...")
-                # Grading Logic
-                damage = await self.calculate_damage(" ".join(state.responses))
-                state.boss_hp -= damage
-                state.status = "finished" if state.boss_hp <= 0 else "waiting" # Reset to waiting for next round or finish
-                
-                await self.broadcast_message(clan_id, f"CRITICAL HIT! {damage} Damage Dealt.")
-            
-            await self.broadcast_state(clan_id)
+            await self.broadcast_message(clan_id, f"CRITICAL HIT! {damage} Damage Dealt.")
+        
+        await self.broadcast_state(clan_id)
 
     async def broadcast_message(self, clan_id: int, text: str):
         if clan_id not in self.active_connections: return
-        msg = json.dumps({"type": "notification", "message": text})
+        msg = dumps({"type": "notification", "message": text})
         for conn in self.active_connections[clan_id].values():
             try: await conn.send_text(msg)
             except: pass
 
-    async def calculate_damage(self, full_response: str) -> int:
+    def award_round(self, clan_id: int, state: RaidState, damage: int):
+        """The squad earns a graded round's damage as XP; members who dropped out don't"""
+        connected = self.active_connections.get(clan_id, {})
+        for member in state.members:
+            if member in connected:
+                xp_ledger.award(member, damage, "raid")
+
+    async def calculate_damage(self, full_response: str) -> Tuple[int, bool]:
+        """(damage, graded): graded is False for the mock, which earns no XP"""
         # Mock AI Grading for prototype speed, or use OpenAI if key exists
-        if len(full_response) < 10: return 10
+        if len(full_response) < 10: return 10, False
         
         # Real AI call could go here
-        return len(full_response) * 2 # Simple mock: longer answer = more damage
+        return min(len(full_response) * 2, MAX_RAID_DAMAGE), False # Simple mock: longer answer = more damage
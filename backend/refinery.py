@@ -1,13 +1,21 @@
+from dataclasses import dataclass
 from pydantic import BaseModel
 from typing import List, Dict, Optional
-import openai
 import os
 import json
 import io
-from pypdf import PdfReader
+import asyncio
+from lazy_imports import lazy_import
+from instrumentation import span
+from usage_accounting import accounting
+from logging_setup import get_logger
+
+log = get_logger("synapse.refinery")
 
 # Environment variable check happens in main.py usually, but we need key here if not passed
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+openai = lazy_import("openai")
+pypdf = lazy_import("pypdf")
 openai.api_key = OPENAI_API_KEY
 
 class QuestNode(BaseModel):
@@ -16,19 +24,30 @@ class QuestNode(BaseModel):
     title: str
     description: str
     difficulty: float
-    coordinates: Dict[str, int] # q, r for hex grid
-    status: str # 'locked', 'unlocked', 'completed'
+    coordinates: Dict[str, int] = {"q": 0, "r": 0} # q, r for hex grid; assigned by world_map
+    status: str = "locked" # 'locked', 'unlocked', 'completed'; tracked by world_map
     rewards: Dict[str, int]
 
-async def refine_ielts_content(file_bytes: bytes, filename: str) -> List[QuestNode]:
+@dataclass
+class Refinement:
+    """Quests for an upload; fallback=True means they are get_mock_quests(), not from the PDF"""
+    quests: List[QuestNode]
+    fallback: bool = False
+
+def mock_refinement() -> Refinement:
+    return Refinement(get_mock_quests(), fallback=True)
+
+async def refine_ielts_content(file_bytes, filename: str) -> Refinement:
     """
-    Refines raw PDF bytes into a set of QuestNodes
+    Refines raw PDF content (bytes, memoryview or mmap) into a set of QuestNodes.
+    Every failure path (no key, no text, model error, no quests) returns mock_refinement().
     """
     # 1. Extract Text
-    text = extract_text_from_pdf(file_bytes)
+    with span("pdf_extract"):
+        text = await asyncio.to_thread(extract_text_from_pdf, file_bytes)
     if not text:
-        print("Failed to extract text from PDF")
-        return get_mock_quests()
+        log.warning("pdf_text_empty", filename=filename)
+        return mock_refinement()
         
     # Trim text to fit context window if needed (simple approach: first 3000 chars)
     # Ideally we'd chunk it, but for a game demo, 3000 chars is enough context
@@ -49,34 +68,34 @@ async def refine_ielts_content(file_bytes: bytes, filename: str) -> List[QuestNo
         "title": "Short Epic Title",
         "description": "Quest description.",
         "difficulty": 6.5,
-        "coordinates": {{"q": 0, "r": 0}},
-        "status": "unlocked",
         "rewards": {{"xp": 100, "sanity": 10}}
       }}
     ]
     
     Requirements:
     1. Generate exactly 5 quests.
-    2. Coordinates (q, r) must be unique small integers for a hex grid (e.g. within range -2 to 2).
-    3. Ensure variety in 'type'.
+    2. Ensure variety in 'type'.
     """
 
     try:
         if not OPENAI_API_KEY:
-            print("No OpenAI Key, using mock for refinery")
-            return get_mock_quests()
+            log.info("no_openai_key_using_mock")
+            return mock_refinement()
 
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an expert IELTS curriculum designer."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            response_format={"type": "json_object"}
-        )
+        with span("completion.refinery"):
+            response = await accounting.call(
+                openai.chat.completions.create,
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "You are an expert IELTS curriculum designer."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.7,
+                response_format={"type": "json_object"}
+            )
         
-        data = json.loads(response.choices[0].message.content)
+        with span("json_parse"):
+            data = json.loads(response.choices[0].message.content)
         quests = []
         raw_list = data.get("quests", data.get("nodes", []))
         
@@ -87,25 +106,28 @@ async def refine_ielts_content(file_bytes: bytes, filename: str) -> List[QuestNo
                 title=q_data.get("title", "Untitled Quest"),
                 description=q_data.get("description", "No description"),
                 difficulty=q_data.get("difficulty", 6.0),
-                coordinates=q_data.get("coordinates", {"q": 0, "r": 0}),
-                status=q_data.get("status", "locked"),
                 rewards=q_data.get("rewards", {"xp": 100, "sanity": 10})
             ))
-            
-        return quests
+
+        if not quests:
+            log.warning("refinery_no_quests", filename=filename)
+            return mock_refinement()
+        return Refinement(quests)
     except Exception as e:
-        print(f"Refinery GPT error: {e}")
-        return get_mock_quests()
+        log.error("refinery_completion_failed", filename=filename, error=str(e))
+        return mock_refinement()
 
-def extract_text_from_pdf(file_bytes: bytes) -> str:
+def extract_text_from_pdf(file_bytes) -> str:
     try:
-        reader = PdfReader(io.BytesIO(file_bytes))
+        # An mmap is already a seekable stream: pypdf reads the mapping, no copy
+        stream = file_bytes if hasattr(file_bytes, "seek") else io.BytesIO(file_bytes)
+        reader = pypdf.PdfReader(stream)
         text = ""
         for page in reader.pages:
             text += page.extract_text() + "\n"
         return text
     except Exception as e:
-        print(f"PDF Extraction Error: {e}")
+        log.warning("pdf_extraction_failed", error=str(e))
         return ""
 
 def get_mock_quests() -> List[QuestNode]:
@@ -116,8 +138,6 @@ def get_mock_quests() -> List[QuestNode]:
             title="The Academic Lexis",
             description="Master complex academic words in context (Mock Data).",
             difficulty=6.5,
-            coordinates={"q": 0, "r": 0},
-            status="unlocked",
             rewards={"xp": 150, "sanity": 20}
         ),
         QuestNode(
@@ -126,8 +146,6 @@ def get_mock_quests() -> List[QuestNode]:
             title="Tense Mastery",
             description="Navigate the trickiest past perfect tenses. (Mock Data)",
             difficulty=7.0,
-            coordinates={"q": 1, "r": -1},
-            status="locked",
             rewards={"xp": 200, "sanity": 15}
         ),
         QuestNode(
@@ -136,8 +154,6 @@ def get_mock_quests() -> List[QuestNode]:
             title="Logical Links",
             description="Build bridge between ideas with advanced connectors. (Mock Data)",
             difficulty=6.0,
-            coordinates={"q": -1, "r": 1},
-            status="locked",
             rewards={"xp": 120, "sanity": 10}
         ),
          QuestNode(
@@ -146,8 +162,6 @@ def get_mock_quests() -> List[QuestNode]:
             title="Echoes of Oxford",
             description="Perfect your intonation and stress. (Mock Data)",
             difficulty=7.5,
-            coordinates={"q": 0, "r": -2},
-            status="locked",
             rewards={"xp": 180, "sanity": 10}
         ),
          QuestNode(
@@ -156,8 +170,6 @@ def get_mock_quests() -> List[QuestNode]:
             title="Synonym Hunter",
             description="Stop saying 'good' and 'bad'. (Mock Data)",
             difficulty=5.5,
-            coordinates={"q": 2, "r": 0},
-            status="locked",
             rewards={"xp": 100, "sanity": 5}
         )
     ]
@@ -0,0 +1,297 @@
+from collections import OrderedDict
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Tuple
+import os
+import time
+
+from sqlalchemy import delete, event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from models import RegionXPBucket, User
+from xp_ledger import xp_ledger, applied_seq_column
+from logging_setup import get_logger
+
+log = get_logger("synapse.rollups")
+
+# Turf-war standings per region over time windows.
+# Every ledger award is counted into a (region, bucket) counter at two
+# granularities: hourly and daily. The counters are written as upserts in the
+# ledger's flush transaction, so they commit together with users.xp and the
+# journal checkpoint. A windowed leaderboard therefore sums a few
+# (buckets x regions) rows and never scans users.
+# Retention (compact(), nightly):
+#   - hourly buckets are dropped after ROLLUP_HOURLY_RETENTION_H;
+#   - daily buckets older than ROLLUP_DAILY_RETENTION_D are folded into weekly ones;
+#   - weekly buckets are dropped after ROLLUP_WEEKLY_RETENTION_W.
+# Windows longer than the daily retention ("quarter") read the weekly buckets
+# plus the daily ones that have not been folded yet.
+# Regions of recently seen users stay in an LRU of ROLLUP_REGION_CACHE_SIZE.
+# A commit that writes users.region through the ORM evicts that user.
+# Core UPDATEs of users.region must call region_rollups.forget().
+# Days and weeks (starting Monday) follow ROLLUP_TZ_OFFSET_H. The default
+# is Asia/Tashkent, like the scheduler.
+
+ROLLUP_TZ_OFFSET_S = int(float(os.getenv("ROLLUP_TZ_OFFSET_H", "5")) * 3600)
+ROLLUP_HOURLY_RETENTION_H = int(os.getenv("ROLLUP_HOURLY_RETENTION_H", "72"))
+ROLLUP_DAILY_RETENTION_D = int(os.getenv("ROLLUP_DAILY_RETENTION_D", "35"))
+ROLLUP_WEEKLY_RETENTION_W = int(os.getenv("ROLLUP_WEEKLY_RETENTION_W", "104"))
+ROLLUP_REGION_CACHE_SIZE = int(os.getenv("ROLLUP_REGION_CACHE_SIZE", "100000"))
+
+HOUR, DAY, WEEK = 3600, 86400, 7 * 86400
+
+# window -> (granularity, buckets ending with the current one)
+WINDOWS = {
+    "hour": ("h", 1),
+    "day": ("d", 1),
+    "week": ("d", 7),
+    "month": ("d", 30),
+    "quarter": ("w", 13),
+}
+
+LOOKUP_CHUNK = 500
+
+
+def hour_start(ts: float) -> int:
+    return int((ts + ROLLUP_TZ_OFFSET_S) // HOUR * HOUR - ROLLUP_TZ_OFFSET_S)
+
+
+def day_start(ts: float) -> int:
+    return int((ts + ROLLUP_TZ_OFFSET_S) // DAY * DAY - ROLLUP_TZ_OFFSET_S)
+
+
+def week_start(ts: float) -> int:
+    day = day_start(ts)
+    # 1970-01-01 was a Thursday: (days + 3) % 7 == 0 on Mondays
+    return day - ((day + ROLLUP_TZ_OFFSET_S) // DAY + 3) % 7 * DAY
+
+
+def _upsert(db):
+    """INSERT ... ON CONFLICT DO UPDATE adding to the existing counters"""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(RegionXPBucket)
+    return stmt.on_conflict_do_update(
+        index_elements=[RegionXPBucket.region, RegionXPBucket.granularity, RegionXPBucket.start],
+        set_={"xp": RegionXPBucket.xp + stmt.excluded.xp, "events": RegionXPBucket.events + stmt.excluded.events},
+    )
+
+
+class RegionRollups:
+    """xp_ledger listener; pending counters are per (username, hour) until flush resolves regions"""
+
+    def __init__(self, ledger, cache_size: int = ROLLUP_REGION_CACHE_SIZE):
+        self.ledger = ledger
+        self.cache_size = cache_size
+        self.pending: Dict[Tuple[str, int], List[int]] = {}
+        self.inflight: Dict[Tuple[str, int], List[int]] = {}
+        # Kept until the next flush starts, like xp_ledger.committed_batch
+        self.committed_batch: Dict[Tuple[str, int], List[int]] = {}
+        # username -> region (LRU) for users seen by flushes/reads
+        self.regions: "OrderedDict[str, str]" = OrderedDict()
+        # Bumped by forget(), so a lookup that raced a region write is not cached
+        self.region_writes = 0
+        self.upserts = 0
+        self.compactions = 0
+
+    # --- Ledger listener ---
+
+    def record(self, username: str, delta: int, ts: int):
+        key = (username, hour_start(ts))
+        entry = self.pending.get(key)
+        if entry is None:
+            self.pending[key] = [delta, 1]
+        else:
+            entry[0] += delta
+            entry[1] += 1
+
+    def take(self):
+        batch, self.pending = self.pending, {}
+        self.inflight, self.committed_batch = batch, {}
+        return batch
+
+    async def apply(self, db, batch):
+        if not batch:
+            return
+        regions = await self._resolve(db, {username for username, _ in batch})
+        buckets: Dict[Tuple[str, str, int], List[int]] = {}
+        for (username, hour), (xp, events) in batch.items():
+            region = regions.get(username)
+            if region is None:
+                continue  # No users row: the ledger drops these awards too
+            for key in ((region, "h", hour), (region, "d", day_start(hour))):
+                entry = buckets.setdefault(key, [0, 0])
+                entry[0] += xp
+                entry[1] += events
+        if buckets:
+            await db.execute(_upsert(db), [
+                {"region": region, "granularity": granularity, "start": start, "xp": xp, "events": events}
+                for (region, granularity, start), (xp, events) in buckets.items()
+            ])
+            self.upserts += len(buckets)
+
+    def restore(self, batch):
+        for key, (xp, events) in batch.items():
+            entry = self.pending.setdefault(key, [0, 0])
+            entry[0] += xp
+            entry[1] += events
+        self.inflight = {}
+
+    def committed(self):
+        self.inflight, self.committed_batch = {}, self.inflight
+
+    def reset(self):
+        self.pending, self.inflight, self.committed_batch = {}, {}, {}
+
+    def forget(self, username: str):
+        """Drop a cached region after users.region changed"""
+        self.regions.pop(username, None)
+        self.region_writes += 1
+
+    async def _resolve(self, db, usernames: Iterable[str]) -> Dict[str, str]:
+        found, missing = {}, []
+        for username in usernames:
+            region = self.regions.get(username)
+            if region is None:
+                missing.append(username)
+            else:
+                self.regions.move_to_end(username)
+                found[username] = region
+        for i in range(0, len(missing), LOOKUP_CHUNK):
+            writes = self.region_writes
+            result = await db.execute(
+                select(User.username, User.region).where(User.username.in_(missing[i:i + LOOKUP_CHUNK]))
+            )
+            rows = result.all()
+            found.update(rows)
+            if writes == self.region_writes:
+                self.regions.update(rows)
+        while len(self.regions) > self.cache_size:
+            self.regions.popitem(last=False)
+        return found
+
+    # --- Reads ---
+
+    async def standings(self, db, window: str, now: Optional[float] = None) -> Dict:
+        """Regions ranked by XP earned in `window` (see WINDOWS), flushed buckets plus pending awards"""
+        granularity, count = WINDOWS[window]
+        now = time.time() if now is None else now
+        if granularity == "h":
+            since, granularities = hour_start(now) - (count - 1) * HOUR, ("h",)
+        elif granularity == "d":
+            since, granularities = day_start(now) - (count - 1) * DAY, ("d",)
+        else:
+            # compact() moves a day into its weekly bucket and deletes it in one transaction
+            since, granularities = week_start(now) - (count - 1) * WEEK, ("w", "d")
+
+        result = await db.execute(
+            select(
+                RegionXPBucket.region,
+                func.sum(RegionXPBucket.xp).label("xp"),
+                func.sum(RegionXPBucket.events).label("events"),
+                func.count().label("buckets"),
+                applied_seq_column(),
+            )
+            .where(RegionXPBucket.granularity.in_(granularities), RegionXPBucket.start >= since)
+            .group_by(RegionXPBucket.region)
+        )
+        rows = result.all()
+        scores = {row.region: [row.xp or 0, row.events or 0] for row in rows}
+        if rows:
+            applied_seq = rows[0].applied_seq
+        else:
+            applied_seq = (await db.execute(select(applied_seq_column()))).scalar()
+
+        # Awards the statement above could not have seen (same rule as xp_ledger.pending_delta)
+        entries = list(self.pending.items())
+        if self.inflight and (applied_seq or 0) < self.ledger.inflight_seq:
+            entries += list(self.inflight.items())
+        if self.committed_batch and (applied_seq or 0) < self.ledger.committed_seq:
+            entries += list(self.committed_batch.items())
+        entries = [(username, xp, events) for (username, hour), (xp, events) in entries if hour >= since]
+        if entries:
+            regions = await self._resolve(db, {username for username, _, _ in entries})
+            for username, xp, events in entries:
+                region = regions.get(username)
+                if region is not None:
+                    entry = scores.setdefault(region, [0, 0])
+                    entry[0] += xp
+                    entry[1] += events
+
+        ranked = sorted(scores.items(), key=lambda item: item[1][0], reverse=True)
+        return {
+            "window": window,
+            "since": since,
+            "buckets_read": sum(row.buckets for row in rows),
+            "data": [{"region": region, "score": xp, "events": events} for region, (xp, events) in ranked],
+        }
+
+    # --- Retention ---
+
+    async def compact(self, db, now: Optional[float] = None) -> Dict:
+        """Fold old daily buckets into weekly ones and drop expired buckets"""
+        now = time.time() if now is None else now
+        hour_cutoff = hour_start(now) - ROLLUP_HOURLY_RETENTION_H * HOUR
+        day_cutoff = day_start(now) - ROLLUP_DAILY_RETENTION_D * DAY
+        week_cutoff = week_start(now) - ROLLUP_WEEKLY_RETENTION_W * WEEK
+
+        old_days = (await db.execute(
+            select(RegionXPBucket.region, RegionXPBucket.start, RegionXPBucket.xp, RegionXPBucket.events)
+            .where(RegionXPBucket.granularity == "d", RegionXPBucket.start < day_cutoff)
+        )).all()
+        weeks: Dict[Tuple[str, int], List[int]] = {}
+        for region, start, xp, events in old_days:
+            entry = weeks.setdefault((region, week_start(start)), [0, 0])
+            entry[0] += xp or 0
+            entry[1] += events or 0
+        if weeks:
+            await db.execute(_upsert(db), [
+                {"region": region, "granularity": "w", "start": start, "xp": xp, "events": events}
+                for (region, start), (xp, events) in weeks.items()
+            ])
+
+        removed = {}
+        for granularity, cutoff in (("d", day_cutoff), ("h", hour_cutoff), ("w", week_cutoff)):
+            result = await db.execute(
+                delete(RegionXPBucket).where(RegionXPBucket.granularity == granularity, RegionXPBucket.start < cutoff)
+            )
+            removed[granularity] = result.rowcount
+        await db.commit()
+        self.compactions += 1
+        summary = {"days_folded": len(old_days), "weekly_upserts": len(weeks),
+                   "hourly_dropped": removed["h"], "weekly_dropped": removed["w"]}
+        log.info("region_rollups_compacted", **summary)
+        return summary
+
+    def stats(self) -> Dict:
+        return {
+            "pending_keys": len(self.pending),
+            "bucket_upserts": self.upserts,
+            "cached_regions": len(self.regions),
+            "compactions": self.compactions,
+        }
+
+
+region_rollups = RegionRollups(xp_ledger)
+xp_ledger.add_listener(region_rollups)
+
+
+# --- Region writes ---
+
+@event.listens_for(Session, "after_flush")
+def _note_region_writes(session, flush_context):
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, User) and inspect(obj).attrs.region.history.has_changes():
+            session.info.setdefault("region_writes", set()).add(obj.username)
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_region_writes(session):
+    for username in session.info.pop("region_writes", ()):
+        region_rollups.forget(username)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_region_writes(session, previous_transaction):
+    session.info.pop("region_writes", None)
@@ -0,0 +1,59 @@
+from typing import Any
+from fastapi.responses import JSONResponse, Response
+import json
+import os
+
+# Pluggable JSON backend. orjson is optional: when it is installed it is used
+# for HTTP responses, WebSocket frames and pre-encoded payloads; otherwise we
+# fall back to the stdlib encoder. Force one with SYNAPSE_JSON_BACKEND=stdlib|orjson.
+JSON_BACKEND = os.getenv("SYNAPSE_JSON_BACKEND", "orjson")
+
+try:
+    if JSON_BACKEND != "orjson":
+        raise ImportError
+    import orjson
+except ImportError:
+    orjson = None
+    JSON_BACKEND = "stdlib"
+
+
+if orjson is not None:
+    def dumps_bytes(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    loads = orjson.loads
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return _encoder.encode(obj).encode("utf-8")
+
+    def dumps(obj: Any) -> str:
+        return _encoder.encode(obj)
+
+    loads = json.loads
+
+
+class FastJSONResponse(JSONResponse):
+    """Default response class for the app, rendered through the selected backend"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
+
+
+def pre_encode(payload: Any) -> bytes:
+    """
+    Encode a static payload (Pydantic model or plain data) once.
+    Pair with static_json() to serve it without re-serializing per request.
+    """
+    if hasattr(payload, "model_dump"):
+        payload = payload.model_dump(mode="json")
+    return dumps_bytes(payload)
+
+
+def static_json(body: bytes, status_code: int = 200) -> Response:
+    # A fresh Response per request: middleware mutates headers in place
+    return Response(content=body, status_code=status_code, media_type="application/json")
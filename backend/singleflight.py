@@ -0,0 +1,87 @@
+from typing import Any, Awaitable, Callable, Dict, Union
+import asyncio
+import hashlib
+import mmap
+
+# Single-flight: concurrent callers with the same key share one upstream call.
+# The call runs as its own task, so a caller that goes away (client disconnect,
+# timeout) does not cancel it for the others. Only when every waiter has left
+# is the upstream call cancelled.
+
+HASH_CHUNK = 1 << 20
+
+
+def content_key(*parts: Union[str, bytes, memoryview, mmap.mmap, None]) -> str:
+    """Stable hash over the inputs that determine an upstream call's result (bytes-like parts are not copied)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = b""
+        elif isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "little"))
+        if isinstance(part, mmap.mmap) and hasattr(mmap, "MADV_DONTNEED"):
+            # Mapped uploads: hash a chunk at a time and drop its pages from our RSS
+            # (they stay in the page cache), so hashing 100 MB doesn't map 100 MB
+            for offset in range(0, len(part), HASH_CHUNK):
+                length = min(HASH_CHUNK, len(part) - offset)
+                digest.update(part[offset:offset + length])
+                part.madvise(mmap.MADV_DONTNEED, offset, length)
+        else:
+            digest.update(part)
+    return digest.hexdigest()
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self.flights: Dict[str, _Flight] = {}
+        self.calls = 0        # upstream calls actually made
+        self.coalesced = 0    # callers that joined an existing flight
+        self.abandoned = 0    # flights cancelled because every waiter left
+
+    def _forget(self, key: str, flight: _Flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.flights[key] = flight
+            self.calls += 1
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Last interested caller is gone; new callers must start fresh
+                self._forget(key, flight)
+                flight.task.cancel()
+                self.abandoned += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "in_flight": len(self.flights),
+        }
+
+
+transcriptions = SingleFlight("transcription")
+combat_gradings = SingleFlight("combat-grading")
+refinements = SingleFlight("refinement")
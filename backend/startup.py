@@ -0,0 +1,94 @@
+from typing import Awaitable, Callable, Dict, List, Tuple
+import asyncio
+import os
+import time
+
+from logging_setup import get_logger
+
+log = get_logger("synapse.startup")
+
+# STARTUP_MODE=eager (default): run every startup step before accepting requests.
+# A failed step aborts startup, so the process exits instead of serving.
+# STARTUP_MODE=deferred: accept requests immediately and run the steps in the
+# background; /ready answers 503 until they have all finished. Requests that need
+# a step (e.g. the DB schema) wait for it via readiness.wait(). A failed step
+# stops the remaining ones, keeps /ready at 503, and get_db() answers 503.
+
+STARTUP_MODE = os.getenv("STARTUP_MODE", "eager").lower()
+
+
+class Readiness:
+    def __init__(self):
+        self._events: Dict[str, asyncio.Event] = {}
+        self.timings: Dict[str, float] = {}
+        self.failures: Dict[str, str] = {}
+        self.started = time.perf_counter()
+
+    def _event(self, step: str) -> asyncio.Event:
+        event = self._events.get(step)
+        if event is None:
+            event = self._events[step] = asyncio.Event()
+        return event
+
+    def expect(self, *steps: str):
+        for step in steps:
+            self._event(step)
+
+    def mark_ready(self, step: str):
+        self.timings[step] = round(time.perf_counter() - self.started, 4)
+        self._event(step).set()
+
+    def mark_failed(self, step: str, error: str):
+        # Still released: waiters proceed and hit the underlying error themselves
+        self.failures[step] = error
+        self._event(step).set()
+
+    def failed(self, step: str) -> bool:
+        return step in self.failures
+
+    async def wait(self, step: str):
+        event = self._events.get(step)
+        if event is not None and not event.is_set():
+            await event.wait()
+
+    @property
+    def pending(self) -> List[str]:
+        return [step for step, event in self._events.items() if not event.is_set()]
+
+    @property
+    def ready(self) -> bool:
+        return not self.pending and not self.failures
+
+    def snapshot(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "mode": STARTUP_MODE,
+            "pending": self.pending,
+            "failed": self.failures,
+            "completed_after_s": self.timings,
+        }
+
+
+readiness = Readiness()
+
+
+async def run_steps(steps: List[Tuple[str, Callable[[], Awaitable[None]]]], fail_fast: bool = True):
+    """
+    Run startup steps in order, recording each as ready (or failed).
+    Later steps depend on earlier ones, so the first failure stops the rest:
+    re-raised with fail_fast (eager startup), otherwise the remaining steps are
+    marked failed too.
+    """
+    for i, (step, fn) in enumerate(steps):
+        try:
+            await fn()
+            readiness.mark_ready(step)
+            log.info("startup_step_ready", step=step, after_s=readiness.timings[step])
+        except Exception as e:
+            readiness.mark_failed(step, str(e))
+            log.exception("startup_step_failed", step=step, error=str(e))
+            for skipped, _ in steps[i + 1:]:
+                readiness.mark_failed(skipped, f"skipped: {step} failed")
+            if fail_fast:
+                raise
+            return
@@ -0,0 +1,71 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from analysis_store import AnalysisStore, ERROR_ARCHETYPES, RECORD_DTYPE, record_dtype
+
+# Analysis store persistence: error columns follow the enemy roster (which may only grow), appends are queued.
+
+OLD = ERROR_ARCHETYPES[:-1]  # a file written before the roster's last archetype shipped
+
+
+def write_old_store(path, rows: int = 3, data_path=None):
+    records = np.zeros(rows, dtype=record_dtype(len(OLD)))
+    records["ts"] = np.arange(rows) + 1_700_000_000
+    records["user_id"] = 7
+    records["errors"] = 2
+    records.tofile(data_path or path)
+    with open(path + ".archetypes", "w", encoding="utf-8") as f:
+        f.writelines(key + "\n" for key in OLD)
+
+
+def assert_widened(path, rows: int = 3):
+    store = AnalysisStore(path)
+    assert len(store) == rows
+    errors = store.column("errors")
+    assert (errors[:len(OLD)] == 2).all() and (errors[len(OLD):] == 0).all()
+    assert os.path.getsize(path) == rows * RECORD_DTYPE.itemsize
+    with open(path + ".archetypes", encoding="utf-8") as f:
+        assert tuple(line.rstrip("\n") for line in f) == ERROR_ARCHETYPES
+    assert not os.path.exists(path + ".bak")
+    return store
+
+
+def test_new_archetype_widens_the_file(tmp_path):
+    path = str(tmp_path / "analyses.bin")
+    write_old_store(path)
+    store = assert_widened(path)
+    store.record(6.5, {}, [{"type": ERROR_ARCHETYPES[-1]}], user_id=7)
+    assert AnalysisStore(path).column("errors")[-1, -1] == 1
+
+
+def test_interrupted_widen_is_redone(tmp_path):
+    # Crash after the old file was moved aside, before the widened one took its place
+    path = str(tmp_path / "analyses.bin")
+    write_old_store(path, data_path=path + ".bak")
+    assert_widened(path)
+
+
+def test_reordered_roster_is_refused(tmp_path):
+    path = str(tmp_path / "analyses.bin")
+    write_old_store(path)
+    with open(path + ".archetypes", "w", encoding="utf-8") as f:
+        f.writelines(key + "\n" for key in reversed(OLD))
+    with pytest.raises(ValueError):
+        AnalysisStore(path)
+
+
+def test_appends_in_a_loop_are_written_by_close(tmp_path):
+    path = str(tmp_path / "analyses.bin")
+
+    async def scenario():
+        store = AnalysisStore(path)
+        for i in range(3):
+            store.record(6.0, {}, [{"type": ERROR_ARCHETYPES[0]}], user_id=i, region="Bukhara")
+        await store.close()
+
+    asyncio.run(scenario())
+    reopened = AnalysisStore(path)
+    assert len(reopened) == 3 and reopened.regions == ["Bukhara"]
@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+from batching import MicroBatcher
+
+# MicroBatcher dispatch: a lone item goes out at once, items queued behind a call share a batch.
+
+WINDOW_S = 0.05
+
+
+def make_batcher(delay_s: float = 0.0, key_fn=lambda item: item[0]):
+    calls = []
+
+    async def single(item):
+        calls.append([item])
+        await asyncio.sleep(delay_s)
+        return item[1]
+
+    async def batch(items):
+        calls.append(list(items))
+        await asyncio.sleep(delay_s)
+        return [item[1] for item in items]
+
+    return MicroBatcher("test", batch, single, window_s=WINDOW_S, max_items=8, key_fn=key_fn), calls
+
+
+def test_single_request_does_not_wait_for_the_window():
+    async def scenario():
+        batcher, calls = make_batcher()
+        samples = []
+        for i in range(20):
+            start = time.perf_counter()
+            assert await batcher.submit(("alice", i)) == i
+            samples.append(time.perf_counter() - start)
+        return sorted(samples)[len(samples) // 2], calls
+
+    median, calls = asyncio.run(scenario())
+    assert median < WINDOW_S / 5, f"single request took {median * 1000:.1f} ms"
+    assert all(len(call) == 1 for call in calls)
+
+
+def test_items_queued_behind_a_call_share_one_batch():
+    async def scenario():
+        batcher, calls = make_batcher(delay_s=0.02)
+        first = asyncio.ensure_future(batcher.submit(("alice", 0)))
+        await asyncio.sleep(0)  # first is in flight
+        rest = [asyncio.ensure_future(batcher.submit(("alice", i))) for i in range(1, 4)]
+        other = asyncio.ensure_future(batcher.submit(("bob", 9)))
+        results = await asyncio.gather(first, *rest, other)
+        return results, calls, batcher.stats()
+
+    results, calls, stats = asyncio.run(scenario())
+    assert results == [0, 1, 2, 3, 9]
+    assert sorted(len(call) for call in calls) == [1, 1, 3]
+    assert [("alice", 1), ("alice", 2), ("alice", 3)] in calls
+    assert stats["pending"] == 0
+
+
+def test_none_key_is_never_batched():
+    async def scenario():
+        batcher, calls = make_batcher(delay_s=0.01, key_fn=lambda item: None)
+        results = await asyncio.gather(*[batcher.submit(("anon", i)) for i in range(3)])
+        return results, calls
+
+    results, calls = asyncio.run(scenario())
+    assert results == [0, 1, 2]
+    assert calls == [[("anon", 0)], [("anon", 1)], [("anon", 2)]]
@@ -0,0 +1,53 @@
+import json
+
+from question_bank import QuestionBank, quotes_transcript, well_formed
+
+# Question bank hygiene: malformed questions never reach a bucket, transcript quotes are detected.
+
+ERRORS = [{"type": "Tense Error", "category": "Grammar"}]
+
+
+def question(prompt: str, **overrides):
+    base = {
+        "prompt": prompt,
+        "options": ["go", "went", "gone", "going"],
+        "correctAnswer": "went",
+        "complexity": 6.0,
+        "explanation": "Past simple for a finished action.",
+    }
+    return {**base, **overrides}
+
+
+def test_malformed_questions_are_refused():
+    bank = QuestionBank(path=None)
+    bad = [
+        question("Three options", options=["a", "b", "c"], correctAnswer="a"),
+        question("Answer not an option", correctAnswer="goed"),
+        question("No complexity", complexity="hard"),
+        {"prompt": "Missing fields"},
+    ]
+    assert not any(well_formed(q) for q in bad)
+    assert bank.add_many(bad, ERRORS) == 0
+    assert len(bank) == 0
+    assert bank.add_many([question("Yesterday I ___ home.")], ERRORS) == 1
+
+
+def test_poisoned_records_are_skipped_on_load(tmp_path):
+    path = tmp_path / "bank.jsonl"
+    records = [
+        {"errors": ERRORS, "question": question("Fine one ___.")},
+        {"errors": ERRORS, "question": question("Poisoned ___.", options="abcd")},
+    ]
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    bank = QuestionBank(path=str(path))
+    assert [entry["prompt"] for entry in bank.entries] == ["Fine one ___."]
+
+
+def test_quotes_transcript():
+    transcript = "Last summer I travelled to Samarkand with my grandmother Dilnoza."
+    quoting = question("Last summer I ___ to Samarkand with my grandmother.")
+    generic = question("Yesterday she ___ to the market.")
+    assert quotes_transcript(quoting, transcript)
+    assert not quotes_transcript(generic, transcript)
+    assert quotes_transcript(question("Who is Dilnoza?"), "Dilnoza")
+    assert not quotes_transcript(generic, "")
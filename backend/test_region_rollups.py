@@ -0,0 +1,91 @@
+import asyncio
+import os
+import tempfile
+import time
+
+# Scratch database before database.py / region_rollups.py are imported
+WORKDIR = tempfile.mkdtemp(prefix="synapse-rollups-test-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{WORKDIR}/rollups.db")
+os.environ.setdefault("XP_JOURNAL_DIR", f"{WORKDIR}/xp_journal")
+os.environ.setdefault("XP_FLUSH_INTERVAL_S", "3600")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from sqlalchemy import insert, select
+
+from database import AsyncSessionLocal, Base, engine
+from models import RegionXPBucket, User
+from region_rollups import DAY, RegionRollups, day_start, hour_start, region_rollups
+
+# Region rollups: cached regions follow region writes, the cache is bounded, weekly buckets are read.
+
+USERS = {"alice": "Tashkent", "bob": "Samarkand"}
+
+
+def run(coro):
+    async def scoped():
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+                await conn.run_sync(Base.metadata.create_all)
+            async with AsyncSessionLocal() as db:
+                await db.execute(insert(User), [
+                    {"username": username, "region": region, "xp": 0} for username, region in USERS.items()
+                ])
+                await db.commit()
+            return await coro
+        finally:
+            await engine.dispose()  # pooled connections belong to this loop
+    return asyncio.run(scoped())
+
+
+async def scores(rollups: RegionRollups, window: str, now: float = None) -> dict:
+    async with AsyncSessionLocal() as db:
+        result = await rollups.standings(db, window, now)
+    return {row["region"]: row["score"] for row in result["data"]}
+
+
+def test_region_change_moves_later_xp():
+    async def scenario():
+        hour = hour_start(time.time())
+        async with AsyncSessionLocal() as db:
+            await region_rollups.apply(db, {("alice", hour): [10, 1]})
+            await db.commit()
+        assert region_rollups.regions["alice"] == "Tashkent"
+
+        async with AsyncSessionLocal() as db:
+            user = (await db.execute(select(User).where(User.username == "alice"))).scalar_one()
+            user.region = "Bukhara"
+            await db.commit()
+        assert "alice" not in region_rollups.regions
+
+        async with AsyncSessionLocal() as db:
+            await region_rollups.apply(db, {("alice", hour): [5, 1]})
+            await db.commit()
+        assert await scores(region_rollups, "day") == {"Tashkent": 10, "Bukhara": 5}
+    run(scenario())
+
+
+def test_region_cache_is_bounded():
+    async def scenario():
+        rollups = RegionRollups(None, cache_size=1)
+        async with AsyncSessionLocal() as db:
+            assert await rollups._resolve(db, USERS) == USERS
+        assert len(rollups.regions) == 1
+    run(scenario())
+
+
+def test_quarter_window_reads_compacted_weeks():
+    async def scenario():
+        now = time.time()
+        rollups = RegionRollups(None)
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(RegionXPBucket), [
+                {"region": "Tashkent", "granularity": "d", "start": day_start(now) - 50 * DAY, "xp": 700, "events": 7},
+                {"region": "Tashkent", "granularity": "d", "start": day_start(now) - DAY, "xp": 30, "events": 3},
+            ])
+            await db.commit()
+            summary = await rollups.compact(db, now)
+        assert summary["days_folded"] == 1
+        assert await scores(rollups, "month", now) == {"Tashkent": 30}
+        assert await scores(rollups, "quarter", now) == {"Tashkent": 730}
+    run(scenario())
@@ -0,0 +1,33 @@
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+import uploads
+from uploads import MappedReader, SpooledUploadRoute, detached
+
+# Upload spooling: the spool size is per route, and spooled content streams back out unchanged.
+
+CONTENT = b"RIFF" + bytes(range(256)) * 64
+
+
+def make_app(monkeypatch) -> FastAPI:
+    monkeypatch.setattr(uploads, "UPLOAD_SPOOL_LIMITS", {"/small-spool": 1024})
+    app = FastAPI()
+    app.router.route_class = SpooledUploadRoute
+
+    @app.post("/small-spool")
+    async def small_spool(file: UploadFile = File(...)):
+        data = detached(file)
+        return {"on_disk": file.file._rolled, "intact": MappedReader(data).read() == CONTENT}
+
+    @app.post("/default-spool")
+    async def default_spool(file: UploadFile = File(...)):
+        return {"on_disk": file.file._rolled}
+
+    return app
+
+
+def test_spool_limit_is_per_route(monkeypatch):
+    client = TestClient(make_app(monkeypatch))
+    files = {"file": ("clip.wav", CONTENT)}
+    assert client.post("/small-spool", files=files).json() == {"on_disk": True, "intact": True}
+    assert client.post("/default-spool", files=files).json() == {"on_disk": False}
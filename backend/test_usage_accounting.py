@@ -0,0 +1,41 @@
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+import usage_accounting
+from usage_accounting import accounting, current_context, metered, report_access
+
+# Usage accounting at the HTTP edge: budgets without X-User-Id, access to the cost report.
+
+app = FastAPI()
+
+
+@app.get("/metered", dependencies=[Depends(metered("combat-voice"))])
+async def metered_route():
+    return {"budget_key": current_context().budget_key}
+
+
+@app.get("/report", dependencies=[Depends(report_access)])
+async def report_route():
+    return {"ok": True}
+
+
+def test_header_less_calls_share_an_ip_budget(monkeypatch):
+    monkeypatch.setattr(accounting, "daily_token_budget", 100)
+    monkeypatch.setattr(accounting, "daily", {})
+    client = TestClient(app)
+    assert client.get("/metered").json() == {"budget_key": "ip:testclient"}
+
+    accounting._charge("ip:testclient", 100)
+    assert client.get("/metered").status_code == 429
+    # A named user behind the same address has their own budget
+    assert client.get("/metered", headers={"X-User-Id": "alice"}).json() == {"budget_key": "alice"}
+
+
+def test_report_needs_the_token(monkeypatch):
+    client = TestClient(app)
+    assert client.get("/report").status_code == 404
+
+    monkeypatch.setattr(usage_accounting, "USAGE_REPORT_TOKEN", "s3cret")
+    assert client.get("/report").status_code == 403
+    assert client.get("/report", headers={"X-Report-Token": "wrong"}).status_code == 403
+    assert client.get("/report", headers={"X-Report-Token": "s3cret"}).status_code == 200
@@ -0,0 +1,65 @@
+import os
+import tempfile
+
+# Scratch database, journal and stores before main.py is imported; no OpenAI key, so
+# every upload goes through the refinery's fallback
+WORKDIR = tempfile.mkdtemp(prefix="synapse-worldmap-test-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{WORKDIR}/app.db")
+os.environ.setdefault("XP_JOURNAL_DIR", f"{WORKDIR}/xp_journal")
+os.environ.setdefault("XP_FLUSH_INTERVAL_S", "3600")
+os.environ.setdefault("QUESTION_BANK_PATH", f"{WORKDIR}/question_bank.jsonl")
+os.environ.setdefault("ANALYSIS_STORE_PATH", f"{WORKDIR}/analyses.bin")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["OPENAI_API_KEY"] = ""
+
+from fastapi.testclient import TestClient
+
+import main
+
+# Quest XP through the HTTP endpoints: unreadable uploads must not pay the mock quests again.
+
+
+def upload(client, username: str, content: bytes, filename: str = "notes.pdf"):
+    response = client.post("/api/refine-content", files={"file": (filename, content)}, headers={"X-User-Id": username})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def complete_all(client, username: str) -> int:
+    """Complete every reachable quest on the user's map; returns the XP paid"""
+    paid = 0
+    while True:
+        nodes = client.get("/api/world-map", headers={"X-User-Id": username}).json()
+        open_nodes = [node for node in nodes if node["status"] == "unlocked"]
+        if not open_nodes:
+            return paid
+        response = client.post(f"/api/world-map/{open_nodes[0]['id']}/complete", headers={"X-User-Id": username})
+        assert response.status_code == 200, response.text
+        paid += response.json()["xpAwarded"]
+
+
+def test_junk_uploads_pay_mock_quests_once():
+    with TestClient(main.app) as client:
+        first = upload(client, "junk_farmer", b"%PDF-1.4 junk one")
+        assert main.world_maps.maps["junk_farmer"].source == main.MOCK_QUESTS_SOURCE
+        paid = complete_all(client, "junk_farmer")
+        assert paid > 0
+
+        # A byte-distinct junk PDF: same fallback source, and the played map is kept
+        second = upload(client, "junk_farmer", b"%PDF-1.4 junk two, different bytes")
+        assert [node["id"] for node in second] == [node["id"] for node in first]
+        assert all(node["status"] == "completed" for node in second)
+        assert main.world_maps.maps["junk_farmer"].source == main.MOCK_QUESTS_SOURCE
+        assert complete_all(client, "junk_farmer") == 0
+
+        # Even with the map rebuilt from the mocks, the slots stay paid
+        main.world_maps.maps.clear()
+        nodes = [quest.model_dump() for quest in main.mock_refinement().quests]
+
+        async def rebuild():
+            from database import AsyncSessionLocal
+            async with AsyncSessionLocal() as db:
+                await main.world_maps.replace(db, "junk_farmer", nodes, source=main.MOCK_QUESTS_SOURCE)
+
+        client.portal.call(rebuild)
+        assert complete_all(client, "junk_farmer") == 0
@@ -0,0 +1,346 @@
+import asyncio
+import glob
+import os
+import tempfile
+
+# Scratch database before database.py / xp_ledger.py are imported; no periodic flush during a test
+WORKDIR = tempfile.mkdtemp(prefix="synapse-xp-test-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{WORKDIR}/xp.db")
+os.environ.setdefault("XP_JOURNAL_DIR", f"{WORKDIR}/xp_journal")
+os.environ.setdefault("XP_FLUSH_INTERVAL_S", "3600")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from sqlalchemy import insert, select
+
+from database import AsyncSessionLocal, Base, engine
+from models import User, XPLedgerCheckpoint
+from xp_ledger import CHECKPOINT_ID, XPLedger, applied_seq_column
+
+# Write-behind XP ledger: crash replay, failed flushes, reads racing a flush, journal slots.
+# Each test gets a fresh schema and journal directory.
+
+USERS = ("alice", "bob")
+
+
+def run(coro):
+    async def scoped():
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+                await conn.run_sync(Base.metadata.create_all)
+            async with AsyncSessionLocal() as db:
+                await db.execute(insert(User), [{"username": username, "xp": 0} for username in USERS])
+                await db.commit()
+            return await coro
+        finally:
+            await engine.dispose()  # pooled connections belong to this loop
+    return asyncio.run(scoped())
+
+
+async def read_xp(ledger: XPLedger, username: str):
+    """users.xp and the ledger's checkpoint from one statement, like the leaderboard reads"""
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(User.xp, applied_seq_column(ledger.checkpoint_id)).where(User.username == username)
+        )).one()
+    return row.xp, row.applied_seq
+
+
+async def stop_without_flush(ledger: XPLedger):
+    """Simulate a crash: no final flush, the journal is left as it is"""
+    if ledger._task is not None:
+        ledger._task.cancel()
+    ledger._close()
+
+
+def segments(directory) -> list:
+    return glob.glob(os.path.join(str(directory), "*.log"))
+
+
+class Listener:
+    """Minimal ledger listener; apply() can fail or block to steer a flush"""
+
+    def __init__(self):
+        self.pending, self.restored, self.commits = [], [], 0
+        self.fail = False
+        self.entered = asyncio.Event()
+        self.release = asyncio.Event()
+        self.release.set()
+
+    def record(self, username, delta, ts):
+        self.pending.append((username, delta))
+
+    def take(self):
+        batch, self.pending = self.pending, []
+        return batch
+
+    async def apply(self, db, batch):
+        self.entered.set()
+        await self.release.wait()
+        if self.fail:
+            raise RuntimeError("listener write failed")
+
+    def restore(self, batch):
+        self.restored.append(batch)
+        self.pending = batch + self.pending
+
+    def committed(self):
+        self.commits += 1
+
+    def reset(self):
+        self.pending = []
+
+
+def test_replay_after_crash(tmp_path):
+    async def scenario():
+        ledger = XPLedger(str(tmp_path))
+        await ledger.start()
+        ledger.award("alice", 10, "combat")
+        ledger.award("bob", 5, "combat")
+        assert await ledger.flush() == 2
+        ledger.award("alice", 7, "raid")  # journaled, never flushed
+        await stop_without_flush(ledger)
+
+        restarted = XPLedger(str(tmp_path))
+        await restarted.start()
+        # Only the entry above the checkpoint comes back; the flushed ones are not applied twice
+        assert restarted.slot == ledger.slot == 0
+        assert restarted.pending == {"alice": 7}
+        assert restarted.seq == ledger.seq
+        xp, applied_seq = await read_xp(restarted, "alice")
+        assert xp + restarted.pending_delta("alice", applied_seq) == 17
+
+        restarted.award("bob", 1, "combat")
+        assert restarted.seq == ledger.seq + 1
+        await restarted.stop()
+        assert await read_xp(restarted, "alice") == (17, restarted.seq)
+        assert (await read_xp(restarted, "bob"))[0] == 6
+        # Replayed segments are gone once covered; only the fresh segment remains
+        assert len(segments(tmp_path)) == 1
+
+    run(scenario())
+
+
+def test_replay_is_idempotent_across_repeated_crashes(tmp_path):
+    async def scenario():
+        ledger = XPLedger(str(tmp_path))
+        await ledger.start()
+        ledger.award("alice", 10, "combat")
+        await stop_without_flush(ledger)
+        for _ in range(2):
+            ledger = XPLedger(str(tmp_path))
+            await ledger.start()
+            assert ledger.pending == {"alice": 10}
+            await stop_without_flush(ledger)
+        ledger = XPLedger(str(tmp_path))
+        await ledger.start()
+        await ledger.stop()
+        assert (await read_xp(ledger, "alice"))[0] == 10
+
+    run(scenario())
+
+
+def test_flush_failure_restores_pending(tmp_path):
+    async def scenario():
+        ledger = XPLedger(str(tmp_path))
+        listener = Listener()
+        ledger.add_listener(listener)
+        await ledger.start()
+        ledger.award("alice", 10, "combat")
+        ledger.award("alice", 3, "raid")
+        ledger.award("bob", 4, "combat")
+
+        listener.fail = True
+        assert await ledger.flush() == 0
+        # Nothing was written (one transaction), everything is pending again
+        assert await read_xp(ledger, "alice") == (0, 0)
+        assert ledger.pending == {"alice": 13, "bob": 4}
+        assert ledger.inflight == {} and ledger.committed_batch == {}
+        assert listener.restored == [[("alice", 10), ("alice", 3), ("bob", 4)]]
+        assert ledger.stats()["pending_awards"] == 3
+        assert ledger.pending_delta("alice", 0) == 13
+
+        # Awards made after the failure join the retry
+        ledger.award("alice", 2, "combat")
+        listener.fail = False
+        assert await ledger.flush() == 2
+        assert await read_xp(ledger, "alice") == (15, ledger.seq)
+        assert (await read_xp(ledger, "bob"))[0] == 4
+        assert listener.commits == 1 and listener.pending == []
+        assert ledger.stats()["flushed_awards"] == 4
+        assert len(segments(tmp_path)) == 1  # sealed segments kept until the retry committed
+        await ledger.stop()
+
+    run(scenario())
+
+
+def test_pending_delta_around_flush(tmp_path):
+    async def scenario():
+        ledger = XPLedger(str(tmp_path))
+        listener = Listener()
+        ledger.add_listener(listener)
+        await ledger.start()
+        ledger.award("alice", 10, "combat")
+        before = await read_xp(ledger, "alice")  # snapshot taken before the flush
+        assert before == (0, 0)
+
+        listener.release.clear()
+        flush = asyncio.create_task(ledger.flush())
+        await listener.entered.wait()
+        # Mid-flush: the batch is in flight, new awards go to the next one
+        ledger.award("alice", 5, "raid")
+        assert ledger.pending_delta("alice", before[1]) == 15
+        listener.release.set()
+        assert await flush == 1
+
+        # A read issued before the commit and evaluated after it still counts the batch
+        assert before[0] + ledger.pending_delta("alice", before[1]) == 15
+        after = await read_xp(ledger, "alice")
+        assert after == (10, ledger.committed_seq)
+        assert after[0] + ledger.pending_delta("alice", after[1]) == 15
+        assert "alice" in ledger.pending_users()
+
+        # The next flush drops the committed batch; its own commit covers the old reads again
+        assert await ledger.flush() == 1
+        assert ledger.committed_batch == {"alice": 5}
+        latest = await read_xp(ledger, "alice")
+        assert latest == (15, ledger.seq)
+        assert latest[0] + ledger.pending_delta("alice", latest[1]) == 15
+        await ledger.stop()
+
+    run(scenario())
+
+
+def write_segment(directory, number: int, lines):
+    """A hand-written journal; the high-water file pins seq to what the lines hold"""
+    with open(os.path.join(directory, "seq"), "wb") as f:
+        f.write(b"0")
+    path = os.path.join(directory, f"{number:010d}.log")
+    with open(path, "wb") as f:
+        f.write(b"".join(lines))
+    return path
+
+
+def test_recover_accepts_lines_without_timestamp(tmp_path):
+    seen = []
+
+    class Recorder(Listener):
+        def record(self, username, delta, ts):
+            seen.append((username, delta, ts))
+
+    path = write_segment(tmp_path, 1, [b'[1, "alice", 10, "combat"]\n', b'[2, "bob", 4, "raid", 1700000000]\n'])
+    os.utime(path, (1600000000, 1600000000))
+    ledger = XPLedger(str(tmp_path))
+    ledger.add_listener(Recorder())
+    assert ledger.recover(0) == 2
+    assert ledger.seq == 2
+    assert ledger.pending == {"alice": 10, "bob": 4}
+    assert seen == [("alice", 10, 1600000000), ("bob", 4, 1700000000)]
+    ledger._close()
+
+
+def test_recover_cuts_only_a_torn_final_write(tmp_path):
+    write_segment(tmp_path, 1, [b'[1, "alice", 10, "combat", 1700000000]\n'])
+    last = write_segment(tmp_path, 2, [b'[2, "bob", 4, "raid", 1700000000]\n', b'[3, "ali'])
+    ledger = XPLedger(str(tmp_path))
+    assert ledger.recover(0) == 2
+    assert ledger.seq == 2
+    ledger._close()
+    with open(last, "rb") as f:
+        assert f.read() == b'[2, "bob", 4, "raid", 1700000000]\n'
+    # The cut segment is no longer the last one; recovering again still works
+    again = XPLedger(str(tmp_path))
+    assert again.recover(0) == 2
+    again._close()
+
+
+def test_recover_refuses_a_corrupt_entry_before_the_tail(tmp_path):
+    write_segment(tmp_path, 1, [b'[1, "alice", 10, "combat", 1700000000]\n', b'garbage\n',
+                                b'[3, "bob", 4, "raid", 1700000000]\n'])
+    write_segment(tmp_path, 2, [b'[4, "bob", 1, "raid", 1700000000]\n'])
+    ledger = XPLedger(str(tmp_path))
+    try:
+        ledger.recover(0)
+    except ValueError as e:
+        assert "0000000001.log:2" in str(e)
+    else:
+        raise AssertionError("a corrupt entry mid-journal must not be skipped")
+
+
+def test_workers_journal_to_separate_slots(tmp_path):
+    async def scenario():
+        first, second = XPLedger(str(tmp_path)), XPLedger(str(tmp_path))
+        await first.start()
+        await second.start()
+        assert (first.slot, second.slot) == (0, 1)
+        assert first.checkpoint_id != second.checkpoint_id
+        first.award("alice", 10, "combat")
+        second.award("alice", 3, "combat")
+        second.award("bob", 4, "combat")
+        assert await second.flush() == 2
+        second.award("bob", 1, "raid")
+        await stop_without_flush(first)
+        await stop_without_flush(second)
+
+        # Each restarted worker replays only its own slot against its own checkpoint
+        again = [XPLedger(str(tmp_path)), XPLedger(str(tmp_path))]
+        for ledger in again:
+            await ledger.start()
+        assert again[0].pending == {"alice": 10}
+        assert again[1].pending == {"bob": 1}
+        for ledger in again:
+            await ledger.stop()
+        assert (await read_xp(again[0], "alice"))[0] == 13
+        assert (await read_xp(again[1], "bob"))[0] == 5
+
+    run(scenario())
+
+
+def test_awards_before_start_survive_a_crash(tmp_path):
+    async def scenario():
+        ledger = XPLedger(str(tmp_path))
+        ledger.award("alice", 8, "summon")  # e.g. from a startup step that runs before the ledger's
+        assert ledger.pending_delta("alice", 0) == 8
+        assert await ledger.flush() == 0  # not before start() has read the checkpoint
+        await stop_without_flush(ledger)
+
+        restarted = XPLedger(str(tmp_path))
+        await restarted.start()
+        assert restarted.pending == {"alice": 8}
+        await restarted.stop()
+        assert (await read_xp(restarted, "alice"))[0] == 8
+
+    run(scenario())
+
+
+def test_start_keeps_awards_made_before_it(tmp_path):
+    async def scenario():
+        ledger = XPLedger(str(tmp_path))
+        ledger.award("alice", 8, "summon")
+        await ledger.start()
+        assert ledger.pending == {"alice": 8}
+        assert ledger.stats()["awards"] == 1
+        await ledger.stop()
+        assert (await read_xp(ledger, "alice"))[0] == 8
+
+    run(scenario())
+
+
+def test_slot_without_high_water_starts_above_an_old_checkpoint(tmp_path):
+    async def scenario():
+        # An older version flushed everything up to seq 100 and deleted its segments
+        async with AsyncSessionLocal() as db:
+            db.add(XPLedgerCheckpoint(id=CHECKPOINT_ID, applied_seq=100))
+            await db.commit()
+        ledger = XPLedger(str(tmp_path))
+        ledger.award("alice", 8, "summon")
+        assert ledger.seq > 100
+        await stop_without_flush(ledger)
+
+        restarted = XPLedger(str(tmp_path))
+        await restarted.start()
+        assert restarted.pending == {"alice": 8}
+        await restarted.stop()
+        assert (await read_xp(restarted, "alice"))[0] == 8
+
+    run(scenario())
@@ -0,0 +1,206 @@
+from contextlib import contextmanager
+from tempfile import SpooledTemporaryFile
+from typing import Callable, Dict, Optional, Union
+import io
+import mmap
+import os
+
+from fastapi import HTTPException, Request, UploadFile
+from fastapi.routing import APIRoute
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+from serialization import FastJSONResponse
+from logging_setup import get_logger
+
+log = get_logger("synapse.uploads")
+
+# Memory-bounded uploads.
+#   - UploadLimitMiddleware rejects a request body to an upload route with 413.
+#     It does so up front when Content-Length is over the route's limit, or
+#     mid-stream once the received bytes pass it (chunked uploads, lying
+#     clients). Nothing past the limit is read.
+#   - SpooledUploadRoute parses the multipart body of an upload route itself,
+#     keeping each file part in memory only up to the route's
+#     UPLOAD_SPOOL_LIMITS entry, then rolling it over to a temp file. Other
+#     routes keep Starlette's defaults.
+#   - mapped(upload) gives handlers a zero-copy view of the content: the
+#     in-memory buffer, or an mmap of the temp file (pypdf reads it directly).
+#     Handlers therefore never `await file.read()` a whole PDF into memory.
+#   - detached(upload) is for work that can outlive the request (a shared
+#     single-flight call): a copy of an in-memory spool, or a mapping of its
+#     own that keeps the temp file alive after the request closes it.
+#   - MappedReader streams a mapping to an HTTP client (Whisper uploads) with a
+#     known length and without copying it.
+
+MiB = 1024 * 1024
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", str(1 * MiB)))
+UPLOAD_MAX_PDF_BYTES = int(os.getenv("UPLOAD_MAX_PDF_BYTES", str(100 * MiB)))
+UPLOAD_MAX_AUDIO_BYTES = int(os.getenv("UPLOAD_MAX_AUDIO_BYTES", str(25 * MiB)))  # Whisper's own limit
+
+# Request path -> maximum upload size; the body may exceed it by MULTIPART_OVERHEAD
+MULTIPART_OVERHEAD = 64 * 1024
+UPLOAD_LIMITS: Dict[str, int] = {
+    "/api/refine-content": UPLOAD_MAX_PDF_BYTES,
+    "/api/analyze-speech": UPLOAD_MAX_AUDIO_BYTES,
+    "/api/combat-voice": UPLOAD_MAX_AUDIO_BYTES,
+}
+
+# Request path -> bytes of a file part held in memory before it spools to disk
+UPLOAD_SPOOL_LIMITS: Dict[str, int] = {path: UPLOAD_SPOOL_MAX_BYTES for path in UPLOAD_LIMITS}
+
+
+class UploadStats:
+    def __init__(self):
+        self.rejected_declared = 0  # Content-Length over the limit
+        self.rejected_streamed = 0  # cut off mid-body
+        self.in_memory = 0
+        self.mapped = 0
+        self.mapped_bytes = 0
+
+    def snapshot(self) -> Dict:
+        return dict(self.__dict__)
+
+
+upload_stats = UploadStats()
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Upload larger than {limit // MiB} MiB")
+
+
+class UploadLimitMiddleware:
+    """Pure ASGI middleware so the limit applies while the body is still arriving"""
+
+    def __init__(self, app, limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.limits = UPLOAD_LIMITS if limits is None else limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        body_limit = limit + MULTIPART_OVERHEAD
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > body_limit:
+            upload_stats.rejected_declared += 1
+            log.info("upload_rejected", path=scope["path"], declared=int(declared), limit=limit)
+            response = FastJSONResponse({"detail": _too_large(limit).detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > body_limit:
+                    upload_stats.rejected_streamed += 1
+                    log.info("upload_rejected", path=scope["path"], received=received, limit=limit)
+                    # FastAPI re-raises HTTPExceptions from body parsing; the parser closes its temp files
+                    raise _too_large(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class SpooledUploadRoute(APIRoute):
+    """
+    APIRoute that parses an upload route's form with the route's spool size.
+    FastAPI reuses the parsed form (request.form() is cached on the request).
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        spool_max = UPLOAD_SPOOL_LIMITS.get(self.path)
+        if spool_max is None:
+            return handler
+
+        async def route_handler(request: Request):
+            if request.headers.get("content-type", "").lower().startswith("multipart/form-data"):
+                parser = MultiPartParser(request.headers, request.stream())
+                parser.max_file_size = spool_max
+                try:
+                    request._form = await parser.parse()
+                except MultiPartException as e:
+                    raise HTTPException(status_code=400, detail=e.message)
+            return await handler(request)
+
+        return route_handler
+
+
+@contextmanager
+def mapped(upload: UploadFile):
+    """
+    Read-only, zero-copy view of an upload's content for the duration of the block:
+    a memoryview of the in-memory spool, or an mmap of the rolled-over temp file.
+    Both work with hashlib and len(); the mmap is also a seekable stream.
+    """
+    spool = upload.file
+    if isinstance(spool, SpooledTemporaryFile) and not spool._rolled:
+        upload_stats.in_memory += 1
+        view = spool._file.getbuffer()
+        try:
+            yield view
+        finally:
+            view.release()
+        return
+
+    spool.flush()
+    fd = spool.fileno()
+    size = os.fstat(fd).st_size
+    if size == 0:
+        yield b""  # mmap can't map an empty file
+        return
+    upload_stats.mapped += 1
+    upload_stats.mapped_bytes += size
+    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as view:
+        yield view
+
+
+def detached(upload: UploadFile) -> Union[bytes, mmap.mmap]:
+    """
+    The upload's content, owned by the caller rather than the request: bytes of
+    an in-memory spool (at most the route's spool limit), or a separate read-only
+    mmap of the temp file, unmapped once the last reference to it is dropped.
+    Call it while the request still holds the upload.
+    """
+    spool = upload.file
+    if isinstance(spool, SpooledTemporaryFile) and not spool._rolled:
+        return spool._file.getvalue()
+    spool.flush()
+    fd = spool.fileno()
+    if os.fstat(fd).st_size == 0:
+        return b""
+    return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+
+
+class MappedReader(io.RawIOBase):
+    """Seekable binary stream over a mapping, with its own position (mmap.seek() returns None before 3.13)"""
+
+    def __init__(self, view: Union[mmap.mmap, memoryview]):
+        self.view = view
+        self.pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.pos, io.SEEK_END: len(self.view)}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def readinto(self, buffer) -> int:
+        chunk = self.view[self.pos:self.pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self.pos += len(chunk)
+        return len(chunk)
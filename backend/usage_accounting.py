@@ -0,0 +1,299 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import contextvars
+import datetime
+import os
+import secrets
+import time
+
+from fastapi import HTTPException, Request
+from sqlalchemy import func, insert, select
+
+from admission import USER_HEADER, client_ip
+from database import AsyncSessionLocal
+from models import UsageRecord, User
+from logging_setup import get_logger
+
+log = get_logger("synapse.usage")
+
+# Token/cost accounting for every upstream AI call.
+#   - Endpoints declare Depends(metered("combat-voice")): it enforces the caller's
+#     daily token budget (O(1) dict lookup) and tags the request context, so the
+#     call sites don't need to thread user/endpoint through. Callers without
+#     X-User-Id share one budget per client IP ("ip:<address>").
+#   - accounting.call(fn, **kwargs) runs the OpenAI call in a worker thread and
+#     records prompt/completion tokens, latency and estimated cost.
+#   - Records are buffered and inserted in batches; usernames are resolved to
+#     user/clan ids once per batch.
+#   - The cost report (per user, clan, ...) needs the USAGE_REPORT_TOKEN in
+#     X-Report-Token; without the env var it is disabled.
+# Days are UTC days.
+
+USAGE_DAILY_TOKEN_BUDGET = int(os.getenv("USAGE_DAILY_TOKEN_BUDGET", "0"))  # per user, 0 = unlimited
+USAGE_FLUSH_INTERVAL_S = float(os.getenv("USAGE_FLUSH_INTERVAL_S", "2"))
+USAGE_FLUSH_MAX = int(os.getenv("USAGE_FLUSH_MAX", "500"))
+USAGE_REPORT_TOKEN = os.getenv("USAGE_REPORT_TOKEN", "")
+REPORT_TOKEN_HEADER = "x-report-token"
+
+# USD per 1M tokens (input, output) and per audio minute
+PRICES: Dict[str, Dict[str, float]] = {
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+    "whisper-1": {"audio_minute": 0.006},
+}
+
+REPORT_DIMENSIONS = {
+    "endpoint": UsageRecord.endpoint,
+    "user": UsageRecord.username,
+    "clan": UsageRecord.clan_id,
+    "model": UsageRecord.model,
+}
+
+
+@dataclass(frozen=True)
+class UsageContext:
+    endpoint: str
+    username: Optional[str] = None
+    budget_key: Optional[str] = None  # username, or ip:<address> for header-less callers
+
+
+_INTERNAL = UsageContext("internal")
+_current: contextvars.ContextVar = contextvars.ContextVar("usage_context", default=_INTERNAL)
+
+
+def current_context() -> UsageContext:
+    return _current.get()
+
+
+def _today() -> int:
+    return int(time.time() // 86400)
+
+
+def _seconds_until_tomorrow() -> int:
+    return int((_today() + 1) * 86400 - time.time()) + 1
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, audio_seconds: float = 0.0) -> float:
+    price = PRICES.get(model, {})
+    return (
+        prompt_tokens * price.get("input", 0.0) / 1e6
+        + completion_tokens * price.get("output", 0.0) / 1e6
+        + audio_seconds / 60 * price.get("audio_minute", 0.0)
+    )
+
+
+class UsageAccountant:
+    def __init__(self, daily_token_budget: int = USAGE_DAILY_TOKEN_BUDGET):
+        self.daily_token_budget = daily_token_budget
+        # username -> [utc day, tokens used that day]
+        self.daily: Dict[str, List[int]] = {}
+        self.pending: List[Dict[str, Any]] = []
+        self.written = 0
+        self.rejected = 0
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    # --- Budgets ---
+
+    def tokens_today(self, username: str) -> int:
+        entry = self.daily.get(username)
+        return entry[1] if entry is not None and entry[0] == _today() else 0
+
+    def check_budget(self, budget_key: Optional[str]):
+        if not budget_key or self.daily_token_budget <= 0:
+            return
+        if self.tokens_today(budget_key) >= self.daily_token_budget:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Daily AI budget used up",
+                headers={"Retry-After": str(_seconds_until_tomorrow())},
+            )
+
+    def _charge(self, budget_key: Optional[str], tokens: int):
+        if not budget_key:
+            return
+        today = _today()
+        entry = self.daily.get(budget_key)
+        if entry is None or entry[0] != today:
+            self.daily[budget_key] = [today, tokens]
+        else:
+            entry[1] += tokens
+
+    async def load_today(self):
+        """Rebuild today's per-budget counters after a restart"""
+        midnight = datetime.datetime.utcfromtimestamp(_today() * 86400)
+        # Rows written before budget_key existed were charged to their username
+        budget_key = func.coalesce(UsageRecord.budget_key, UsageRecord.username)
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(budget_key, func.sum(UsageRecord.prompt_tokens + UsageRecord.completion_tokens))
+                .where(UsageRecord.created_at >= midnight, budget_key.is_not(None))
+                .group_by(budget_key)
+            )).all()
+        today = _today()
+        for key, tokens in rows:
+            self.daily[key] = [today, int(tokens or 0)]
+
+    # --- Recording ---
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int, latency_s: float,
+               audio_seconds: float = 0.0, contexts: Optional[List[UsageContext]] = None):
+        """Attribute one upstream call, split evenly across `contexts` (batched calls)"""
+        contexts = contexts or [current_context()]
+        n = len(contexts)
+        now = datetime.datetime.utcnow()
+        for i, ctx in enumerate(contexts):
+            # Integer shares; the remainder goes to the first caller
+            prompt_share = prompt_tokens // n + (prompt_tokens % n if i == 0 else 0)
+            completion_share = completion_tokens // n + (completion_tokens % n if i == 0 else 0)
+            self._charge(ctx.budget_key, prompt_share + completion_share)
+            self.pending.append({
+                "created_at": now,
+                "endpoint": ctx.endpoint,
+                "model": model,
+                "username": ctx.username,
+                "budget_key": ctx.budget_key,
+                "prompt_tokens": prompt_share,
+                "completion_tokens": completion_share,
+                "audio_seconds": audio_seconds / n,
+                "latency_ms": latency_s * 1000,
+                "cost_usd": estimate_cost(model, prompt_share, completion_share, audio_seconds / n),
+            })
+        if len(self.pending) >= USAGE_FLUSH_MAX:
+            self._spawn_flush()
+
+    async def call(self, fn: Callable, *args, contexts: Optional[List[UsageContext]] = None,
+                   audio_seconds: float = 0.0, **kwargs):
+        """Run a blocking OpenAI call off the event loop and record its usage"""
+        start = time.perf_counter()
+        response = await asyncio.to_thread(fn, *args, **kwargs)
+        usage = getattr(response, "usage", None)
+        self.record(
+            kwargs.get("model", "unknown"),
+            int(getattr(usage, "prompt_tokens", 0) or 0),
+            int(getattr(usage, "completion_tokens", 0) or 0),
+            time.perf_counter() - start,
+            audio_seconds=audio_seconds,
+            contexts=contexts,
+        )
+        return response
+
+    # --- Batched writes ---
+
+    def _spawn_flush(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            return  # One early flush at a time; it takes everything pending when it runs
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+        except RuntimeError:
+            pass  # No loop (scripts); the next periodic flush picks them up
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+            try:
+                async with AsyncSessionLocal() as db:
+                    usernames = {row["username"] for row in batch if row["username"]}
+                    ids = {}
+                    if usernames:
+                        result = await db.execute(select(User.username, User.id, User.clan_id).where(User.username.in_(usernames)))
+                        ids = {username: (user_id, clan_id) for username, user_id, clan_id in result.all()}
+                    for row in batch:
+                        row["user_id"], row["clan_id"] = ids.get(row["username"], (None, None))
+                    await db.execute(insert(UsageRecord), batch)
+                    await db.commit()
+            except Exception as e:
+                # Keep the rows for the next attempt rather than losing billing data
+                self.pending = batch + self.pending
+                log.warning("usage_flush_failed", rows=len(batch), error=str(e))
+                return 0
+            self.written += len(batch)
+            return len(batch)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(USAGE_FLUSH_INTERVAL_S)
+            await self.flush()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    # --- Reporting ---
+
+    async def report(self, db, by: str, days: int = 1, limit: int = 50) -> Dict:
+        column = REPORT_DIMENSIONS[by]
+        since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+        tokens = func.sum(UsageRecord.prompt_tokens + UsageRecord.completion_tokens)
+        rows = (await db.execute(
+            select(
+                column,
+                func.count(UsageRecord.id),
+                func.sum(UsageRecord.prompt_tokens),
+                func.sum(UsageRecord.completion_tokens),
+                func.sum(UsageRecord.audio_seconds),
+                func.sum(UsageRecord.cost_usd),
+                func.avg(UsageRecord.latency_ms),
+            )
+            .where(UsageRecord.created_at >= since)
+            .group_by(column)
+            .order_by(tokens.desc())
+            .limit(limit)
+        )).all()
+        return {
+            "by": by,
+            "days": days,
+            "unflushed_records": len(self.pending),
+            "rows": [
+                {
+                    by: key,
+                    "calls": calls,
+                    "prompt_tokens": int(prompt or 0),
+                    "completion_tokens": int(completion or 0),
+                    "audio_seconds": round(audio or 0.0, 1),
+                    "cost_usd": round(cost or 0.0, 6),
+                    "avg_latency_ms": round(latency or 0.0, 1),
+                }
+                for key, calls, prompt, completion, audio, cost, latency in rows
+            ],
+        }
+
+    def stats(self) -> Dict:
+        return {"pending": len(self.pending), "written": self.written, "budget_rejections": self.rejected}
+
+
+accounting = UsageAccountant()
+
+
+def metered(endpoint: str):
+    """
+    FastAPI dependency: Depends(metered("combat-voice")).
+    Rejects users (or, without X-User-Id, client IPs) over their daily token budget
+    and tags the request for attribution.
+    """
+    async def dependency(request: Request):
+        username = request.headers.get(USER_HEADER)
+        ip = client_ip(request)
+        budget_key = username or (f"ip:{ip}" if ip else None)
+        accounting.check_budget(budget_key)
+        _current.set(UsageContext(endpoint, username, budget_key))
+    return dependency
+
+
+async def report_access(request: Request):
+    """FastAPI dependency for the usage report: X-Report-Token must match USAGE_REPORT_TOKEN"""
+    if not USAGE_REPORT_TOKEN:
+        raise HTTPException(status_code=404, detail="Usage report disabled. Set USAGE_REPORT_TOKEN to enable.")
+    token = request.headers.get(REPORT_TOKEN_HEADER, "")
+    if not secrets.compare_digest(token.encode(), USAGE_REPORT_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid report token")
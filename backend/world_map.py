@@ -0,0 +1,303 @@
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+import asyncio
+import os
+
+from sqlalchemy import select, update
+
+from models import QuestReward, UserWorldMap
+from serialization import dumps_bytes, loads
+from logging_setup import get_logger
+
+log = get_logger("synapse.world_map")
+
+# Server-side quest world map.
+#   - Layout: node i sits at the i-th axial hex of a spiral around (0, 0):
+#     the centre, then ring 1, ring 2, ... Coordinates are unique by
+#     construction and never come from the model. Quests are placed easiest
+#     first, so difficulty grows outward.
+#   - A layout depends only on the node count. The coordinate -> node index
+#     and the per-node neighbour lists are built once per size and shared by
+#     every map of that size.
+#   - Per user we keep the quest definitions plus one status byte per node.
+#     Completing a node unlocks its locked neighbours: six lookups, no scan.
+#   - Persisted as (quest JSON without coordinates/status, status bytes). A
+#     completion rewrites only the status bytes.
+#   - Rewards come from the model: xp is clamped to QUEST_XP_MAX. A map
+#     remembers the content key of the upload it was built from, and quest XP
+#     is paid once per (user, upload, slot). Re-uploading the same PDF rebuilds
+#     the map but pays nothing twice. Slots, not quest ids, because the model
+#     names quests differently on every run.
+# Loaded maps stay in an LRU of WORLD_MAP_CACHE_SIZE users.
+
+WORLD_MAP_CACHE_SIZE = int(os.getenv("WORLD_MAP_CACHE_SIZE", "1024"))
+WORLD_MAP_MAX_NODES = int(os.getenv("WORLD_MAP_MAX_NODES", "20000"))
+QUEST_XP_MAX = int(os.getenv("QUEST_XP_MAX", "200"))
+
+# Status bytes are part of the stored format
+LOCKED, UNLOCKED, COMPLETED = 0, 1, 2
+STATUS_NAMES = ("locked", "unlocked", "completed")
+
+# Axial neighbour offsets, in ring-walking order
+HEX_DIRECTIONS = ((1, 0), (1, -1), (0, -1), (-1, 0), (-1, 1), (0, 1))
+
+# Computed per node, never stored with the quest
+DERIVED_FIELDS = ("coordinates", "status")
+
+
+def quest_xp(quest: Dict) -> int:
+    """The quest's xp reward as an int in [0, QUEST_XP_MAX]"""
+    xp = (quest.get("rewards") or {}).get("xp")
+    if isinstance(xp, bool) or not isinstance(xp, (int, float)) or xp != xp:
+        return 0
+    return min(max(int(xp), 0), QUEST_XP_MAX)
+
+
+def _insert_reward(db):
+    """INSERT ... ON CONFLICT DO NOTHING; rowcount 0 means already paid"""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(QuestReward).on_conflict_do_nothing()
+
+
+def spiral(count: int) -> Iterator[Tuple[int, int]]:
+    """The first `count` axial coordinates of the spiral: centre, then each ring from its west-south-west corner"""
+    if count <= 0:
+        return
+    yield (0, 0)
+    produced, radius = 1, 1
+    while True:
+        q, r = -radius, radius  # HEX_DIRECTIONS[4] * radius
+        for dq, dr in HEX_DIRECTIONS:
+            for _ in range(radius):
+                yield (q, r)
+                produced += 1
+                if produced == count:
+                    return
+                q, r = q + dq, r + dr
+        radius += 1
+
+
+class HexLayout:
+    """Coordinates, coordinate index and neighbour lists for an n-node spiral"""
+
+    __slots__ = ("coords", "index", "neighbours")
+
+    def __init__(self, count: int):
+        self.coords: List[Tuple[int, int]] = list(spiral(count))
+        self.index: Dict[Tuple[int, int], int] = {coord: i for i, coord in enumerate(self.coords)}
+        index = self.index
+        self.neighbours: List[Tuple[int, ...]] = [
+            tuple(index[n] for n in ((q + dq, r + dr) for dq, dr in HEX_DIRECTIONS) if n in index)
+            for q, r in self.coords
+        ]
+
+    def at(self, q: int, r: int) -> Optional[int]:
+        return self.index.get((q, r))
+
+
+@lru_cache(maxsize=64)
+def layout(count: int) -> HexLayout:
+    return HexLayout(count)
+
+
+class WorldMap:
+    """One user's map: quest definitions in spiral order plus a status byte each"""
+
+    __slots__ = ("nodes", "status", "source", "layout", "ids", "lock", "retired")
+
+    def __init__(self, nodes: List[Dict], status: bytearray, source: Optional[str] = None):
+        self.nodes = nodes
+        self.status = status
+        self.source = source or ""  # maps stored before sources were kept share ""
+        self.layout = layout(len(nodes))
+        self.ids: Dict[str, int] = {node["id"]: i for i, node in enumerate(nodes)}
+        self.lock = asyncio.Lock()  # orders status writes
+        self.retired = False  # replaced by a newer map; stop persisting
+
+    @classmethod
+    def build(cls, quests: List[Dict], source: Optional[str] = None) -> "WorldMap":
+        """Lay out fresh quests: easiest at the centre and unlocked, everything else locked"""
+        nodes, seen = [], set()
+        for i, quest in enumerate(sorted(quests, key=lambda quest: float(quest.get("difficulty") or 0))):
+            node = {key: value for key, value in quest.items() if key not in DERIVED_FIELDS}
+            node_id = str(node.get("id") or f"q_{i}")
+            if node_id in seen:
+                node_id = f"{node_id}_{i}"  # the model repeats ids now and then
+            seen.add(node_id)
+            node["id"] = node_id
+            node["rewards"] = {**(node.get("rewards") or {}), "xp": quest_xp(node)}
+            nodes.append(node)
+        status = bytearray(len(nodes))
+        if nodes:
+            status[0] = UNLOCKED
+        return cls(nodes, status, source)
+
+    def node(self, i: int) -> Dict:
+        q, r = self.layout.coords[i]
+        return {**self.nodes[i], "coordinates": {"q": q, "r": r}, "status": STATUS_NAMES[self.status[i]]}
+
+    def to_list(self) -> List[Dict]:
+        return [self.node(i) for i in range(len(self.nodes))]
+
+    def state(self, node_id: str) -> Optional[str]:
+        i = self.ids.get(node_id)
+        return None if i is None else STATUS_NAMES[self.status[i]]
+
+    def complete(self, node_id: str) -> Optional[List[int]]:
+        """
+        Mark an unlocked node completed and unlock its locked neighbours.
+        Returns the newly unlocked node positions, or None if the node was not
+        unlocked (locked, or already completed). Raises KeyError for an unknown id.
+        """
+        i = self.ids[node_id]
+        if self.status[i] != UNLOCKED:
+            return None
+        self.status[i] = COMPLETED
+        unlocked = []
+        for j in self.layout.neighbours[i]:
+            if self.status[j] == LOCKED:
+                self.status[j] = UNLOCKED
+                unlocked.append(j)
+        return unlocked
+
+    def encode(self) -> Tuple[bytes, bytes]:
+        return dumps_bytes(self.nodes), bytes(self.status)
+
+    @classmethod
+    def decode(cls, nodes: bytes, status: bytes, source: Optional[str] = None) -> "WorldMap":
+        nodes = loads(nodes)
+        status = bytearray(status or b"")
+        if len(status) != len(nodes):
+            # Truncated or foreign row: keep the quests, restart progress
+            log.warning("world_map_status_mismatch", nodes=len(nodes), status=len(status))
+            status = bytearray(len(nodes))
+            if nodes:
+                status[0] = UNLOCKED
+        return cls(nodes, status, source)
+
+
+class WorldMaps:
+    """Loaded maps by username (LRU) in front of the world_maps table"""
+
+    def __init__(self, cache_size: int = WORLD_MAP_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.maps: "OrderedDict[str, WorldMap]" = OrderedDict()
+        self.hits = 0
+        self.loads = 0
+        self.builds = 0
+        self.completions = 0
+        self.unlocks = 0
+        self.rewards_paid = 0
+        self.rewards_repeated = 0
+
+    def _remember(self, username: str, world: WorldMap):
+        self.maps[username] = world
+        self.maps.move_to_end(username)
+        while len(self.maps) > self.cache_size:
+            self.maps.popitem(last=False)
+
+    async def get(self, db, username: str) -> Optional[WorldMap]:
+        world = self.maps.get(username)
+        if world is not None:
+            self.maps.move_to_end(username)
+            self.hits += 1
+            return world
+        row = (await db.execute(
+            select(UserWorldMap.nodes, UserWorldMap.status, UserWorldMap.source).where(UserWorldMap.username == username)
+        )).first()
+        if row is None:
+            return None
+        world = self.maps.get(username)  # loaded by a concurrent request meanwhile
+        if world is None:
+            world = WorldMap.decode(row.nodes, row.status, row.source)
+            self._remember(username, world)
+            self.loads += 1
+        return world
+
+    async def replace(self, db, username: str, quests: List[Dict], source: Optional[str] = None) -> WorldMap:
+        """A new upload (content key `source`) replaces the user's map and its progress"""
+        if len(quests) > WORLD_MAP_MAX_NODES:
+            quests = quests[:WORLD_MAP_MAX_NODES]
+        world = WorldMap.build(quests, source)
+        nodes, status = world.encode()
+        old = self.maps.get(username)
+        if old is not None:
+            # An in-flight completion on the old map must not overwrite the new row
+            old.retired = True
+            await old.lock.acquire()
+        try:
+            if await db.get(UserWorldMap, username) is None:
+                db.add(UserWorldMap(username=username, nodes=nodes, status=status, source=world.source))
+            else:
+                await db.execute(
+                    update(UserWorldMap)
+                    .where(UserWorldMap.username == username)
+                    .values(nodes=nodes, status=status, source=world.source)
+                )
+            await db.commit()
+        finally:
+            if old is not None:
+                old.lock.release()
+        self._remember(username, world)
+        self.builds += 1
+        log.info("world_map_built", username=username, nodes=len(world.nodes), rings=_rings(len(world.nodes)))
+        return world
+
+    async def complete(self, db, world: WorldMap, username: str, node_id: str) -> Optional[List[int]]:
+        """WorldMap.complete, then persist the status bytes if anything changed"""
+        unlocked = world.complete(node_id)
+        if unlocked is None:
+            return None
+        self.completions += 1
+        self.unlocks += len(unlocked)
+        async with world.lock:
+            if world.retired:
+                return unlocked
+            # Snapshot under the lock: whichever write lands last carries the newest state
+            await db.execute(
+                update(UserWorldMap).where(UserWorldMap.username == username).values(status=bytes(world.status))
+            )
+            await db.commit()
+        return unlocked
+
+    async def pay(self, db, world: WorldMap, username: str, node_id: str) -> int:
+        """XP for a node just completed, or 0 if this user was paid for its slot of this upload before"""
+        i = world.ids[node_id]
+        xp = quest_xp(world.nodes[i])
+        if not xp:
+            return 0
+        result = await db.execute(_insert_reward(db).values(username=username, source=world.source, slot=i))
+        await db.commit()
+        if not result.rowcount:
+            self.rewards_repeated += 1
+            return 0
+        self.rewards_paid += 1
+        return xp
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "cached_maps": len(self.maps),
+            "cache_hits": self.hits,
+            "loads": self.loads,
+            "builds": self.builds,
+            "completions": self.completions,
+            "unlocks": self.unlocks,
+            "rewards_paid": self.rewards_paid,
+            "rewards_repeated": self.rewards_repeated,
+            "layouts": layout.cache_info().currsize,
+        }
+
+
+def _rings(count: int) -> int:
+    """Outermost ring used by an n-node spiral"""
+    radius = 0
+    while 3 * radius * (radius + 1) + 1 < count:
+        radius += 1
+    return radius
+
+
+world_maps = WorldMaps()
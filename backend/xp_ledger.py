@@ -0,0 +1,377 @@
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import asyncio
+import fcntl
+import glob
+import os
+import time
+
+from sqlalchemy import bindparam, select, update
+
+from database import AsyncSessionLocal
+from models import User, XPLedgerCheckpoint
+from serialization import dumps, loads
+from instrumentation import observe, SIZE_BUCKETS
+from logging_setup import get_logger
+
+log = get_logger("synapse.xp")
+
+# Write-behind XP ledger. Combat, raids and summons call xp_ledger.award(), which
+#   1. appends [seq, username, delta, reason, ts] to the journal (one os.write, so it
+#      survives a process crash; fsynced when a segment is sealed, or on every
+#      award with XP_JOURNAL_FSYNC=1),
+#   2. adds the delta to an in-memory per-user sum.
+# Every XP_FLUSH_INTERVAL_S the sums are applied with one executemany
+# `UPDATE users SET xp = xp + :delta`, and the checkpoint row records the
+# highest seq applied, in the same transaction. The journal rotates into
+# segments at each flush. Segments are deleted once their flush commits. At
+# startup, entries above the checkpoint are replayed, so nothing is applied twice.
+# Lines written before timestamps were journaled ([seq, username, delta, reason])
+# replay with their segment's mtime. Only the last line of the last segment
+# can be a torn write; it is cut off. A bad line anywhere else stops recovery.
+#
+# Journal slots: each process locks (flock) its own slot, the first free one of
+# XP_JOURNAL_SLOTS: XP_JOURNAL_DIR itself, then XP_JOURNAL_DIR/worker-<n>. Each slot has its
+# own checkpoint row (id CHECKPOINT_ID + slot), so workers never replay or
+# checkpoint each other's entries. A restarted worker takes over a dead worker's
+# slot and replays it. The slot is claimed on the first award, so awards made
+# before start() are journaled too. start() then rebuilds pending from the journal.
+# seq keeps growing across restarts: a high-water file records the highest seq
+# handed out before each flush. A slot without one (new, or written by an older
+# version) starts from the clock in microseconds, above any counter-based checkpoint.
+#
+# Reads: select `applied_seq_column()` next to users.xp (this process's checkpoint) and add
+# `pending_delta(username, applied_seq)`. Whether the flush that is in flight
+# is already in the row is then decided per statement, so no award is
+# counted twice or missed. The last committed batch is kept (with its seq)
+# until the next flush starts: a read issued before that commit may only
+# get here after it.
+# Awards for usernames with no users row are dropped at flush time.
+#
+# Listeners (e.g. region_rollups) see every award, including replayed ones.
+# At flush they hand over their own batch (take), write it in the same
+# transaction (apply), and either commit it (committed) or merge it back (restore).
+
+XP_JOURNAL_DIR = os.getenv("XP_JOURNAL_DIR", "./xp_journal")
+XP_JOURNAL_FSYNC = os.getenv("XP_JOURNAL_FSYNC", "0") == "1"
+XP_FLUSH_INTERVAL_S = float(os.getenv("XP_FLUSH_INTERVAL_S", "1"))
+XP_FLUSH_MAX_USERS = int(os.getenv("XP_FLUSH_MAX_USERS", "2000"))
+XP_JOURNAL_SLOTS = int(os.getenv("XP_JOURNAL_SLOTS", "64"))
+
+CHECKPOINT_ID = 1  # slot 0; slot n uses CHECKPOINT_ID + n
+LOCK_FILE = ".lock"
+HIGH_WATER_FILE = "seq"
+
+_apply_xp = (
+    update(User.__table__)
+    .where(User.__table__.c.username == bindparam("b_username"))
+    .values(xp=User.__table__.c.xp + bindparam("b_delta"))
+)
+
+
+def applied_seq_column(checkpoint_id: Optional[int] = None):
+    """Scalar subquery to select alongside users.xp (same statement = same snapshot)"""
+    if checkpoint_id is None:
+        checkpoint_id = xp_ledger.checkpoint_id
+    return (
+        select(XPLedgerCheckpoint.applied_seq)
+        .where(XPLedgerCheckpoint.id == checkpoint_id)
+        .scalar_subquery()
+        .label("applied_seq")
+    )
+
+
+class XPLedger:
+    def __init__(self, journal_dir: str = XP_JOURNAL_DIR):
+        self.journal_dir = journal_dir
+        # Set when the slot is claimed
+        self.slot: Optional[int] = None
+        self.directory = journal_dir
+        self.checkpoint_id = CHECKPOINT_ID
+        self._lock_fd: Optional[int] = None
+        self.seq = 0
+        self.pending: Dict[str, int] = {}
+        # The batch being written: reads whose applied_seq is below inflight_seq still count it
+        self.inflight: Dict[str, int] = {}
+        self.inflight_seq = 0
+        # The last batch that committed, for reads whose applied_seq predates it
+        self.committed_batch: Dict[str, int] = {}
+        self.committed_seq = 0
+        self.awards = 0
+        self.flushed_awards = 0
+        self.flushes = 0
+        self._pending_awards = 0
+        self._inflight_awards = 0
+        self._segment = 0
+        self._fd: Optional[int] = None
+        self._sealed: List[str] = []
+        # Flushing waits until start() has read the checkpoint and replayed the journal
+        self._started = False
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self.listeners: List = []
+
+    # --- Journal ---
+
+    def _slot_directory(self, slot: int) -> str:
+        return self.journal_dir if slot == 0 else os.path.join(self.journal_dir, f"worker-{slot}")
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{number:010d}.log")
+
+    def _segment_paths(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "*.log")))
+
+    def _open_segment(self):
+        self._segment += 1
+        self._fd = os.open(self._segment_path(self._segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _seal_segment(self):
+        """Close the current segment (fsynced) and start a new one"""
+        self._write_high_water()
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._sealed.append(self._segment_path(self._segment))
+        self._open_segment()
+
+    def _read_high_water(self) -> Optional[int]:
+        try:
+            with open(os.path.join(self.directory, HIGH_WATER_FILE), "rb") as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_high_water(self):
+        path = os.path.join(self.directory, HIGH_WATER_FILE)
+        with open(path + ".tmp", "wb") as f:
+            f.write(str(self.seq).encode("ascii"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _claim(self):
+        """Lock the first free journal slot and continue its seq; no-op once claimed"""
+        if self._lock_fd is not None:
+            return
+        for slot in range(XP_JOURNAL_SLOTS):
+            directory = self._slot_directory(slot)
+            os.makedirs(directory, exist_ok=True)
+            fd = os.open(os.path.join(directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)  # another live process owns this slot
+                continue
+            self._lock_fd, self.slot, self.directory = fd, slot, directory
+            self.checkpoint_id = CHECKPOINT_ID + slot
+            break
+        else:
+            raise RuntimeError(f"All {XP_JOURNAL_SLOTS} XP journal slots under {self.journal_dir} are in use")
+
+        paths = self._segment_paths()
+        high_water = self._read_high_water()
+        self.seq = time.time_ns() // 1000 if high_water is None else high_water
+        for seq, _username, _delta, _ts in self._entries(paths):
+            self.seq = max(self.seq, seq)
+        if high_water is None:
+            self._write_high_water()
+        self._segment = max([int(os.path.basename(path).split(".")[0]) for path in paths] or [0])
+        self._open_segment()
+        log.info("xp_journal_claimed", slot=slot, segments=len(paths))
+
+    def _close(self):
+        """Close the journal and release the slot (no flush)"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)  # drops the flock
+            self._lock_fd = None
+        self._started = False
+
+    def _entries(self, paths: List[str]) -> Iterator[Tuple[int, str, int, int]]:
+        """(seq, username, delta, ts) per journal line, oldest segment first"""
+        for i, path in enumerate(paths):
+            mtime = int(os.path.getmtime(path))
+            with open(path, "rb") as f:
+                lines = f.readlines()
+            offset = 0
+            for number, line in enumerate(lines, 1):
+                try:
+                    seq, username, delta, *rest = loads(line)
+                    ts = int(rest[1]) if len(rest) > 1 else mtime
+                except (ValueError, TypeError) as e:
+                    if i == len(paths) - 1 and number == len(lines):
+                        # Torn final write; truncated so it stays the only bad line ever skipped
+                        os.truncate(path, offset)
+                        log.warning("xp_journal_torn_write", path=path, bytes=len(line))
+                        break
+                    raise ValueError(f"Corrupt XP journal entry at {path}:{number}") from e
+                offset += len(line)
+                yield seq, username, delta, ts
+
+    def recover(self, applied_seq: int) -> int:
+        """Rebuild pending from the journal entries newer than the checkpoint; returns how many"""
+        self._claim()
+        self.pending, self._pending_awards = {}, 0
+        for listener in self.listeners:
+            listener.reset()
+        replayed = 0
+        paths = self._segment_paths()
+        for seq, username, delta, ts in self._entries(paths):
+            if seq > applied_seq:
+                self._add(username, delta, ts)
+                replayed += 1
+        self.seq = max(self.seq, applied_seq)
+        # Replayed entries stay in their segments until the next flush covers them
+        current = self._segment_path(self._segment)
+        self._sealed = [path for path in paths if path != current]
+        if replayed:
+            log.info("xp_journal_replayed", entries=replayed, segments=len(paths), slot=self.slot)
+        return replayed
+
+    # --- Awards ---
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _add(self, username: str, delta: int, ts: int):
+        self.pending[username] = self.pending.get(username, 0) + delta
+        self._pending_awards += 1
+        for listener in self.listeners:
+            listener.record(username, delta, ts)
+
+    def award(self, username: str, delta: int, reason: str = "", ts: Optional[int] = None):
+        """Credit (or debit) XP; durable once this returns, visible to reads immediately"""
+        if not username or not delta:
+            return
+        delta = int(delta)
+        ts = int(time.time()) if ts is None else int(ts)
+        if self._fd is None:
+            self._claim()
+        self.seq += 1
+        os.write(self._fd, (dumps([self.seq, username, delta, reason, ts]) + "\n").encode("utf-8"))
+        if XP_JOURNAL_FSYNC:
+            os.fsync(self._fd)
+        self._add(username, delta, ts)
+        self.awards += 1
+        if len(self.pending) >= XP_FLUSH_MAX_USERS:
+            self._spawn_flush()
+
+    # --- Reads ---
+
+    def pending_delta(self, username: str, applied_seq: Optional[int]) -> int:
+        """XP not yet in a users row that was read together with `applied_seq`"""
+        delta = self.pending.get(username, 0)
+        if self.inflight and (applied_seq or 0) < self.inflight_seq:
+            delta += self.inflight.get(username, 0)
+        if self.committed_batch and (applied_seq or 0) < self.committed_seq:
+            delta += self.committed_batch.get(username, 0)
+        return delta
+
+    def pending_users(self) -> Set[str]:
+        return set(self.pending) | set(self.inflight) | set(self.committed_batch)
+
+    def has_debits(self) -> bool:
+        """Whether any pending delta is negative (a flushed top-N may then not be the final top-N)"""
+        return any(d < 0 for batch in (self.pending, self.inflight, self.committed_batch) for d in batch.values())
+
+    # --- Batched writes ---
+
+    def _spawn_flush(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            return  # One early flush at a time; it takes everything pending when it runs
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+        except RuntimeError:
+            pass  # No loop (scripts); the next periodic flush picks them up
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self.pending or not self._started:
+                return 0  # Nothing to do, or start() hasn't recovered the journal yet
+            self._seal_segment()
+            batch, self.pending = self.pending, {}
+            self.inflight, self.inflight_seq = batch, self.seq
+            self.committed_batch, self.committed_seq = {}, 0
+            awards, self._inflight_awards, self._pending_awards = self._pending_awards, self._pending_awards, 0
+            params = [{"b_username": username, "b_delta": delta} for username, delta in batch.items() if delta]
+            taken = [listener.take() for listener in self.listeners]
+            try:
+                async with AsyncSessionLocal() as db:
+                    if params:
+                        await db.execute(_apply_xp, params)
+                    for listener, listener_batch in zip(self.listeners, taken):
+                        await listener.apply(db, listener_batch)
+                    await db.execute(
+                        update(XPLedgerCheckpoint)
+                        .where(XPLedgerCheckpoint.id == self.checkpoint_id)
+                        .values(applied_seq=self.inflight_seq)
+                    )
+                    await db.commit()
+            except Exception as e:
+                # Merge back; the sealed segments stay on disk until a flush succeeds
+                for username, delta in batch.items():
+                    self.pending[username] = self.pending.get(username, 0) + delta
+                self._pending_awards += awards
+                self.inflight, self._inflight_awards = {}, 0
+                for listener, listener_batch in zip(self.listeners, taken):
+                    listener.restore(listener_batch)
+                log.warning("xp_flush_failed", users=len(batch), error=str(e))
+                return 0
+            self.committed_batch, self.committed_seq = batch, self.inflight_seq
+            self.inflight, self._inflight_awards = {}, 0
+            for listener in self.listeners:
+                listener.committed()
+            sealed, self._sealed = self._sealed, []
+            for path in sealed:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.flushes += 1
+            self.flushed_awards += awards
+            observe("synapse_xp_flush_users", len(batch), (), SIZE_BUCKETS)
+            return len(batch)
+
+    async def start(self):
+        """Claim a journal slot, ensure its checkpoint row exists, replay the journal, start periodic flushing"""
+        self._claim()
+        async with AsyncSessionLocal() as db:
+            checkpoint = await db.get(XPLedgerCheckpoint, self.checkpoint_id)
+            if checkpoint is None:
+                checkpoint = XPLedgerCheckpoint(id=self.checkpoint_id, applied_seq=0)
+                db.add(checkpoint)
+                await db.commit()
+            applied_seq = checkpoint.applied_seq or 0
+        self.committed_batch, self.committed_seq = {}, 0
+        # Awards made before start() are in the journal and come back with the rest
+        self.recover(applied_seq)
+        self._started = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(XP_FLUSH_INTERVAL_S)
+            await self.flush()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        self._close()
+
+    def stats(self) -> Dict:
+        return {
+            "awards": self.awards,
+            "flushed_awards": self.flushed_awards,
+            "pending_awards": self._pending_awards + self._inflight_awards,
+            "pending_users": len(self.pending),
+            "flushes": self.flushes,
+        }
+
+
+xp_ledger = XPLedger()
@@ -31,6 +31,8 @@ const RaidArena = () => {
                 setRaidState(msg.data);
             } else if (msg.type === 'notification') {
                 addNotification(msg.message);
+            } else if (msg.type === 'ping') {
+                ws.current.send(JSON.stringify({ type: 'pong' }));
             }
         };
 